@@ -1,8 +1,14 @@
 from .account import Account
-from .aux_data_structures import MerkleTree
+from .aux_data_structures import CompactMerkleTree, MerkleTree
+from .block_store import BlockStore
 from .blockchain import Blockchain
+from .connection_pool import ConnectionPool
 from .key_master import KeyMaster
+from .mempool import Mempool
+from .metrics import MetricsRegistry, MetricsServer
+from .mining import MiningEngine
 from .network_manager import NetworkManager
 from .node import Node
 from .request_handler import RequestHandler
 from .transaction import Transaction
+from .wire_protocol import FrameReader, WireProtocol
@@ -1,4 +1,6 @@
-from .aux_data_structures import MerkleTree
+from typing import List
+
+from .aux_data_structures import CompactMerkleTree, MerkleTree
 from .helper_functions import get_logger
 from .transaction import Transaction
 
@@ -9,6 +11,7 @@ class Account:
     def __init__(self, address: str):
         self.address = address
         self._chain = None
+        self.balance_index = None
         logger.info('Account created')
      
     @property
@@ -39,6 +42,10 @@ class Account:
         return balance
 
     def get_balance(self) -> int:
+        if (self.balance_index is not None and 
+            self.balance_index.is_synced_with(self.chain)):
+            return self.balance_index.get_balance(self.address)
+        
         return self.get_balance_of(self.address, self.chain)
     
     def is_transaction_in_block(self, 
@@ -47,21 +54,60 @@ class Account:
                                 transaction: Transaction,
                                 proof_list: list) -> bool:
         
+        block = self._chain[block_index]
         transaction_hash = MerkleTree.get_single_hash(transaction.serialized)
         
         root = proof_list[-1].decode('utf-8')
-        block_root = self._chain[block_index].merkle_root
+        if root != block.merkle_root:
+            return False
         
-        return root == block_root and MerkleTree.validate_leaf_hash(transaction_hash, 
-                                                                   transaction_index, 
-                                                                   proof_list)
+        if block.has_merkle_tree:
+            return MerkleTree.validate_leaf_hash(transaction_hash, 
+                                                 transaction_index, 
+                                                 proof_list)
+        return CompactMerkleTree.validate_leaf_hash(transaction_hash, 
+                                                    transaction_index, 
+                                                    proof_list)
+    
+    def are_transactions_in_block(self, 
+                                  block_index: int,
+                                  transaction_indexes: List[int],
+                                  transactions: List[Transaction],
+                                  transaction_count: int,
+                                  proof_list: list) -> bool:
+        block = self._chain[block_index]
+        if (len(transaction_indexes) != len(transactions) or 
+            not proof_list or proof_list[-1].decode('utf-8') != block.merkle_root):
+            return False
+        
+        leaf_hashes = {idx: MerkleTree.get_single_hash(t.serialized) 
+                       for idx, t in zip(transaction_indexes, transactions)}
+        if block.has_merkle_tree:
+            return MerkleTree.validate_multiproof(leaf_hashes, 
+                                                  transaction_count, 
+                                                  proof_list)
+        return CompactMerkleTree.validate_multiproof(leaf_hashes, 
+                                                     transaction_count, 
+                                                     proof_list)
+    
+    def generate_transactions_in_block_proof(self, 
+                                             transaction_indexes: List[int], 
+                                             block_index: int) -> dict:
+        #  one proof for many transactions, shared siblings are sent once
+        block = self._chain[block_index]
+        transaction_indexes = sorted(set(transaction_indexes))
+        proof_list = block.get_merkle_multiproof_list(transaction_indexes)
+        return {'transactions': [block.transactions[idx] 
+                                 for idx in transaction_indexes],
+                'transaction_indexes': transaction_indexes,
+                'transaction_count': len(block.transactions),
+                'proof_list': proof_list}
     
     def generate_transaction_in_block_proof(self, 
                                             transaction_index: int, 
                                             block_index: int) -> dict:
         block = self._chain[block_index]
-        proof_list = MerkleTree.get_proof_list(block.merkle_tree, 
-                                               transaction_index)
+        proof_list = block.get_merkle_proof_list(transaction_index)
         return {'transaction': block.transactions[transaction_index],
                 'transaction_index': transaction_index,
                 'proof_list': proof_list}
@@ -1,5 +1,47 @@
+from collections import defaultdict
 from hashlib import sha256
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def collect_multiproof(level_sizes: List[int], indexes: Iterable[int],
+                       get_node: Callable[[int, int], bytes]) -> List[bytes]:
+    #  siblings not derivable from the proven leafs, level by level in 
+    #  index order, each one listed once however many leafs need it
+    proof = []
+    known = set(indexes)
+    for level, size in enumerate(level_sizes[:-1]):
+        for idx in sorted(known):
+            sibling = idx ^ 1
+            if sibling < size and sibling not in known:
+                proof.append(get_node(level, sibling))
+        known = {idx // 2 for idx in known}
+    return proof
+
+
+def fold_multiproof(nodes: Dict[int, bytes], leaf_count: int, 
+                    proof: Iterator[bytes], 
+                    hash_pair: Callable[[bytes, bytes], bytes]) -> Optional[bytes]:
+    count = leaf_count
+    while count > 1:
+        parents = {}
+        for idx in sorted(nodes):
+            if idx // 2 in parents:
+                continue
+            sibling = idx ^ 1
+            if sibling >= count:
+                sibling_hash = nodes[idx]
+            elif sibling in nodes:
+                sibling_hash = nodes[sibling]
+            else:
+                sibling_hash = next(proof, None)
+                if sibling_hash is None:
+                    return None
+            left, right = ((nodes[idx], sibling_hash) if idx % 2 == 0 
+                           else (sibling_hash, nodes[idx]))
+            parents[idx // 2] = hash_pair(left, right)
+        nodes = parents
+        count = (count + 1) // 2
+    return nodes.get(0)
 
 
 class MerkleTree:
@@ -38,13 +80,17 @@ class MerkleTree:
             
         return tree
     
+    @staticmethod
+    def hash_pair(left: bytes, right: bytes) -> bytes:
+        return sha256(left + right).hexdigest().encode('utf-8')
+    
     @staticmethod        
     def validate_leaf_hash(leaf_hash: str, 
                            leaf_index: int, proof_list: list) -> bool:
-        root = proof_list.pop()        
+        root = proof_list[-1]
         current_hash = leaf_hash
         idx = leaf_index
-        for i in range(len(proof_list)):
+        for i in range(len(proof_list) - 1):
             if idx % 2 == 0:
                 current_hash = sha256(current_hash + 
                                       proof_list[i]).hexdigest().encode('utf-8')
@@ -72,3 +118,286 @@ class MerkleTree:
             idx = idx // 2
             
         return [x.encode('utf-8') for x in proof_list]
+    
+    @staticmethod
+    def get_multiproof_list(tree: List[list], indexes: Iterable[int]) -> list:
+        proof_list = collect_multiproof([len(level) for level in tree], indexes,
+                                        lambda level, idx: tree[level][idx])
+        return [x.encode('utf-8') for x in proof_list + [tree[-1][0]]]
+    
+    @staticmethod
+    def validate_multiproof(leaf_hashes: Dict[int, bytes], leaf_count: int,
+                            proof_list: list) -> bool:
+        if not leaf_hashes or not proof_list:
+            return False
+        proof = iter(proof_list[:-1])
+        root = fold_multiproof(dict(leaf_hashes), leaf_count, proof, 
+                               MerkleTree.hash_pair)
+        return root == proof_list[-1] and next(proof, None) is None
+
+
+class CompactMerkleTree:
+    #  raw 32 byte digests, each level packed into one bytearray. an odd
+    #  node out is paired with itself, like in MerkleTree
+    digest_size = 32
+    
+    def __init__(self, leaf_digests: Iterable[bytes]=()):
+        self.levels = [bytearray(b''.join(leaf_digests))]
+        self._build()
+        
+    def __len__(self) -> int:
+        return len(self.levels[0]) // self.digest_size
+    
+    @staticmethod
+    def hash_pair(level: bytearray, i: int) -> bytes:
+        size = CompactMerkleTree.digest_size
+        left = level[i * size: (i + 1) * size]
+        right = level[(i + 1) * size: (i + 2) * size] or left
+        return sha256(left + right).digest()
+    
+    @staticmethod
+    def next_level(level: bytearray) -> bytearray:
+        count = len(level) // CompactMerkleTree.digest_size
+        return bytearray(b''.join(CompactMerkleTree.hash_pair(level, i) 
+                                  for i in range(0, count, 2)))
+    
+    def _build(self):
+        del self.levels[1:]
+        while len(self.levels[-1]) > self.digest_size:
+            self.levels.append(self.next_level(self.levels[-1]))
+        
+    def append(self, leaf_digest: bytes):
+        #  only the right edge of each level changes, O(log n) hashes
+        size = self.digest_size
+        self.levels[0] += leaf_digest
+        level_idx = 0
+        while len(self.levels[level_idx]) > size:
+            level = self.levels[level_idx]
+            parent_idx = (len(level) // size - 1) // 2
+            if level_idx + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            parent_level = self.levels[level_idx + 1]
+            parent_level[parent_idx * size: (parent_idx + 1) * size] = \
+                self.hash_pair(level, 2 * parent_idx)
+            level_idx += 1
+            
+    @property
+    def root(self) -> Optional[bytes]:
+        if len(self) == 0:
+            return None
+        return bytes(self.levels[-1][:self.digest_size])
+    
+    @staticmethod
+    def compute_root(leaf_digests: List[bytes]) -> Optional[bytes]:
+        #  keeps only the level being hashed instead of the whole tree
+        if len(leaf_digests) == 0:
+            return None
+        level = bytearray(b''.join(leaf_digests))
+        while len(level) > CompactMerkleTree.digest_size:
+            level = CompactMerkleTree.next_level(level)
+        return bytes(level)
+    
+    def get_proof(self, idx: int) -> List[bytes]:
+        size = self.digest_size
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = idx + 1 if idx % 2 == 0 else idx - 1
+            if sibling * size >= len(level):
+                sibling = idx
+            proof.append(bytes(level[sibling * size: (sibling + 1) * size]))
+            idx //= 2
+        return proof
+    
+    @staticmethod
+    def verify_proof(leaf_digest: bytes, idx: int, proof: List[bytes], 
+                     root: bytes) -> bool:
+        current = leaf_digest
+        for sibling in proof:
+            if idx % 2 == 0:
+                current = sha256(current + sibling).digest()
+            else:
+                current = sha256(sibling + current).digest()
+            idx //= 2
+        return current == root
+    
+    def get_proof_list(self, idx: int) -> List[bytes]:
+        #  same shape as MerkleTree.get_proof_list, hex siblings then the root
+        return [d.hex().encode('utf-8') for d in self.get_proof(idx) + [self.root]]
+    
+    @staticmethod
+    def validate_leaf_hash(leaf_hash: bytes, leaf_index: int, 
+                           proof_list: list) -> bool:
+        try:
+            digests = [bytes.fromhex(h.decode('utf-8')) 
+                       for h in [leaf_hash] + proof_list]
+        except ValueError:
+            return False
+        return CompactMerkleTree.verify_proof(digests[0], leaf_index, 
+                                              digests[1:-1], digests[-1])
+    
+    @staticmethod
+    def raw_hash_pair(left: bytes, right: bytes) -> bytes:
+        return sha256(left + right).digest()
+    
+    def get_multiproof(self, indexes: Iterable[int]) -> List[bytes]:
+        size = self.digest_size
+        return collect_multiproof(
+            [len(level) // size for level in self.levels], indexes,
+            lambda level, idx: bytes(self.levels[level][idx * size: 
+                                                        (idx + 1) * size]))
+    
+    @staticmethod
+    def verify_multiproof(leaf_digests: Dict[int, bytes], leaf_count: int,
+                          proof: List[bytes], root: bytes) -> bool:
+        if not leaf_digests:
+            return False
+        proof = iter(proof)
+        computed_root = fold_multiproof(dict(leaf_digests), leaf_count, proof,
+                                        CompactMerkleTree.raw_hash_pair)
+        return computed_root == root and next(proof, None) is None
+    
+    def get_multiproof_list(self, indexes: Iterable[int]) -> List[bytes]:
+        return [d.hex().encode('utf-8') 
+                for d in self.get_multiproof(indexes) + [self.root]]
+    
+    @staticmethod
+    def validate_multiproof(leaf_hashes: Dict[int, bytes], leaf_count: int,
+                            proof_list: list) -> bool:
+        if not proof_list:
+            return False
+        try:
+            leaf_digests = {idx: bytes.fromhex(h.decode('utf-8')) 
+                            for idx, h in leaf_hashes.items()}
+            digests = [bytes.fromhex(h.decode('utf-8')) for h in proof_list]
+        except ValueError:
+            return False
+        return CompactMerkleTree.verify_multiproof(leaf_digests, leaf_count,
+                                                   digests[:-1], digests[-1])
+
+
+class ChainIndex:
+    #  derived from a chain block by block, its height and tip tell how far.
+    #  an index behind the chain (a checkpoint) is replayed forward, one on
+    #  another branch is rebuilt
+    def reset(self):
+        self.height = 0
+        self.tip_hash = None
+        
+    def apply_block(self, block: 'Blockchain.Block'):
+        raise NotImplementedError
+        
+    def rebuild(self, chain: list):
+        self.reset()
+        for block in chain:
+            self.apply_block(block)
+            
+    def is_synced_with(self, chain: list) -> bool:
+        if self.height != len(chain):
+            return False
+        
+        return self.height == 0 or self.tip_hash == chain[-1].hashcode
+    
+    def is_ancestor_of(self, chain: list) -> bool:
+        if self.height > len(chain):
+            return False
+        return self.height == 0 or self.tip_hash == chain[self.height - 1].hashcode
+    
+    def sync(self, chain: list) -> int:
+        #  returns the number of blocks applied
+        if self.is_synced_with(chain):
+            return 0
+        if not self.is_ancestor_of(chain):
+            self.reset()
+        applied = len(chain) - self.height
+        for height in range(self.height, len(chain)):
+            self.apply_block(chain[height])
+        return applied
+    
+    
+class BalanceIndex(ChainIndex):
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        super().reset()
+        self.balances = {}
+        
+    @staticmethod
+    def get_block_deltas(block: 'Blockchain.Block') -> Dict[str, int]:
+        deltas = defaultdict(int)
+        for t in block.transactions:
+            deltas[t.sender] -= t.amount + t.fee
+            deltas[t.receiver] += t.amount
+            deltas[block.miner] += t.fee
+            
+        return deltas
+    
+    def _add_deltas(self, deltas: Dict[str, int], sign: int):
+        for address, delta in deltas.items():
+            balance = self.balances.get(address, 0) + sign * delta
+            if balance:
+                self.balances[address] = balance
+            else:
+                self.balances.pop(address, None)
+    
+    def apply_block(self, block: 'Blockchain.Block') -> Dict[str, int]:
+        deltas = self.get_block_deltas(block)
+        self._add_deltas(deltas, 1)
+        self.height += 1
+        self.tip_hash = block.hashcode
+        return deltas
+        
+    def revert_block(self, block: 'Blockchain.Block', previous_hash: str):
+        self.revert_deltas(self.get_block_deltas(block), previous_hash)
+        
+    def revert_deltas(self, deltas: Dict[str, int], previous_hash: str):
+        self._add_deltas(deltas, -1)
+        self.height -= 1
+        self.tip_hash = previous_hash
+        
+    def get_balance(self, address: str) -> int:
+        return self.balances.get(address, 0)
+    
+    def as_dict(self) -> dict:
+        return {'balances': self.balances,
+                'height': self.height,
+                'tip_hash': self.tip_hash}
+    
+    @classmethod
+    def from_dict(cls, obj: dict) -> 'BalanceIndex':
+        balance_index = cls()
+        balance_index.balances = obj['balances']
+        balance_index.height = obj['height']
+        balance_index.tip_hash = obj['tip_hash']
+        return balance_index
+    
+    
+class TransactionIndex(ChainIndex):
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        super().reset()
+        self.locations: Dict[str, Tuple[int, int]] = {}
+        
+    def apply_block(self, block: 'Blockchain.Block'):
+        for position, t in enumerate(block.transactions):
+            self.locations[t.txid] = (self.height, position)
+        self.height += 1
+        self.tip_hash = block.hashcode
+        
+    def revert_block(self, block: 'Blockchain.Block', previous_hash: str):
+        self.revert_txids([t.txid for t in block.transactions], previous_hash)
+        
+    def revert_txids(self, txids: List[str], previous_hash: str):
+        self.height -= 1
+        for txid in txids:
+            if self.locations.get(txid, (None,))[0] == self.height:
+                del self.locations[txid]
+        self.tip_hash = previous_hash
+        
+    def get_location(self, txid: str) -> Optional[Tuple[int, int]]:
+        return self.locations.get(txid)
+    
+    def __contains__(self, txid: str) -> bool:
+        return txid in self.locations
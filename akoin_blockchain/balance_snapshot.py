@@ -0,0 +1,121 @@
+import numpy as np
+
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .helper_functions import get_logger
+
+logger = get_logger(__name__)
+
+#  float64 bincount weights stay exact below this
+MAX_EXACT_FLOAT = 2 ** 53
+
+
+class TransactionColumns:
+    #  the chain's transactions flattened into one column per field,
+    #  addresses are replaced by dense integer ids
+    def __init__(self):
+        self.addresses: List[str] = []
+        self.address_ids: Dict[str, int] = {}
+        self.senders = array('q')
+        self.receivers = array('q')
+        self.amounts = array('q')
+        self.fees = array('q')
+        self.miners = array('q')
+        self.heights = array('q')
+        self.block_count = 0
+        self.tip_hash = None
+
+    def __len__(self) -> int:
+        return len(self.heights)
+
+    def get_address_id(self, address: str) -> int:
+        if address not in self.address_ids:
+            self.address_ids[address] = len(self.addresses)
+            self.addresses.append(address)
+        return self.address_ids[address]
+
+    def append_block(self, block: 'Blockchain.Block'):
+        miner = self.get_address_id(block.miner)
+        for t in block.transactions:
+            self.senders.append(self.get_address_id(t.sender))
+            self.receivers.append(self.get_address_id(t.receiver))
+            self.amounts.append(int(t.amount))
+            self.fees.append(int(t.fee))
+            self.miners.append(miner)
+            self.heights.append(self.block_count)
+        self.block_count += 1
+        self.tip_hash = block.hashcode
+
+    def sync(self, chain: list):
+        #  appends what was mined since the last sync, anything else rebuilds
+        if (self.block_count > len(chain) or
+            (self.block_count and
+             chain[self.block_count - 1].hashcode != self.tip_hash)):
+            logger.info('Transaction columns out of sync, rebuilding')
+            self.__init__()
+
+        for height in range(self.block_count, len(chain)):
+            self.append_block(chain[height])
+
+    def truncate(self, block_count: int, tip_hash: Optional[str]):
+        if block_count >= self.block_count:
+            return
+        
+        count = int(np.searchsorted(self.column('heights', len(self)), 
+                                    block_count, side='left'))
+        for name in ['senders', 'receivers', 'amounts', 'fees', 'miners', 
+                     'heights']:
+            del getattr(self, name)[count:]
+        self.block_count = block_count
+        self.tip_hash = tip_hash
+
+    @classmethod
+    def from_chain(cls, chain: list) -> 'TransactionColumns':
+        columns = cls()
+        columns.sync(chain)
+        return columns
+
+    def column(self, name: str, count: int) -> np.ndarray:
+        return np.frombuffer(getattr(self, name), dtype=np.int64)[:count]
+
+    @staticmethod
+    def sum_by_id(ids: np.ndarray, weights: np.ndarray, size: int) -> np.ndarray:
+        if np.abs(weights).sum() < MAX_EXACT_FLOAT:
+            return np.bincount(ids, weights=weights,
+                               minlength=size).astype(np.int64)
+
+        totals = np.zeros(size, dtype=np.int64)
+        np.add.at(totals, ids, weights)
+        return totals
+
+    def balances_at(self, height: Optional[int]=None) -> np.ndarray:
+        #  balance of every address id once block `height` is applied
+        if height is None:
+            height = self.block_count - 1
+        count = int(np.searchsorted(self.column('heights', len(self)),
+                                    height, side='right'))
+
+        size = len(self.addresses)
+        amounts = self.column('amounts', count)
+        fees = self.column('fees', count)
+        return (self.sum_by_id(self.column('receivers', count), amounts, size)
+                - self.sum_by_id(self.column('senders', count),
+                                 amounts + fees, size)
+                + self.sum_by_id(self.column('miners', count), fees, size))
+
+    def get_balances(self, height: Optional[int]=None) -> Dict[str, int]:
+        balances = self.balances_at(height)
+        return {self.addresses[i]: int(balances[i])
+                for i in np.flatnonzero(balances)}
+
+    def get_rich_list(self, n: int,
+                      height: Optional[int]=None) -> List[Tuple[str, int]]:
+        balances = self.balances_at(height)
+        n = min(n, len(balances))
+        if n == 0:
+            return []
+
+        top = np.argpartition(-balances, n - 1)[:n]
+        top = top[np.argsort(-balances[top], kind='stable')]
+        return [(self.addresses[i], int(balances[i])) for i in top]
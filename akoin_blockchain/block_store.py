@@ -0,0 +1,444 @@
+import json
+import mmap
+import os
+import struct
+
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple, Union
+
+from .aux_data_structures import ChainIndex, TransactionIndex
+from .blockchain import Blockchain
+from .helper_functions import get_logger
+
+from .constants import (BLOCK_STORE_SEGMENT_SIZE, BLOCK_STORE_CACHE_SIZE,
+                        HASH_INDEX_INITIAL_CAPACITY)
+
+logger = get_logger(__name__)
+
+
+class MappedFile:
+    def __init__(self, path: str, initial_size: int):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'r+b' if not is_new else 'w+b')
+        if is_new:
+            self.file.truncate(initial_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.is_new = is_new
+
+    def resize(self, size: int):
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class HeightIndex:
+    header = struct.Struct('!8sQ')  # magic, block count
+    record = struct.Struct('!IQI32s')  # segment, offset, length, hash
+    magic = b'AKNHGT01'
+
+    def __init__(self, path: str):
+        self.mapped = MappedFile(path, self.header.size +
+                                 1024 * self.record.size)
+        if self.mapped.is_new:
+            self.header.pack_into(self.mapped.map, 0, self.magic, 0)
+        elif self.header.unpack_from(self.mapped.map, 0)[0] != self.magic:
+            raise Exception(f'Not a height index: {path}')
+
+    def __len__(self) -> int:
+        return self.header.unpack_from(self.mapped.map, 0)[1]
+
+    def _position(self, height: int) -> int:
+        return self.header.size + height * self.record.size
+
+    def get(self, height: int) -> Tuple[int, int, int, bytes]:
+        return self.record.unpack_from(self.mapped.map, self._position(height))
+
+    def append(self, segment: int, offset: int, length: int, hashcode: bytes):
+        height = len(self)
+        position = self._position(height)
+        if position + self.record.size > len(self.mapped.map):
+            self.mapped.resize(2 * len(self.mapped.map))
+
+        self.record.pack_into(self.mapped.map, position,
+                              segment, offset, length, hashcode)
+        self.header.pack_into(self.mapped.map, 0, self.magic, height + 1)
+
+    def truncate(self, count: int):
+        self.header.pack_into(self.mapped.map, 0, self.magic,
+                              min(count, len(self)))
+
+
+class HashTable:
+    #  open addressing table keyed by 32 byte digests, linear probing. a
+    #  fixed size meta record sits between the header and the slots
+    header = struct.Struct('!8sQQ')  # magic, capacity, used slots
+    meta = struct.Struct('')
+    slot = struct.Struct('!32s')  # key, then the values
+    magic = b''
+    empty = bytes(32)
+    max_load = 0.6
+
+    def __init__(self, path: str,
+                 capacity: Optional[int]=HASH_INDEX_INITIAL_CAPACITY):
+        self.path = path
+        self.mapped = MappedFile(path, self.header.size + self.meta.size +
+                                 capacity * self.slot.size)
+        if self.mapped.is_new:
+            self.header.pack_into(self.mapped.map, 0, self.magic, capacity, 0)
+        elif self.header.unpack_from(self.mapped.map, 0)[0] != self.magic:
+            raise Exception(f'Not a {type(self).__name__}: {path}')
+
+    @property
+    def capacity(self) -> int:
+        return self.header.unpack_from(self.mapped.map, 0)[1]
+
+    @property
+    def used(self) -> int:
+        return self.header.unpack_from(self.mapped.map, 0)[2]
+
+    def _set_used(self, used: int):
+        self.header.pack_into(self.mapped.map, 0, self.magic,
+                              self.capacity, used)
+
+    def _position(self, idx: int) -> int:
+        return self.header.size + self.meta.size + idx * self.slot.size
+
+    def _home(self, key: bytes) -> int:
+        return int.from_bytes(key[:8], 'big') % self.capacity
+
+    def _key_at(self, idx: int) -> bytes:
+        position = self._position(idx)
+        return self.mapped.map[position: position + 32]
+
+    def _find_slot(self, key: bytes) -> Tuple[int, bool]:
+        capacity = self.capacity
+        idx = self._home(key)
+        while True:
+            slot_key = self._key_at(idx)
+            if slot_key == key:
+                return idx, True
+            if slot_key == self.empty:
+                return idx, False
+            idx = (idx + 1) % capacity
+
+    def _get(self, key: bytes) -> Optional[tuple]:
+        idx, found = self._find_slot(key)
+        if not found:
+            return None
+        return self.slot.unpack_from(self.mapped.map, self._position(idx))[1:]
+
+    def _set(self, key: bytes, *values):
+        idx, found = self._find_slot(key)
+        self.slot.pack_into(self.mapped.map, self._position(idx), key, *values)
+        if not found:
+            self._set_used(self.used + 1)
+            if self.used > self.max_load * self.capacity:
+                self._grow()
+
+    def _delete(self, key: bytes) -> bool:
+        #  backward shift, later slots of the probe run that may sit in the
+        #  freed one move up so no lookup stops short of them
+        idx, found = self._find_slot(key)
+        if not found:
+            return False
+
+        capacity = self.capacity
+        other = idx
+        while True:
+            other = (other + 1) % capacity
+            other_key = self._key_at(other)
+            if other_key == self.empty:
+                break
+            home = self._home(other_key)
+            if (other - home) % capacity >= (other - idx) % capacity:
+                position = self._position(idx)
+                other_position = self._position(other)
+                self.mapped.map[position: position + self.slot.size] = \
+                    self.mapped.map[other_position: 
+                                    other_position + self.slot.size]
+                idx = other
+
+        position = self._position(idx)
+        self.mapped.map[position: position + self.slot.size] = \
+            bytes(self.slot.size)
+        self._set_used(self.used - 1)
+        return True
+
+    def _entries(self) -> Iterator[tuple]:
+        for idx in range(self.capacity):
+            entry = self.slot.unpack_from(self.mapped.map, self._position(idx))
+            if entry[0] != self.empty:
+                yield entry
+
+    def _clear_slots(self):
+        start = self._position(0)
+        self.mapped.map[start:] = bytes(len(self.mapped.map) - start)
+        self._set_used(0)
+
+    def _grow(self):
+        entries = list(self._entries())
+        capacity = 2 * self.capacity
+        logger.info(f'Growing {type(self).__name__} to {capacity} slots')
+        self.mapped.resize(self._position(capacity))
+        self.header.pack_into(self.mapped.map, 0, self.magic, capacity, 0)
+        self._clear_slots()
+        for entry in entries:
+            self._set(*entry)
+
+    def close(self):
+        self.mapped.close()
+
+
+class HashIndex(HashTable):
+    #  block hash -> height, entries of blocks truncated away are left
+    #  behind and filtered out by the chain
+    slot = struct.Struct('!32sQ')  # hash, height
+    magic = b'AKNHSH01'
+
+    def get(self, hashcode: str, default: Optional[int]=None) -> Optional[int]:
+        try:
+            key = bytes.fromhex(hashcode)
+        except ValueError:
+            return default
+        
+        values = self._get(key)
+        return default if values is None else values[0]
+
+    def __setitem__(self, hashcode: str, height: int):
+        self._set(bytes.fromhex(hashcode), height)
+
+    def pop(self, hashcode: str, default: Optional[int]=None):
+        #  stale entries are harmless, see above
+        return default
+
+
+class TransactionLocations(HashTable):
+    #  txid -> (height, position), with the height and tip of the index
+    #  kept alongside so the table is a complete index on its own
+    meta = struct.Struct('!Q32s')  # height, tip hash
+    slot = struct.Struct('!32sQI')  # txid, height, position
+    magic = b'AKNTXL01'
+
+    @property
+    def height(self) -> int:
+        return self.meta.unpack_from(self.mapped.map, self.header.size)[0]
+
+    @property
+    def tip_hash(self) -> Optional[str]:
+        tip_hash = self.meta.unpack_from(self.mapped.map, self.header.size)[1]
+        return tip_hash.hex() if tip_hash != self.empty else None
+
+    def set_tip(self, height: int, tip_hash: Optional[str]):
+        self.meta.pack_into(self.mapped.map, self.header.size, height,
+                            bytes.fromhex(tip_hash) if tip_hash else self.empty)
+
+    def get(self, txid: str, default: Optional[Tuple[int, int]]=None
+            ) -> Optional[Tuple[int, int]]:
+        try:
+            key = bytes.fromhex(txid)
+        except ValueError:
+            return default
+
+        location = self._get(key)
+        return default if location is None else location
+
+    def __setitem__(self, txid: str, location: Tuple[int, int]):
+        self._set(bytes.fromhex(txid), *location)
+
+    def __delitem__(self, txid: str):
+        if not self._delete(bytes.fromhex(txid)):
+            raise KeyError(txid)
+
+    def __contains__(self, txid: str) -> bool:
+        return self.get(txid) is not None
+
+    def clear(self):
+        self._clear_slots()
+
+
+class StoredTransactionIndex(TransactionIndex):
+    #  written entry by entry as blocks are applied and reverted, so nothing
+    #  is dumped at checkpoints and the locations stay on disk
+    def __init__(self, path: str):
+        self.locations = TransactionLocations(path)
+
+    @property
+    def height(self) -> int:
+        return self.locations.height
+
+    @height.setter
+    def height(self, height: int):
+        self.locations.set_tip(height, self.locations.tip_hash)
+
+    @property
+    def tip_hash(self) -> Optional[str]:
+        return self.locations.tip_hash
+
+    @tip_hash.setter
+    def tip_hash(self, tip_hash: Optional[str]):
+        self.locations.set_tip(self.locations.height, tip_hash)
+
+    def reset(self):
+        ChainIndex.reset(self)
+        self.locations.clear()
+
+    def get_location(self, txid: str) -> Optional[Tuple[int, int]]:
+        #  a revert that was cut short can leave entries above the tip
+        location = self.locations.get(txid)
+        if location is None or location[0] >= self.height:
+            return None
+        return location
+
+    def __contains__(self, txid: str) -> bool:
+        return self.get_location(txid) is not None
+
+    def close(self):
+        self.locations.close()
+
+
+class BlockStore:
+    def __init__(self, directory: str,
+                 segment_size: Optional[int]=BLOCK_STORE_SEGMENT_SIZE,
+                 cache_size: Optional[int]=BLOCK_STORE_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.height_index = HeightIndex(os.path.join(directory, 'heights.idx'))
+        self.hash_index = HashIndex(os.path.join(directory, 'hashes.idx'))
+        self.transaction_index = StoredTransactionIndex(
+            os.path.join(directory, 'transactions.idx'))
+        self.segments = {}
+        self.segment = self._last_segment()
+        logger.info(f'Block store opened with {len(self)} blocks')
+
+    def __len__(self) -> int:
+        return len(self.height_index)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'blk{segment:05d}.dat')
+
+    def _last_segment(self) -> int:
+        segment = 0
+        while os.path.exists(self._segment_path(segment + 1)):
+            segment += 1
+        return segment
+
+    def _get_segment_file(self, segment: int):
+        if segment not in self.segments:
+            self.segments[segment] = open(self._segment_path(segment), 'a+b')
+        return self.segments[segment]
+
+    def append(self, block: Blockchain.Block):
+        data = json.dumps(block.as_dict()).encode('utf-8')
+        segment_file = self._get_segment_file(self.segment)
+        segment_file.seek(0, os.SEEK_END)
+        offset = segment_file.tell()
+        if offset > 0 and offset + len(data) > self.segment_size:
+            self.segment += 1
+            segment_file = self._get_segment_file(self.segment)
+            offset = 0
+
+        segment_file.write(data)
+        segment_file.flush()
+
+        height = len(self)
+        self.height_index.append(self.segment, offset, len(data),
+                                 bytes.fromhex(block.hashcode))
+        self.hash_index[block.hashcode] = height
+        self._cache(height, block)
+
+    def _cache(self, height: int, block: Blockchain.Block):
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get_block(self, height: int) -> Blockchain.Block:
+        if height in self.cache:
+            self.cache.move_to_end(height)
+            return self.cache[height]
+
+        segment, offset, length, _ = self.height_index.get(height)
+        data = os.pread(self._get_segment_file(segment).fileno(),
+                        length, offset)
+        block = Blockchain.Block.from_dict(json.loads(data))
+        self._cache(height, block)
+        return block
+
+    def get_hash(self, height: int) -> str:
+        return self.height_index.get(height)[3].hex()
+
+    def truncate(self, count: int):
+        #  segments stay append only, the truncated blocks become orphaned
+        self.height_index.truncate(count)
+        for height in [h for h in self.cache if h >= count]:
+            del self.cache[height]
+
+    def as_chain(self) -> 'StoredChain':
+        return StoredChain(self)
+    
+    def state_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.json')
+
+    def write_state(self, name: str, state: dict):
+        tmp_path = self.state_path(name) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path(name))
+
+    def read_state(self, name: str) -> Optional[dict]:
+        if not os.path.exists(self.state_path(name)):
+            return None
+        with open(self.state_path(name)) as f:
+            return json.load(f)
+
+    def close(self):
+        for segment_file in self.segments.values():
+            segment_file.close()
+        self.segments = {}
+        self.height_index.mapped.close()
+        self.hash_index.close()
+        self.transaction_index.close()
+
+
+class StoredChain:
+    #  list-like view of a block store, blocks are only read when accessed
+    def __init__(self, block_store: BlockStore):
+        self.block_store = block_store
+
+    def __len__(self) -> int:
+        return len(self.block_store)
+
+    def __getitem__(self, idx: Union[int, slice]
+                    ) -> Union[Blockchain.Block, List[Blockchain.Block]]:
+        if isinstance(idx, slice):
+            return [self.block_store.get_block(i)
+                    for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('chain index out of range')
+        return self.block_store.get_block(idx)
+
+    def __iter__(self) -> Iterator[Blockchain.Block]:
+        for i in range(len(self)):
+            yield self.block_store.get_block(i)
+
+    def append(self, block: Blockchain.Block):
+        self.block_store.append(block)
+
+    def pop(self) -> Blockchain.Block:
+        block = self[-1]
+        self.block_store.truncate(len(self) - 1)
+        return block
+
+    def truncate(self, count: int):
+        self.block_store.truncate(count)
@@ -0,0 +1,201 @@
+import heapq
+
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .aux_data_structures import CompactMerkleTree
+from .helper_functions import get_logger
+from .transaction import Transaction
+
+from .constants import (MAX_PACKAGE_DEPTH, MAX_PACKAGE_SIZE,
+                        MAX_FUNDING_CANDIDATES)
+
+logger = get_logger(__name__)
+
+
+class BlockTemplate:
+    #  transactions are picked by ancestor fee rate. one a sender can't
+    #  afford yet is scored as a package with the unconfirmed transactions
+    #  funding it, its fees summed over the package size. packages are
+    #  resolved once, in rounds that only draw on packages resolved in
+    #  earlier ones. a popped package is checked against the balances left by
+    #  the selections so far, and a transaction nothing funds is parked
+    #  until a selected transaction credits its sender enough
+    def __init__(self, get_balance: Callable[[str], int], max_size: int):
+        self.get_balance = get_balance
+        self.max_size = max_size
+        self.balances: Dict[str, int] = {}
+        self.parked: Dict[str, List[tuple]] = {}
+        self.funding: Dict[str, List[Transaction]] = {}
+        self.packages: Dict[str, List[Transaction]] = {}
+        self.selected: List[Transaction] = []
+        self.selected_txids: Set[str] = set()
+        self.merkle_tree = CompactMerkleTree()
+
+    def balance_of(self, address: str) -> int:
+        if address not in self.balances:
+            self.balances[address] = self.get_balance(address)
+        return self.balances[address]
+
+    def apply(self, balances: Dict[str, int], t: Transaction) -> bool:
+        #  simulates t on top of the template's balances
+        cost = t.amount + t.fee
+        balance = (balances[t.sender] if t.sender in balances
+                   else self.balance_of(t.sender))
+        if t.amount < 0 or t.fee < 0 or balance < cost:
+            return False
+        balances[t.sender] = balance - cost
+        balances[t.receiver] = (balances[t.receiver] if t.receiver in balances
+                                else self.balance_of(t.receiver)) + t.amount
+        return True
+
+    def is_affordable(self, package: List[Transaction]) -> bool:
+        balances = {}
+        return all(self.apply(balances, t) for t in package)
+
+    def get_funding_steps(self, sender: str) -> List[tuple]:
+        #  the highest fee resolved funders of sender merged one after the
+        #  other, a funder whose package doesn't fit is skipped. each step
+        #  is the simulated balances, package and txids so far
+        balances, package, txids = {}, [], set()
+        steps = [(balances, package, txids)]
+        for funder in self.funding.get(sender, []):
+            ancestors = self.packages.get(funder.txid)
+            if ancestors is None:
+                continue
+            ancestors = [a for a in ancestors if a.txid not in txids]
+            if len(package) + len(ancestors) >= MAX_PACKAGE_SIZE:
+                continue
+            trial_balances = dict(balances)
+            if all(self.apply(trial_balances, a) for a in ancestors):
+                balances, package = trial_balances, package + ancestors
+                txids = txids | {a.txid for a in ancestors}
+                steps.append((balances, package, txids))
+        return steps
+
+    def resolve_package(self, t: Transaction,
+                        steps: List[tuple]) -> Optional[List[Transaction]]:
+        #  the first step that affords t, before any that would include it
+        for balances, package, txids in steps:
+            if t.txid in txids:
+                return None
+            if self.apply(dict(balances), t):
+                return package + [t]
+        return None
+
+    def resolve_packages(self, transactions: List[Transaction]
+                         ) -> List[Transaction]:
+        #  returns the transactions left unresolved. the steps of a sender
+        #  are shared by all of its transactions within a round
+        unresolved = []
+        for t in transactions:
+            if self.apply({}, t):
+                self.packages[t.txid] = [t]
+            else:
+                unresolved.append(t)
+
+        for _ in range(MAX_PACKAGE_DEPTH):
+            resolved, steps = {}, {}
+            for t in unresolved:
+                if t.sender not in steps:
+                    steps[t.sender] = self.get_funding_steps(t.sender)
+                package = self.resolve_package(t, steps[t.sender])
+                if package is not None:
+                    resolved[t.txid] = package
+            if not resolved:
+                break
+            self.packages.update(resolved)
+            unresolved = [t for t in unresolved if t.txid not in resolved]
+        return unresolved
+
+    @staticmethod
+    def get_fee_rate(package: List[Transaction]) -> float:
+        return sum(t.fee for t in package) / len(package)
+
+    def get_remaining(self, t: Transaction) -> List[Transaction]:
+        return [a for a in self.packages[t.txid]
+                if a.txid not in self.selected_txids]
+
+    def push(self, queue: List[tuple], i: int, t: Transaction):
+        heapq.heappush(queue, (-self.get_fee_rate(self.packages[t.txid]),
+                               t.timestamp, i, t))
+
+    def park(self, i: int, t: Transaction):
+        if t.amount < 0 or t.fee < 0:
+            return
+        logger.debug(f'parking transaction: {t}')
+        heapq.heappush(self.parked.setdefault(t.sender, []),
+                       (t.amount + t.fee, i, t))
+
+    def release(self, queue: List[tuple], address: str):
+        #  parked transactions the credited balance now covers on their own
+        parked = self.parked.get(address)
+        while parked and parked[0][0] <= self.balance_of(address):
+            _, i, t = heapq.heappop(parked)
+            self.packages[t.txid] = [t]
+            self.push(queue, i, t)
+        if parked is not None and not parked:
+            del self.parked[address]
+
+    def select(self, t: Transaction):
+        self.apply(self.balances, t)
+        self.selected.append(t)
+        self.selected_txids.add(t.txid)
+        self.merkle_tree.append(bytes.fromhex(t.txid))
+
+    def build(self, transactions: Iterable[Transaction]) -> List[Transaction]:
+        transactions = list(transactions)
+        funding = {}
+        for t in transactions:
+            funding.setdefault(t.receiver, []).append(t)
+        self.funding = {receiver: heapq.nlargest(MAX_FUNDING_CANDIDATES,
+                                                 funders, key=lambda t: t.fee)
+                        for receiver, funders in funding.items()}
+
+        unresolved = {t.txid for t in self.resolve_packages(transactions)}
+        queue = []
+        for i, t in enumerate(transactions):
+            if t.txid in unresolved:
+                self.park(i, t)
+            else:
+                self.push(queue, i, t)
+
+        while queue and len(self.selected) < self.max_size:
+            fee_rate, timestamp, i, t = heapq.heappop(queue)
+            if t.txid in self.selected_txids:
+                continue
+            #  selections since the push may have taken part of the package
+            #  or spent the balances it relies on
+            package = self.get_remaining(t)
+            if not self.is_affordable(package):
+                if self.is_affordable([t]):
+                    self.packages[t.txid] = [t]
+                    self.push(queue, i, t)
+                else:
+                    self.park(i, t)
+                continue
+            if len(package) != len(self.packages[t.txid]):
+                self.packages[t.txid] = package
+                if -self.get_fee_rate(package) > fee_rate:
+                    self.push(queue, i, t)
+                    continue
+            if len(package) > self.max_size - len(self.selected):
+                continue
+
+            for member in package:
+                self.select(member)
+                self.release(queue, member.receiver)
+
+        logger.info(f'Block template built with {len(self.selected)} '
+                    f'transactions, {sum(map(len, self.parked.values()))} parked')
+        return self.selected
+
+    @property
+    def merkle_root(self) -> str:
+        root = self.merkle_tree.root
+        return root.hex() if root is not None else ''
+
+    @staticmethod
+    def build_from(transactions: Iterable[Transaction],
+                   get_balance: Callable[[str], int],
+                   max_size: int) -> List[Transaction]:
+        return BlockTemplate(get_balance, max_size).build(transactions)
@@ -1,17 +1,27 @@
 import hashlib
 import json
+import threading
 import time
 
+from collections import OrderedDict, defaultdict
+
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from .account import Account
-from .aux_data_structures import MerkleTree
+from .aux_data_structures import (BalanceIndex, CompactMerkleTree, MerkleTree,
+                                  TransactionIndex)
+from .balance_snapshot import TransactionColumns
+from .block_template import BlockTemplate
+from .chain_validation import ChainValidator
 from .helper_functions import get_logger
+from .mining import MiningCancelled, MiningEngine
 from .transaction import Transaction
 
 from .constants import (BLOCK_DIFFICULTY, MAX_BLOCK_TRANSACTIONS, 
-                        INITIAL_CURRENCY_SUPPLY, GENESIS_BLOCK_FEE)
+                        INITIAL_CURRENCY_SUPPLY, GENESIS_BLOCK_FEE,
+                        BLOCK_VERSION, LEGACY_BLOCK_VERSION,
+                        MERKLE_BLOCK_VERSION,
+                        BALANCE_CHECKPOINT_INTERVAL, MAX_UNDO_RECORDS)
 
 logger = get_logger(__name__)
 
@@ -20,17 +30,19 @@ class Blockchain:
     class Block:
         difficulty = BLOCK_DIFFICULTY
         max_size = MAX_BLOCK_TRANSACTIONS
+        version = LEGACY_BLOCK_VERSION  # blocks created before versioning
         
         def __init__(self, index: int, 
                      transactions: List[Transaction], 
                      previous_hash: str,
-                     miner: str):
+                     miner: str,
+                     mining_engine: Optional[MiningEngine]=None,
+                     merkle_root: Optional[str]=None):
             
+            self.version = BLOCK_VERSION
             self.index = index
             self.transactions = transactions
-            self.merkle_tree = MerkleTree.make_tree([t.serialized for t 
-                                                     in self.transactions])
-            self.merkle_root = self.merkle_tree[-1][0]
+            self.merkle_root = merkle_root or self.compute_merkle_root()
             self.timestamp = str(datetime.now())
             self.unix_timestamp = time.time()
             self.previous_hash = previous_hash
@@ -40,12 +52,32 @@ class Blockchain:
             if len(transactions) > 10:
                 raise Exception('Invalid block! (max transactions exeeded)')
                 
-            self.hashcode = self.proof_of_work()
+            self.hashcode = self.proof_of_work(mining_engine)
             logger.info(f'New Block created, hashcode: {self.hashcode}')
               
         def __str__(self) -> str:
             return json.dumps(self.as_object(), sort_keys=True)
         
+        def __eq__(self, other) -> bool:
+            if not isinstance(other, Blockchain.Block):
+                return NotImplemented
+            return self.hashcode == other.hashcode
+        
+        def __hash__(self) -> int:
+            return hash(self.hashcode)
+        
+        @property
+        def has_merkle_tree(self) -> bool:
+            return self.version < MERKLE_BLOCK_VERSION
+        
+        @property
+        def merkle_tree(self) -> List[list]:
+            #  only older block versions carry their hex tree, built lazily
+            if '_merkle_tree' not in self.__dict__:
+                self._merkle_tree = MerkleTree.make_tree([t.serialized for t 
+                                                          in self.transactions])
+            return self._merkle_tree
+        
         def as_object(self, with_hash: Optional[bool]=True) -> dict:
             serialized_transactions = [t.serialized for t in self.transactions]
             obj = {'index': self.index,
@@ -54,37 +86,316 @@ class Blockchain:
                    'previous_hash': self.previous_hash,
                    'nonce': self.nonce,
                    'miner': self.miner,
-                   'transactions': serialized_transactions,
-                   'merkle_tree': self.merkle_tree}
+                   'transactions': serialized_transactions}
+            if self.has_merkle_tree:
+                obj['merkle_tree'] = self.merkle_tree
+            else:
+                obj['merkle_root'] = self.merkle_root
             if with_hash:
                 obj['hashcode'] = self.hashcode
+            if self.version != LEGACY_BLOCK_VERSION:
+                obj['version'] = self.version
             
             return obj
         
+        def as_dict(self) -> dict:
+            return {'version': self.version,
+                    'index': self.index,
+                    'transactions': [t.as_dict() for t in self.transactions],
+                    'merkle_root': self.merkle_root,
+                    'timestamp': self.timestamp,
+                    'unix_timestamp': self.unix_timestamp,
+                    'previous_hash': self.previous_hash,
+                    'nonce': self.nonce,
+                    'miner': self.miner,
+                    'hashcode': self.hashcode}
+        
+        @classmethod
+        def from_dict(cls, obj: dict) -> 'Blockchain.Block':
+            #  rebuilds a mined block without mining it again
+            block = cls.__new__(cls)
+            for field in ['version', 'index', 'merkle_root', 'timestamp', 
+                          'unix_timestamp', 'previous_hash', 'nonce', 
+                          'miner', 'hashcode']:
+                setattr(block, field, obj[field])
+            block.transactions = [Transaction.from_dict(t) 
+                                  for t in obj['transactions']]
+            return block
+        
+        @classmethod
+        def from_header(cls, header: dict) -> 'Blockchain.Block':
+            #  a body-less block, enough to check a header's proof of work
+            block = cls.__new__(cls)
+            for field in ['version', 'index', 'merkle_root', 'timestamp', 
+                          'unix_timestamp', 'previous_hash', 'nonce', 
+                          'miner', 'hashcode']:
+                setattr(block, field, header[field])
+            block.transactions = None
+            return block
+        
+        def as_header(self) -> dict:
+            return {'version': self.version,
+                    'index': self.index,
+                    'previous_hash': self.previous_hash,
+                    'merkle_root': self.merkle_root,
+                    'timestamp': self.timestamp,
+                    'unix_timestamp': self.unix_timestamp,
+                    'miner': self.miner,
+                    'nonce': self.nonce,
+                    'hashcode': self.hashcode}
+        
         def as_json_pre_hash(self) -> str:
             return json.dumps(self.as_object(with_hash=False), sort_keys=True)
+        
+        def get_header_prefix(self) -> bytes:
+            #  everything the header hash covers except for the nonce,
+            #  transactions are covered through the merkle root
+            return '|'.join([str(self.version),
+                             str(self.index), 
+                             self.previous_hash, 
+                             self.merkle_root,
+                             self.timestamp, 
+                             repr(self.unix_timestamp),
+                             self.miner, 
+                             '']).encode()
     
         def compute_hash(self) -> str:
-            return hashlib.sha256(self.as_json_pre_hash().encode()).hexdigest()
+            if self.version == LEGACY_BLOCK_VERSION:
+                return hashlib.sha256(self.as_json_pre_hash().encode()).hexdigest()
+            
+            return hashlib.sha256(self.get_header_prefix() + 
+                                  str(self.nonce).encode()).hexdigest()
+        
+        def compute_merkle_root(self) -> str:
+            if self.has_merkle_tree:
+                return MerkleTree.make_tree([t.serialized for t 
+                                             in self.transactions])[-1][0]
+            
+            #  a transaction's txid is the sha256 of its serialization
+            root = CompactMerkleTree.compute_root([bytes.fromhex(t.txid) for t 
+                                                   in self.transactions])
+            return root.hex() if root is not None else ''
+        
+        def get_merkle_proof_list(self, transaction_index: int) -> list:
+            if self.has_merkle_tree:
+                return MerkleTree.get_proof_list(self.merkle_tree, 
+                                                 transaction_index)
+            
+            return self.get_compact_merkle_tree().get_proof_list(transaction_index)
+        
+        def get_merkle_multiproof_list(self, transaction_indexes: List[int]) -> list:
+            if self.has_merkle_tree:
+                return MerkleTree.get_multiproof_list(self.merkle_tree, 
+                                                      transaction_indexes)
+            
+            return self.get_compact_merkle_tree().get_multiproof_list(
+                transaction_indexes)
+        
+        def get_compact_merkle_tree(self) -> CompactMerkleTree:
+            return CompactMerkleTree(bytes.fromhex(t.txid) 
+                                     for t in self.transactions)
     
-        def proof_of_work(self) -> str:
-            computed_hash = self.compute_hash()
-            while not computed_hash.startswith('0' * self.difficulty):
-                self.nonce += 1
-                computed_hash = self.compute_hash()
+        def get_pow_template(self) -> Tuple[bytes, bytes]:
+            if self.version != LEGACY_BLOCK_VERSION:
+                return self.get_header_prefix(), b''
+            
+            #  the legacy pre hash json only changes at the nonce, so it is 
+            #  split around it once instead of being re-serialized per attempt
+            obj = self.as_object(with_hash=False)
+            obj['nonce'] = 0
+            json_block = json.dumps(obj, sort_keys=True)
+            marker = '"nonce": '
+            split_idx = json_block.index(marker + '0') + len(marker)
+            return (json_block[:split_idx].encode(), 
+                    json_block[split_idx + 1:].encode())
     
+        def proof_of_work(self, 
+                          mining_engine: Optional[MiningEngine]=None) -> str:
+            prefix, suffix = self.get_pow_template()
+            if mining_engine is None:
+                mining_engine = MiningEngine.get_default()
+                
+            result = mining_engine.mine(prefix, suffix, self.difficulty)
+            if result is None:
+                raise MiningCancelled('Mining cancelled')
+            
+            self.nonce, computed_hash = result
             return computed_hash
 
-    def __init__(self, public_key_string: str, with_genesis=True):
-        self.chain = []
-        self.chain_length = 0
+    def __init__(self, public_key_string: str, with_genesis=True, 
+                 mining_engine: Optional[MiningEngine]=None,
+                 block_store: Optional['BlockStore']=None):
+        self.mining_engine = mining_engine
         self.public_key_string = public_key_string
-        if with_genesis:
+        self.block_store = block_store
+        self.balance_index = BalanceIndex()
+        self.transaction_index = TransactionIndex()
+        self.transaction_columns = None  # built on first snapshot
+        self.undo_records = OrderedDict()
+        if block_store is None:
+            self.chain = []
+            self.block_heights = {}
+        else:
+            #  blocks are read from disk only when accessed
+            self.chain = block_store.as_chain()
+            self.block_heights = block_store.hash_index
+            balances = block_store.read_state('balances')
+            if balances is not None:
+                self.balance_index = BalanceIndex.from_dict(balances)
+            self.transaction_index = block_store.transaction_index
+                
+        self.chain_length = len(self.chain)
+        self._set_up()
+        if with_genesis and self.chain_length == 0:
             self.create_genesis_block()
+            
+    def _set_up(self):
+        #  held across every change to the chain and its indexes, reentrant
+        #  since a reorganization disconnects and appends under it
+        self._chain_lock = threading.RLock()
+        
+    def __getstate__(self) -> dict:
+        #  locks can't be copied, copies get their own
+        state = dict(self.__dict__)
+        state.pop('_chain_lock', None)
+        return state
+    
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._set_up()
+    
+    def is_block_valid(self, block: Block) -> bool:
+        return ChainValidator.is_block_valid(block, self.Block.difficulty,
+                                             self.Block.max_size)
+    
+    def is_header_valid(self, header: dict) -> bool:
+        if header.get('version', LEGACY_BLOCK_VERSION) == LEGACY_BLOCK_VERSION:
+            return True  # legacy hashes cover the body, checked once fetched
+        
+        computed_hash = self.Block.from_header(header).compute_hash()
+        return all([computed_hash.startswith('0' * self.Block.difficulty),
+                    computed_hash == header['hashcode']])
+    
+    def is_header_chain_valid(self, headers: List[dict]) -> bool:
+        fork_height = headers[0]['index']
+        if fork_height > len(self.chain):
+            return False
+        
+        previous_hash = self.chain[fork_height - 1].hashcode if fork_height else '0'
+        for i, header in enumerate(headers):
+            if any([header['index'] != fork_height + i,
+                    header['previous_hash'] != previous_hash,
+                    not self.is_header_valid(header)]):
+                logger.info(f'Invalid header found: {header}')
+                return False
+            previous_hash = header['hashcode']
+            
+        return True
+
+    def append_block(self, block: Block):
+        with self._chain_lock:
+            self.sync_balance_index()
+            self.sync_transaction_index()
+            self.chain.append(block)
+            self.chain_length += 1
+            self.add_undo_record(block, self.balance_index.apply_block(block))
+            self.transaction_index.apply_block(block)
+            self.block_heights[block.hashcode] = len(self.chain) - 1
+            if (self.block_store is not None and 
+                self.chain_length % BALANCE_CHECKPOINT_INTERVAL == 0):
+                self.save_state()
+            
+    def add_undo_record(self, block: Block, balance_deltas: Dict[str, int]):
+        self.undo_records[block.hashcode] = {
+            'balance_deltas': balance_deltas,
+            'txids': [t.txid for t in block.transactions]}
+        if len(self.undo_records) > MAX_UNDO_RECORDS:
+            self.undo_records.popitem(last=False)
+            
+    def get_undo_record(self, block: Block) -> dict:
+        undo_record = self.undo_records.pop(block.hashcode, None)
+        if undo_record is None:
+            undo_record = {'balance_deltas': BalanceIndex.get_block_deltas(block),
+                           'txids': [t.txid for t in block.transactions]}
+        return undo_record
+    
+    def disconnect_block(self) -> Block:
+        with self._chain_lock:
+            self.sync_balance_index()
+            self.sync_transaction_index()
+            block = self.chain.pop()
+            self.chain_length = len(self.chain)
+            previous_hash = self.chain[-1].hashcode if self.chain_length else None
+            
+            undo_record = self.get_undo_record(block)
+            self.balance_index.revert_deltas(undo_record['balance_deltas'], 
+                                             previous_hash)
+            self.transaction_index.revert_txids(undo_record['txids'], 
+                                                previous_hash)
+            self.block_heights.pop(block.hashcode, None)
+            if self.transaction_columns is not None:
+                self.transaction_columns.truncate(self.chain_length, 
+                                                  previous_hash)
+            return block
+    
+    def connect_block(self, block: Block):
+        self.append_block(block)
+        
+    def save_state(self):
+        if self.block_store is None:
+            return
+        with self._chain_lock:
+            self.sync_balance_index()
+            self.sync_transaction_index()
+            #  the transaction index is written to the store as it changes
+            self.block_store.write_state('balances', 
+                                         self.balance_index.as_dict())
+            
+    def close(self):
+        if self.block_store is not None:
+            self.save_state()
+            self.block_store.close()
+        
+    def sync_balance_index(self):
+        with self._chain_lock:
+            applied = self.balance_index.sync(self.chain)
+        if applied:
+            logger.info(f'Balance index synced, {applied} blocks applied')
+            
+    def get_balance_of(self, address: str) -> int:
+        self.sync_balance_index()
+        return self.balance_index.get_balance(address)
+    
+    def sync_transaction_index(self):
+        with self._chain_lock:
+            applied = self.transaction_index.sync(self.chain)
+        if applied:
+            logger.info(f'Transaction index synced, {applied} blocks applied')
+            
+    def get_transaction_location(self, txid: str) -> Optional[Tuple[int, int]]:
+        self.sync_transaction_index()
+        return self.transaction_index.get_location(txid)
+    
+    def get_transaction(self, txid: str) -> Optional[Transaction]:
+        location = self.get_transaction_location(txid)
+        if location is None:
+            return None
+        
+        height, position = location
+        return self.chain[height].transactions[position]
+    
+    def get_transaction_columns(self) -> TransactionColumns:
+        if self.transaction_columns is None:
+            self.transaction_columns = TransactionColumns()
+        self.transaction_columns.sync(self.chain)
+        return self.transaction_columns
+    
+    def get_balances_at(self, height: Optional[int]=None) -> Dict[str, int]:
+        return self.get_transaction_columns().get_balances(height)
     
-    def is_block_valid(self, block: Block) -> bool:        
-        return all([block.compute_hash().startswith('0' * self.Block.difficulty),
-                    len(block.transactions) <= self.Block.max_size])
+    def is_transaction_in_chain(self, txid: str) -> bool:
+        self.sync_transaction_index()
+        return txid in self.transaction_index
 
     def create_genesis_block(self):
         transaction = Transaction('0' * len(self.public_key_string), 
@@ -96,113 +407,227 @@ class Blockchain:
                         'previous_hash': '0',
                         'transactions': [transaction],
                         'miner': self.public_key_string,
+                        'mining_engine': self.mining_engine,
                         })
         
-        self.chain.append(block)
-        self.chain_length += 1
+        self.append_block(block)
         
         logger.info('Genesis block mined!')
  
-    def get_top_possible_transactions(self, 
-                                      sorted_transactions: 
-                                          List[Transaction]) -> List[Transaction]:
-        logger.debug(sorted_transactions)
-        if len(self.chain) == 0:
-            return sorted_transactions
-        
-        while True:
-            logger.debug('enter while loop')
-            possible_transactions = sorted_transactions[: self.Block.max_size]
-            balances = {}
-            bad_transactions = 0
-            
-            for t in possible_transactions:
-                if t.sender in balances:
-                    continue
-                
-                balances[t.sender] = Account.get_balance_of(t.sender, self.chain)
-            
-            for t in possible_transactions:
-                if t.receiver in balances:
-                    balances[t.receiver] += t.amount
-                balances[t.sender] -= t.amount + t.fee
-                
-                if balances[t.sender] < 0:
-                    balances[t.sender] += t.amount + t.fee
-                    sorted_transactions.remove(t)
-                    logger.debug(f'bad transaction: {t}')
-                    bad_transactions += 1
-                    
-            if bad_transactions == 0:
-                logger.info(f'Top valid transactions gathered: {possible_transactions}')
-                return possible_transactions
-                    
     def create_block_transactions(self, transactions: 
                                   List[Transaction]) -> List[Transaction]:
+        if len(self.chain) == 0:
+            return sorted(transactions, key=lambda t: t.fee, reverse=True)
         
-        sorted_transactions = sorted(transactions, 
-                                     key=lambda t: t.fee, 
-                                     reverse=True)
-        return self.get_top_possible_transactions(sorted_transactions)
+        return self.build_block_template(transactions).selected
+    
+    def build_block_template(self, transactions: 
+                             List[Transaction]) -> BlockTemplate:
+        self.sync_balance_index()
+        template = BlockTemplate(self.balance_index.get_balance, 
+                                 self.Block.max_size)
+        template.build(transactions)
+        return template
     
     def create_block(self, transactions: List[Transaction]) -> List[Transaction]:
         if len(transactions) == 0:
             return []
         
-        prev_hash = self.chain[-1].hashcode
-        transactions = self.create_block_transactions(transactions)
-        block_idx = len(self.chain)
+        with self._chain_lock:
+            prev_hash = self.chain[-1].hashcode
+            template = self.build_block_template(transactions)
+        transactions = template.selected
+        if len(transactions) == 0:
+            logger.info('No affordable transactions to mine')
+            return []
         
-        block = self.Block(**{
-                        'index': block_idx,
-                        'previous_hash': prev_hash,
-                        'transactions': transactions,
-                        'miner': self.public_key_string,
-                        })
+        block_idx = len(self.chain)
+        try:
+            block = self.Block(**{
+                            'index': block_idx,
+                            'previous_hash': prev_hash,
+                            'transactions': transactions,
+                            'miner': self.public_key_string,
+                            'mining_engine': self.mining_engine,
+                            'merkle_root': template.merkle_root,
+                            })
+        except MiningCancelled:
+            logger.info('Mining cancelled, block discarded')
+            return []
         
-        self.chain.append(block)
-        self.chain_length += 1
+        #  the tip is checked and the block appended in one step, so no
+        #  other block can land at its height in between
+        with self._chain_lock:
+            if self.chain[-1].hashcode != prev_hash:
+                logger.info('Chain tip changed while mining, block discarded')
+                return []
+            self.append_block(block)
         
         logger.info('New block mined!')
         
         return transactions
     
-    def is_chain_valid(self, chain: Optional[List[Block]]=None) -> bool:
+    def is_chain_valid(self, chain: Optional[List[Block]]=None,
+                       validate_first: Optional[bool]=False) -> bool:
         if chain is None:
             logger.warning('Got null chain object')
             chain = self.chain
-
+        
+        #  linkage is cheap and checked in order, the independent hash, 
+        #  merkle root and signature checks are farmed out afterwards
         previous_block = chain[0]
         for block in chain[1:]:
-            if block.previous_hash != previous_block.hashcode:
+            if (block.previous_hash != previous_block.hashcode or 
+                block.index != previous_block.index + 1):
                 logger.info('Bad block found!')
                 logger.debug(f'{block}')
                 return False
-            if not self.is_block_valid(block):
-                logger.info('Invalid block found!')
-                logger.debug(f'{block}')
-                return False
             previous_block = block
             
+        blocks = chain[:] if validate_first else chain[1:]
+        if not ChainValidator.validate_blocks(blocks, self.Block.difficulty,
+                                              self.Block.max_size):
+            logger.info('Invalid block found!')
+            return False
+            
         logger.debug('Chain validated')            
         return True
     
+    def get_block_by_hash(self, hashcode: str) -> Optional[Block]:
+        height = self.block_heights.get(hashcode)
+        if height is None or height >= len(self.chain):
+            return None
+        
+        block = self.chain[height]
+        return block if block.hashcode == hashcode else None
+    
+    def get_block_locator(self) -> List[str]:
+        #  dense near the tip, exponentially sparser towards genesis
+        locator = []
+        height = len(self.chain) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.chain[height].hashcode)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+            
+        locator.append(self.chain[0].hashcode)
+        return locator
+    
+    def find_locator_fork_height(self, locator: List[str]) -> int:
+        for hashcode in locator:
+            block = self.get_block_by_hash(hashcode)
+            if block is not None:
+                return self.block_heights[hashcode] + 1
+            
+        return 0
+    
+    def get_headers(self, locator: List[str], max_headers: int) -> List[dict]:
+        start = self.find_locator_fork_height(locator)
+        return [block.as_header() for block 
+                in self.chain[start: start + max_headers]]
+    
+    def get_blocks(self, hashes: List[str]) -> List[Block]:
+        blocks = [self.get_block_by_hash(h) for h in hashes]
+        return [block for block in blocks if block is not None]
+    
     def get_last_block(self) -> Block:
         return self.chain[-1]
     
-    def get_chain(self):
+    def get_chain(self) -> List[Block]:
+        if self.block_store is not None:
+            return self.chain[:]
         return self.chain
     
+    def find_fork_height(self, chain: List[Block]) -> int:
+        #  blocks are hash linked, so a shared block implies a shared prefix
+        low, high = 0, min(len(self.chain), len(chain))
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.chain[mid - 1].hashcode == chain[mid - 1].hashcode:
+                low = mid
+            else:
+                high = mid - 1
+                
+        return low
+    
     def replace_chain(self, chain: List[Block]) -> bool:
-        if len(chain) <= self.chain_length:
-            logger.info('chain rejected (too short)')
-            return False
-        
-        if not self.is_chain_valid(chain):
-            logger.info('chain rejected (invalid!)')
-            return False
-        
-        self.chain = chain
-        self.chain_length = len(chain)
-        logger.info('chain replaced!')
+        return self.reorganize_to(chain) is not None
+    
+    def reorganize_to(self, chain: List[Block]
+                      ) -> Optional[Tuple[List[Block], List[Block]]]:
+        with self._chain_lock:
+            if len(chain) <= self.chain_length:
+                logger.info('chain rejected (too short)')
+                return None
+            
+            #  the common prefix is ours and already validated, the peer's 
+            #  copy of it is dropped in favour of our own blocks
+            fork_height = self.find_fork_height(chain)
+            return self.reorganize(fork_height, chain[fork_height:])
+    
+    def extend_chain(self, fork_height: int, blocks: List[Block]) -> bool:
+        return self.reorganize(fork_height, blocks) is not None
+    
+    def reorganize(self, fork_height: int, blocks: List[Block]
+                   ) -> Optional[Tuple[List[Block], List[Block]]]:
+        #  our blocks below the fork height are already validated, 
+        #  so only the new ones are checked. returns the disconnected 
+        #  and the connected blocks
+        with self._chain_lock:
+            if fork_height + len(blocks) <= self.chain_length:
+                logger.info('blocks rejected (chain too short)')
+                return None
+            
+            anchor = self.chain[fork_height - 1: fork_height]
+            if not self.is_chain_valid(anchor + blocks, 
+                                       validate_first=not anchor):
+                logger.info('blocks rejected (invalid!)')
+                return None
+            
+            if not self.are_balances_valid(fork_height, blocks):
+                logger.info('blocks rejected (overspending!)')
+                return None
+            
+            logger.info(f'Switching to fork at {fork_height}, '
+                        f'{self.chain_length - fork_height} blocks disconnected, '
+                        f'{len(blocks)} blocks connected')
+            return self.switch_chain(fork_height, blocks), blocks
+    
+    def are_balances_valid(self, fork_height: int, blocks: List[Block]) -> bool:
+        #  replays the new blocks over the balances at the fork height, kept
+        #  as changes on top of the index so the cost follows the reorg depth
+        self.sync_balance_index()
+        overlay = defaultdict(int)
+        for block in self.chain[fork_height:]:
+            for address, delta in BalanceIndex.get_block_deltas(block).items():
+                overlay[address] -= delta
+                
+        for block in blocks:
+            for t in block.transactions:
+                overlay[t.sender] -= t.amount + t.fee
+                overlay[t.receiver] += t.amount
+                if block.index == 0:
+                    continue  # the genesis block mints the supply
+                
+                balance = (self.balance_index.get_balance(t.sender) + 
+                           overlay[t.sender])
+                if t.amount < 0 or t.fee < 0 or balance < 0:
+                    logger.info(f'Overspending transaction in block {block.index}')
+                    return False
+            for t in block.transactions:
+                overlay[block.miner] += t.fee
+                
         return True
+    
+    def switch_chain(self, fork_height: int, blocks: List[Block]) -> List[Block]:
+        disconnected = []
+        with self._chain_lock:
+            while self.chain_length > fork_height:
+                disconnected.append(self.disconnect_block())
+            for block in blocks:
+                self.connect_block(block)
+            
+        logger.info(f'chain replaced! (fork height: {fork_height})')
+        return disconnected
@@ -0,0 +1,147 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+from typing import List, Optional
+
+from .helper_functions import get_logger, get_process_context
+from .key_master import KeyMaster
+from .metrics import VALIDATION_SECONDS, VALIDATED_BLOCKS
+from .constants import (VALIDATION_PROCESSES, VALIDATION_CHUNK_SIZE,
+                        PARALLEL_VALIDATION_MIN_BLOCKS, VALIDATION_TIMEOUT)
+
+logger = get_logger(__name__)
+
+_stop_event = None
+_pool_stop_event = None
+_executor = None
+_executor_lock = threading.Lock()
+_validation_lock = threading.Lock()
+
+
+def _init_worker(stop_event: 'multiprocessing.Event'):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _validate_chunk(blocks: list, difficulty: int, max_size: int) -> bool:
+    for block in blocks:
+        if _stop_event.is_set():
+            return True  # another chunk already failed
+        if not ChainValidator.is_block_valid(block, difficulty, max_size):
+            _stop_event.set()
+            logger.info(f'Invalid block found: {block.index}')
+            return False
+    return True
+
+
+class ChainValidator:
+
+    @staticmethod
+    def are_signatures_valid(block: 'Blockchain.Block') -> bool:
+        #  the genesis block mints without a signature
+        if block.index == 0:
+            return True
+        return all(getattr(t, 'signature', None) is not None and
+                   KeyMaster.is_verified(t.serialized, t.signature, t.sender)
+                   for t in block.transactions)
+
+    @staticmethod
+    def is_block_valid(block: 'Blockchain.Block', difficulty: int,
+                       max_size: int, check_signatures=True) -> bool:
+        if len(block.transactions) > max_size:
+            return False
+
+        computed_hash = block.compute_hash()
+        return (computed_hash.startswith('0' * difficulty) and
+                computed_hash == block.hashcode and
+                block.compute_merkle_root() == block.merkle_root and
+                (not check_signatures or
+                 ChainValidator.are_signatures_valid(block)))
+
+    @staticmethod
+    def get_executor() -> concurrent.futures.ProcessPoolExecutor:
+        global _executor, _pool_stop_event
+        with _executor_lock:
+            if _executor is None:
+                processes = VALIDATION_PROCESSES or os.cpu_count() or 1
+                logger.info(f'Starting validation pool ({processes} processes)')
+                context = get_process_context()
+                _pool_stop_event = context.Event()
+                _executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(_pool_stop_event,))
+            return _executor
+
+    @staticmethod
+    def validate_blocks_parallel(blocks: list, difficulty: int, max_size: int,
+                                 chunk_size: Optional[int]=
+                                     VALIDATION_CHUNK_SIZE,
+                                 timeout: Optional[float]=
+                                     VALIDATION_TIMEOUT) -> bool:
+        #  one validation at a time, they share the pool's stop event. blocks
+        #  not validated in time are rejected and the pool is replaced
+        with _validation_lock:
+            executor = ChainValidator.get_executor()
+            _pool_stop_event.clear()
+            futures = [executor.submit(_validate_chunk,
+                                       blocks[i: i + chunk_size],
+                                       difficulty, max_size)
+                       for i in range(0, len(blocks), chunk_size)]
+
+            is_valid = True
+            deadline = time.time() + timeout
+            try:
+                for future in concurrent.futures.as_completed(futures, 
+                                                              timeout):
+                    if not future.result():
+                        is_valid = False
+                        for pending in futures:
+                            pending.cancel()
+                        break
+            except concurrent.futures.TimeoutError:
+                logger.error(f'Validation timed out after {timeout}s')
+                _pool_stop_event.set()
+                ChainValidator.shutdown(wait=False)
+                return False
+
+            _, not_done = concurrent.futures.wait(
+                futures, max(deadline - time.time(), 0))
+            if not_done:
+                logger.error('Validation pool did not stop in time')
+                ChainValidator.shutdown(wait=False)
+            return is_valid
+
+    @staticmethod
+    def validate_blocks(blocks: List['Blockchain.Block'], difficulty: int,
+                        max_size: int,
+                        min_parallel_blocks: Optional[int]=
+                            PARALLEL_VALIDATION_MIN_BLOCKS) -> bool:
+        started_at = time.perf_counter()
+        try:
+            if len(blocks) >= min_parallel_blocks:
+                return ChainValidator.validate_blocks_parallel(blocks,
+                                                               difficulty,
+                                                               max_size)
+
+            for block in blocks:
+                if not ChainValidator.is_block_valid(block, difficulty,
+                                                     max_size):
+                    logger.info(f'Invalid block found: {block.index}')
+                    return False
+            return True
+        finally:
+            VALIDATION_SECONDS.observe(time.perf_counter() - started_at)
+            VALIDATED_BLOCKS.inc(len(blocks))
+
+    @staticmethod
+    def shutdown(wait: Optional[bool]=True):
+        global _executor
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(wait=wait, cancel_futures=True)
+                _executor = None
@@ -0,0 +1,343 @@
+import socket
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .helper_functions import get_logger
+from .metrics import PEER_RTT_SECONDS, BYTES_SENT
+from .wire_protocol import FrameReader, WireProtocol
+
+from .constants import (LEGACY_PROTOCOL_VERSION, BROADCAST_TIMEOUT,
+                        PEER_HEALTHY, PEER_IDLE, PEER_DOWN,
+                        PEER_KEEPALIVE_INTERVAL, PEER_IDLE_TIMEOUT,
+                        PEER_MAINTENANCE_INTERVAL, PEER_RECONNECT_BACKOFF,
+                        PEER_MAX_RECONNECT_BACKOFF, PEER_MAX_FAILURES,
+                        PEER_STALE_AFTER)
+
+logger = get_logger(__name__)
+
+
+class PeerConnection:
+    #  a pooled socket and the health of the peer behind it, peers without
+    #  an address (accepted sockets) can't be reconnected
+    def __init__(self, peer: str, address: Optional[Tuple[str, int]]=None,
+                 url: Optional[str]=None,
+                 open_connection: Optional[Callable[[Tuple[str, int]],
+                                                    Tuple[socket.socket, int]]]=None):
+        self.peer = peer
+        self.address = address
+        self.url = url
+        self.open_connection = open_connection
+        self.socket = None
+        self.protocol = LEGACY_PROTOCOL_VERSION
+        self.frame_reader = FrameReader()
+        self.lock = threading.Lock()
+        self.state = PEER_DOWN
+        self.failures = 0
+        self.next_retry = 0
+        self.last_used = time.time()  # any request, keepalives included
+        self.last_requested = self.last_used
+        self.rtt = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.socket is not None
+
+    @property
+    def can_reconnect(self) -> bool:
+        return self.address is not None and self.failures < PEER_MAX_FAILURES
+
+    def is_retry_due(self, now: float) -> bool:
+        return self.can_reconnect and now >= self.next_retry
+
+    def attach(self, s: socket.socket, protocol: int):
+        self.socket = s
+        self.protocol = protocol
+        self.frame_reader = FrameReader(
+            allow_legacy=protocol == LEGACY_PROTOCOL_VERSION)
+        self.state = PEER_HEALTHY
+        self.failures = 0
+        self.last_used = time.time()
+        self.last_requested = self.last_used
+
+    def close(self, state: str):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+        self.state = state
+
+    def mark_failed(self):
+        self.close(PEER_DOWN)
+        self.failures += 1
+        backoff = min(PEER_RECONNECT_BACKOFF * 2 ** (self.failures - 1),
+                      PEER_MAX_RECONNECT_BACKOFF)
+        self.next_retry = time.time() + backoff
+
+    def is_stale(self) -> bool:
+        return time.time() - self.last_used >= PEER_STALE_AFTER
+
+    def is_dropped(self) -> bool:
+        #  a peer that closed the socket left an end of stream, or stray
+        #  bytes, to read before any request was sent
+        s = self.socket
+        timeout = s.gettimeout()
+        s.settimeout(0)
+        try:
+            s.recv(1, socket.MSG_PEEK)
+            return True
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            s.settimeout(timeout)
+
+    def reopen(self):
+        if self.address is None or self.open_connection is None:
+            raise ConnectionError('Connection closed by peer')
+        protocol = self.protocol
+        self.close(PEER_DOWN)
+        self.attach(*self.open_connection(self.address))
+        if self.protocol != protocol:
+            raise ConnectionError('Protocol changed on reconnect')
+
+    def send(self, frame: bytes, timeout: Optional[float]):
+        s = self.socket
+        if s is None:
+            raise ConnectionError('Not connected')
+        s.settimeout(timeout)
+        s.sendall(frame)
+        BYTES_SENT.inc(len(frame))
+
+    def request(self, frame: bytes, timeout: Optional[float]=None,
+                keepalive: Optional[bool]=False) -> Optional[dict]:
+        #  one request in flight per socket, so replies can't interleave.
+        #  keepalive requests don't count as use of the connection
+        with self.lock:
+            if self.is_connected and self.is_stale() and self.is_dropped():
+                if keepalive:
+                    logger.info(f'{self.peer} closed the idle connection')
+                    self.close(PEER_IDLE)
+                    return None
+                logger.info(f'{self.peer} closed the idle connection, '
+                            'reconnecting')
+                self.reopen()
+
+            started_at = time.time()
+            try:
+                self.send(frame, timeout)
+            except socket.timeout:
+                raise
+            except OSError:
+                #  a failed send never reached the peer whole, so it is sent
+                #  once more on a new connection. a reply that fails after 
+                #  the send isn't retried, the peer may have acted on it
+                if not (self.is_connected and self.is_stale()):
+                    raise
+                logger.info(f'Stale connection to {self.peer}, reconnecting')
+                self.reopen()
+                self.send(frame, timeout)
+
+            res, _ = self.frame_reader.read_message(self.socket)
+            if res is None:
+                raise ConnectionError('Connection closed by peer')
+            self.last_used = time.time()
+            if not keepalive:
+                self.last_requested = self.last_used
+            self.rtt = self.last_used - started_at
+            PEER_RTT_SECONDS.observe(self.rtt, (self.peer,))
+            return res
+
+    def as_dict(self) -> dict:
+        return {'peer': self.peer,
+                'state': self.state,
+                'failures': self.failures,
+                'rtt': self.rtt,
+                'idle': time.time() - self.last_requested}
+
+
+class ConnectionPool:
+    #  one persistent connection per peer. failed peers are reconnected with
+    #  exponential backoff and evicted after too many failures in a row,
+    #  unused connections are pinged and eventually closed until needed
+    def __init__(self,
+                 open_connection: Callable[[Tuple[str, int]],
+                                           Tuple[socket.socket, int]],
+                 keepalive_interval: Optional[float]=PEER_KEEPALIVE_INTERVAL,
+                 idle_timeout: Optional[float]=PEER_IDLE_TIMEOUT):
+        self.open_connection = open_connection
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self._set_up()
+
+    def _set_up(self):
+        self.connections: Dict[str, PeerConnection] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._keepalive_thread = None
+
+    def __getstate__(self) -> dict:
+        #  sockets and threads can't be copied, copies start empty
+        return {'open_connection': self.open_connection,
+                'keepalive_interval': self.keepalive_interval,
+                'idle_timeout': self.idle_timeout}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._set_up()
+
+    def __contains__(self, peer: str) -> bool:
+        return peer in self.connections
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def get(self, peer: str) -> Optional[PeerConnection]:
+        return self.connections.get(peer)
+
+    def get_connections(self) -> List[PeerConnection]:
+        with self._lock:
+            return list(self.connections.values())
+
+    def get_connected(self) -> List[PeerConnection]:
+        return [c for c in self.get_connections() if c.is_connected]
+
+    def get_available(self) -> List[PeerConnection]:
+        #  connected peers, and those a request may reconnect right now
+        now = time.time()
+        return [c for c in self.get_connections()
+                if c.is_connected or c.state == PEER_IDLE or c.is_retry_due(now)]
+
+    def get_health(self) -> Dict[str, dict]:
+        return {c.peer: c.as_dict() for c in self.get_connections()}
+
+    def add(self, peer: str, s: socket.socket, protocol: int,
+            address: Optional[Tuple[str, int]]=None,
+            url: Optional[str]=None) -> PeerConnection:
+        with self._lock:
+            connection = self.connections.get(peer)
+            if connection is None:
+                connection = PeerConnection(peer, address, url,
+                                            self.open_connection)
+                self.connections[peer] = connection
+            connection.close(PEER_DOWN)
+            connection.attach(s, protocol)
+        self.start_keepalive()
+        return connection
+
+    def connect(self, peer: str, address: Tuple[str, int],
+                url: Optional[str]=None) -> Optional[PeerConnection]:
+        with self._lock:
+            if peer not in self.connections:
+                self.connections[peer] = PeerConnection(
+                    peer, address, url, self.open_connection)
+            connection = self.connections[peer]
+        self.start_keepalive()
+        return connection if self.reconnect(connection) else None
+
+    def reconnect(self, connection: PeerConnection) -> bool:
+        with connection.lock:
+            if connection.is_connected:
+                return True
+            try:
+                s, protocol = self.open_connection(connection.address)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Unable to connect to {connection.peer}: {e}')
+                self.report_failure(connection.peer)
+                return False
+            connection.attach(s, protocol)
+
+        logger.info(f'Connected to {connection.peer}')
+        return True
+
+    def acquire(self, peer: str) -> Optional[PeerConnection]:
+        connection = self.connections.get(peer)
+        if connection is None:
+            return None
+        if connection.is_connected:
+            return connection
+
+        if connection.address is not None and (
+                connection.state == PEER_IDLE or
+                connection.is_retry_due(time.time())):
+            if self.reconnect(connection):
+                return connection
+        return None
+
+    def report_failure(self, peer: str) -> bool:
+        #  returns whether the peer got evicted
+        connection = self.connections.get(peer)
+        if connection is None:
+            return False
+
+        connection.mark_failed()
+        if connection.can_reconnect:
+            logger.warning(f'Peer {peer} down, retrying in '
+                           f'{connection.next_retry - time.time():.1f}s')
+            return False
+
+        logger.warning(f'Evicting peer: {peer}')
+        self.remove(peer)
+        return True
+
+    def remove(self, peer: str) -> Optional[PeerConnection]:
+        with self._lock:
+            connection = self.connections.pop(peer, None)
+        if connection is not None:
+            connection.close(PEER_DOWN)
+        return connection
+
+    def ping(self, connection: PeerConnection) -> bool:
+        frame = WireProtocol.frame({'path': 'ping', 'data': None},
+                                   connection.protocol)
+        try:
+            connection.request(frame, BROADCAST_TIMEOUT, keepalive=True)
+            return True
+        except Exception as e:
+            logger.warning(f'Keepalive to {connection.peer} failed: {e}')
+            self.report_failure(connection.peer)
+            return False
+
+    def maintain(self, now: Optional[float]=None):
+        now = time.time() if now is None else now
+        for connection in self.get_connections():
+            idle = now - connection.last_requested
+            if connection.is_connected:
+                if self.idle_timeout is not None and idle >= self.idle_timeout:
+                    #  a busy connection isn't idle, it is left alone
+                    if connection.lock.acquire(blocking=False):
+                        try:
+                            logger.info(f'Closing idle connection: {connection.peer}')
+                            connection.close(PEER_IDLE)
+                        finally:
+                            connection.lock.release()
+                elif (self.keepalive_interval is not None and
+                      now - connection.last_used >= self.keepalive_interval):
+                    self.ping(connection)
+            elif connection.state == PEER_DOWN and connection.is_retry_due(now):
+                self.reconnect(connection)
+
+    def _run_keepalive(self):
+        while not self._stop_event.wait(PEER_MAINTENANCE_INTERVAL):
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception('Connection maintenance failed')
+
+    def start_keepalive(self):
+        if self.keepalive_interval is None and self.idle_timeout is None:
+            return
+        with self._lock:
+            if self._keepalive_thread is None and not self._stop_event.is_set():
+                self._keepalive_thread = threading.Thread(
+                    target=self._run_keepalive, name='keepalive', daemon=True)
+                self._keepalive_thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        for peer in list(self.connections):
+            self.remove(peer)
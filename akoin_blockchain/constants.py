@@ -1,18 +1,95 @@
 HEADERSIZE = 10
 BUFFERSIZE = 16
-MAX_MESSAGE_SIZE = 5096
+MAX_MESSAGE_SIZE = 5096  # legacy (pickle) framing only
+
+LEGACY_PROTOCOL_VERSION = 1
+PROTOCOL_VERSION = 2
+ALLOW_LEGACY_PROTOCOL = True
+PROTOCOL_NEGOTIATION_TIMEOUT = 2  # seconds, legacy peers may never answer a frame
+FRAME_MAGIC = b'\x00AKN'  # legacy headers are ascii digits, never a null byte
+FRAME_BUFFER_SIZE = 64 * 1024
+MAX_FRAME_SIZE = 64 * 1024 * 1024
 
 LOCAL_HOST = '127.0.0.1'
 PORT = 1620
 INITIAL_WEB_ADDRESS = f'http://{LOCAL_HOST}:{PORT}'
 
 MAX_CONNECTIONS = 5
+BROADCAST_TIMEOUT = 10  # seconds, per peer
+BROADCAST_MAX_WORKERS = 32
+
+PEER_HEALTHY = 'healthy'
+PEER_IDLE = 'idle'  # closed for inactivity, reconnected on the next request
+PEER_DOWN = 'down'  # failed, reconnected with backoff
+PEER_KEEPALIVE_INTERVAL = 30  # seconds without traffic before a ping, below ASYNC_IDLE_TIMEOUT
+PEER_STALE_AFTER = 5  # seconds unused before a socket is checked for a peer close
+PEER_IDLE_TIMEOUT = 300  # seconds without requests, pings aside, before the socket is closed
+PEER_MAINTENANCE_INTERVAL = 5  # seconds
+PEER_RECONNECT_BACKOFF = 1  # seconds, doubled on each failure
+PEER_MAX_RECONNECT_BACKOFF = 60  # seconds
+PEER_MAX_FAILURES = 8  # in a row, then the peer is evicted
+
+#  seconds a threaded server keeps an unused socket, below the keepalive
+#  interval so idle peers don't pin its worker threads
+SERVER_IDLE_TIMEOUT = 20
+ASYNC_MAX_CONNECTIONS = 10000
+ASYNC_MAX_PENDING_REQUESTS = 64  # requests waiting on or running in the executor
+ASYNC_IDLE_TIMEOUT = 600  # seconds
+ASYNC_LISTEN_BACKLOG = 1024
+#  cheap reads answered on the event loop, everything else goes to the executor
+ASYNC_INLINE_PATHS = {'get_chain_length', 'get_chain_address', 'get_nodes', 
+                      'negotiate_protocol', 'get_tip', 'announce_tip', 'ping',
+                      'announce_transactions'}
 
 BLOCK_DIFFICULTY = 3
 MAX_BLOCK_TRANSACTIONS = 10
+MAX_PACKAGE_DEPTH = 4  # unconfirmed ancestors chained behind a template transaction
+MAX_PACKAGE_SIZE = 25  # transactions in a template package
+MAX_FUNDING_CANDIDATES = 8  # highest fee transactions considered per receiver
+LEGACY_BLOCK_VERSION = 1  # hashed as the full block json
+HEADER_BLOCK_VERSION = 2  # hashed as a compact header
+MERKLE_BLOCK_VERSION = 3  # merkle root over raw digests, no stored tree
+BLOCK_VERSION = MERKLE_BLOCK_VERSION
+
+MINING_PROCESSES = 0  # one per core
+MINING_BATCH_SIZE = 1024
+PARALLEL_MINING_MIN_DIFFICULTY = 4  # process pool overhead isn't worth it below
+
+PUBLIC_KEY_CACHE_SIZE = 1024  # parsed sender keys
+VERIFIED_SIGNATURE_CACHE_SIZE = 100000  # digests of verified signatures
+VERIFY_PROCESSES = 0  # one per core
+VERIFY_BATCH_MIN_SIZE = 64  # smaller batches are verified in process
+VERIFY_TIMEOUT = 60  # seconds, unfinished batches are verified in process
+
+MEMPOOL_MAX_SIZE = 200000  # lowest fee transactions are evicted beyond
+MEMPOOL_HEAP_SLACK = 1024  # stale heap entries tolerated before compaction
+
+VALIDATION_PROCESSES = 0  # one per core
+VALIDATION_CHUNK_SIZE = 256  # blocks per pool task
+PARALLEL_VALIDATION_MIN_BLOCKS = 1000  # shorter chains are checked in process
+VALIDATION_TIMEOUT = 600  # seconds, blocks not validated in time are rejected
 
 INITIAL_CURRENCY_SUPPLY = 1000000000
 GENESIS_BLOCK_FEE = 0
 
+BLOCK_STORE_SEGMENT_SIZE = 64 * 1024 * 1024
+BLOCK_STORE_CACHE_SIZE = 1024  # decoded blocks kept in memory
+HASH_INDEX_INITIAL_CAPACITY = 4096
+BALANCE_CHECKPOINT_INTERVAL = 100  # blocks
+MAX_UNDO_RECORDS = 1000  # deeper reorgs recompute undo data from the blocks
+
+MAX_SYNC_HEADERS = 2000  # per get_headers request
+MAX_SYNC_BLOCKS = 100  # per get_blocks request
+MAX_PENDING_TIPS = 64  # announced tips waiting for the sync worker
+
+INVENTORY_BATCH_INTERVAL = 0.5  # seconds new txids wait to be announced together
+MAX_INVENTORY_SIZE = 50000  # txids per announcement
+
+#  seconds, upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_PORT = 0  # prometheus text over http, off unless set
+METRICS_PATH = '/metrics'
+
 INITIAL_NODE = 'http://127.0.0.1:1620'
 TRANSACTION_MAX_DAYS = 5
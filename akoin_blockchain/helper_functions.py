@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 import os
 import random
 import string
@@ -28,6 +29,14 @@ def is_url_valid(url):
         return False
 
     
+def get_process_context() -> multiprocessing.context.BaseContext:
+    #  pools are started from nodes running listener, keepalive and sync 
+    #  threads, a forked worker could inherit a lock one of them held
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+    
 def get_logger(name: str, level: Optional[int]=logging.DEBUG) -> logging.Logger:
     logger = logging.getLogger(name)
     if os.getenv('LOGGING_LEVEL'):
@@ -1,8 +1,58 @@
+import concurrent.futures
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from hashlib import sha256
+from typing import List, Optional, Tuple
+
 from ellipticcurve.ecdsa import Ecdsa
 from ellipticcurve.signature import Signature
 from ellipticcurve.publicKey import PublicKey
 from ellipticcurve.privateKey import PrivateKey
 
+from .helper_functions import get_logger, get_process_context
+from .constants import (PUBLIC_KEY_CACHE_SIZE, VERIFIED_SIGNATURE_CACHE_SIZE,
+                        VERIFY_PROCESSES, VERIFY_BATCH_MIN_SIZE,
+                        VERIFY_TIMEOUT)
+
+logger = get_logger(__name__)
+
+_cache_lock = threading.Lock()
+_public_key_cache = OrderedDict()
+_verified_signatures = OrderedDict()
+_executor_lock = threading.Lock()
+_verify_executor = None
+
+
+def _cache_get(cache: OrderedDict, key):
+    #  hits move to the end, so the least recently used entry goes first
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache: OrderedDict, key, value, max_size: int):
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+
+
+def _verify_processes() -> int:
+    return VERIFY_PROCESSES or os.cpu_count() or 1
+
+
+def _verify_chunk(chunk: List[Tuple[str, str, str]]) -> List[bool]:
+    #  runs in the verification pool, signatures travel as strings
+    return [KeyMaster.is_verified(s, KeyMaster.signature_from_string(signature),
+                                  public_key_string)
+            for s, signature, public_key_string in chunk]
+
 
 class KeyMaster:
     
@@ -13,9 +63,36 @@ class KeyMaster:
                 'public_key': prvk.publicKey(),
                 'public_key_string': prvk.publicKey().toString()} 
     
+    @staticmethod
+    def keys_from_private_key(prvk: PrivateKey) -> dict:
+        return {'private_key': prvk, 
+                'public_key': prvk.publicKey(),
+                'public_key_string': prvk.publicKey().toString()}
+    
+    @staticmethod
+    def load_or_generate_keys(path: Optional[str]=None) -> dict:
+        if path is None:
+            return KeyMaster.generate_keys()
+        
+        if os.path.exists(path):
+            with open(path) as f:
+                return KeyMaster.keys_from_private_key(PrivateKey.fromPem(f.read()))
+        
+        keys = KeyMaster.generate_keys()
+        #  created owner only, the key is never readable by others
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(keys['private_key'].toPem())
+        return keys
+    
     @staticmethod
     def public_key_from_string(public_key_string: str) -> PublicKey:
-        return PublicKey.fromString(public_key_string)
+        public_key = _cache_get(_public_key_cache, public_key_string)
+        if public_key is None:
+            public_key = PublicKey.fromString(public_key_string)
+            _cache_put(_public_key_cache, public_key_string, public_key,
+                       PUBLIC_KEY_CACHE_SIZE)
+        return public_key
     
     @staticmethod
     def signature_from_string(signature_string: str) -> Signature:
@@ -25,17 +102,111 @@ class KeyMaster:
     def sign(s: str, private_key: PrivateKey) -> Signature:
         return Ecdsa.sign(s, private_key)
     
+    @staticmethod
+    def verification_key(s: str, signature_string: str, 
+                         public_key_string: str) -> bytes:
+        return sha256('\n'.join([s, signature_string, 
+                                 public_key_string]).encode()).digest()
+    
     @staticmethod
     def is_verified(s: str, signature: Signature, 
                     public_key_string: str) -> bool:
-        return Ecdsa.verify(s, signature, 
-                            KeyMaster.public_key_from_string(public_key_string))
+        key = KeyMaster.verification_key(s, signature._toString(), 
+                                         public_key_string)
+        if _cache_get(_verified_signatures, key):
+            return True
+        
+        is_verified = Ecdsa.verify(s, signature, 
+                                   KeyMaster.public_key_from_string(public_key_string))
+        if is_verified:
+            #  only successes are cached, failures are cheap to repeat
+            _cache_put(_verified_signatures, key, True, 
+                       VERIFIED_SIGNATURE_CACHE_SIZE)
+        return is_verified
+    
+    @staticmethod
+    def clear_caches():
+        with _cache_lock:
+            _public_key_cache.clear()
+            _verified_signatures.clear()
+    
+    @staticmethod
+    def get_verify_executor() -> concurrent.futures.ProcessPoolExecutor:
+        global _verify_executor
+        with _executor_lock:
+            if _verify_executor is None:
+                processes = _verify_processes()
+                logger.info(f'Starting verification pool ({processes} processes)')
+                _verify_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=processes, mp_context=get_process_context())
+            return _verify_executor
+    
+    @staticmethod
+    def shutdown_verify_executor():
+        global _verify_executor
+        with _executor_lock:
+            if _verify_executor is not None:
+                _verify_executor.shutdown(wait=False, cancel_futures=True)
+                _verify_executor = None
+    
+    @staticmethod
+    def verify_batch(items: List[Tuple[str, Signature, str]],
+                     min_parallel_size: Optional[int]=VERIFY_BATCH_MIN_SIZE
+                     ) -> List[bool]:
+        results = [False] * len(items)
+        pending = []
+        for i, (s, signature, public_key_string) in enumerate(items):
+            if signature is None:
+                continue
+            
+            signature_string = signature._toString()
+            key = KeyMaster.verification_key(s, signature_string, 
+                                             public_key_string)
+            if _cache_get(_verified_signatures, key):
+                results[i] = True
+            else:
+                pending.append((i, key, (s, signature_string, public_key_string)))
+                
+        if len(pending) < min_parallel_size:
+            for i, _, (s, _, public_key_string) in pending:
+                results[i] = KeyMaster.is_verified(s, items[i][1], 
+                                                   public_key_string)
+            return results
+        
+        executor = KeyMaster.get_verify_executor()
+        chunk_size = -(-len(pending) // _verify_processes())
+        chunks = [pending[i: i + chunk_size] 
+                  for i in range(0, len(pending), chunk_size)]
+        futures = [executor.submit(_verify_chunk, [item for _, _, item in chunk]) 
+                   for chunk in chunks]
+        
+        #  chunks the pool doesn't verify in time are verified in process,
+        #  and the pool is replaced
+        deadline = time.time() + VERIFY_TIMEOUT
+        timed_out = False
+        for chunk, future in zip(chunks, futures):
+            try:
+                verified = future.result(max(deadline - time.time(), 0))
+            except (concurrent.futures.TimeoutError, 
+                    concurrent.futures.CancelledError):
+                if not timed_out:
+                    logger.error('Verification pool timed out')
+                    KeyMaster.shutdown_verify_executor()
+                    timed_out = True
+                verified = [KeyMaster.is_verified(s, items[i][1], 
+                                                  public_key_string)
+                            for i, _, (s, _, public_key_string) in chunk]
+            for (i, key, _), is_verified in zip(chunk, verified):
+                results[i] = is_verified
+                if is_verified:
+                    _cache_put(_verified_signatures, key, True,
+                               VERIFIED_SIGNATURE_CACHE_SIZE)
+        return results
     
     @staticmethod
     def is_public_key_string_valid(public_key_string):
         try:
-            PublicKey.fromString(public_key_string)
+            KeyMaster.public_key_from_string(public_key_string)
             return True
         except Exception:  # no exception subclass in ellipticcure lib
             return False
-        
\ No newline at end of file
@@ -0,0 +1,158 @@
+import heapq
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from .helper_functions import get_logger
+from .transaction import Transaction
+
+from .constants import MEMPOOL_MAX_SIZE, MEMPOOL_HEAP_SLACK
+
+logger = get_logger(__name__)
+
+
+class Mempool:
+    #  heaps use lazy deletion, entries of removed transactions are
+    #  skipped when met and dropped when the heaps get compacted
+    def __init__(self, max_size: Optional[int]=MEMPOOL_MAX_SIZE):
+        self.max_size = max_size
+        self.transactions: Dict[str, Transaction] = {}
+        self.json_transactions: Dict[str, str] = {}
+        self.json_index: Dict[str, str] = {}
+        self.by_sender: Dict[str, Set[str]] = {}
+        self.fee_heap = []  # highest fee first
+        self.eviction_heap = []  # lowest fee, then oldest first
+        self.expiry_heap = []  # oldest first
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.json_index))
+
+    def __contains__(self, item) -> bool:
+        if isinstance(item, Transaction):
+            return item.txid in self.transactions
+        return item in self.json_index or item in self.transactions
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Mempool):
+            return self.json_index.keys() == other.json_index.keys()
+        if isinstance(other, (set, frozenset)):
+            return self.json_index.keys() == other
+        return NotImplemented
+
+    def get(self, txid: str) -> Optional[Transaction]:
+        return self.transactions.get(txid)
+
+    def get_json(self, txid: str) -> Optional[str]:
+        return self.json_transactions.get(txid)
+
+    def get_transactions(self) -> List[Transaction]:
+        return list(self.transactions.values())
+
+    def get_by_sender(self, sender: str) -> List[Transaction]:
+        return [self.transactions[txid]
+                for txid in self.by_sender.get(sender, ())]
+
+    def add(self, t: Transaction, json_transaction: Optional[str]=None) -> bool:
+        txid = t.txid
+        if txid in self.transactions:
+            return False
+
+        if json_transaction is None:
+            json_transaction = t.as_json()
+        self.transactions[txid] = t
+        self.json_transactions[txid] = json_transaction
+        self.json_index[json_transaction] = txid
+        self.by_sender.setdefault(t.sender, set()).add(txid)
+        heapq.heappush(self.fee_heap, (-t.fee, t.timestamp, txid))
+        heapq.heappush(self.eviction_heap, (t.fee, t.timestamp, txid))
+        heapq.heappush(self.expiry_heap, (t.timestamp, txid))
+
+        evicted = self.evict()
+        return txid not in evicted
+
+    def remove(self, txid: str) -> Optional[Transaction]:
+        t = self.transactions.pop(txid, None)
+        if t is None:
+            return None
+
+        del self.json_index[self.json_transactions.pop(txid)]
+        sender_txids = self.by_sender[t.sender]
+        sender_txids.discard(txid)
+        if not sender_txids:
+            del self.by_sender[t.sender]
+
+        if len(self.fee_heap) > 2 * len(self.transactions) + MEMPOOL_HEAP_SLACK:
+            self.compact()
+        return t
+
+    def remove_transactions(self, transactions: Iterable[Transaction]
+                            ) -> List[Transaction]:
+        removed = [self.remove(t.txid) for t in transactions]
+        return [t for t in removed if t is not None]
+
+    def clear(self):
+        self.__init__(self.max_size)
+
+    def evict(self) -> List[str]:
+        evicted = []
+        while len(self.transactions) > self.max_size:
+            _, _, txid = heapq.heappop(self.eviction_heap)
+            if self.remove(txid) is not None:
+                evicted.append(txid)
+
+        if evicted:
+            logger.info(f'Mempool full, evicted {len(evicted)} transactions')
+        return evicted
+
+    def expire(self, before: float) -> List[Transaction]:
+        #  only the expired transactions are visited
+        expired = []
+        while self.expiry_heap and self.expiry_heap[0][0] < before:
+            _, txid = heapq.heappop(self.expiry_heap)
+            t = self.remove(txid)
+            if t is not None:
+                expired.append(t)
+
+        if expired:
+            logger.info(f'{len(expired)} transactions expired')
+        return expired
+
+    def compact(self):
+        self.fee_heap = [e for e in self.fee_heap if e[2] in self.transactions]
+        self.eviction_heap = [e for e in self.eviction_heap
+                              if e[2] in self.transactions]
+        self.expiry_heap = [e for e in self.expiry_heap
+                            if e[1] in self.transactions]
+        heapq.heapify(self.fee_heap)
+        heapq.heapify(self.eviction_heap)
+        heapq.heapify(self.expiry_heap)
+
+    def iter_by_fee(self) -> Iterator[Transaction]:
+        #  walks the heap best first without popping it, so taking the
+        #  top k costs O(k log k) whatever the pool size
+        heap = self.fee_heap
+        if not heap:
+            return
+
+        seen = set()
+        frontier = [(heap[0], 0)]
+        while frontier:
+            entry, i = heapq.heappop(frontier)
+            txid = entry[2]
+            if txid in self.transactions and txid not in seen:
+                seen.add(txid)
+                yield self.transactions[txid]
+
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def top(self, k: int) -> List[Transaction]:
+        top_transactions = []
+        for t in self.iter_by_fee():
+            if len(top_transactions) == k:
+                break
+            top_transactions.append(t)
+        return top_transactions
@@ -0,0 +1,281 @@
+import bisect
+import http.server
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .helper_functions import get_logger
+from .constants import LATENCY_BUCKETS, METRICS_PATH
+
+logger = get_logger(__name__)
+
+
+class Metric:
+    #  values are kept per tuple of label values, updates take the metric's
+    #  own lock so recording stays cheap and never waits on a scrape
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str,
+                 label_names: Optional[Tuple[str, ...]]=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def get_labels(self, labels: tuple) -> Dict[str, str]:
+        return dict(zip(self.label_names, labels))
+
+    def snapshot(self) -> List[Tuple[tuple, object]]:
+        with self._lock:
+            return list(self.values.items())
+
+    def collect(self) -> dict:
+        return {'type': self.kind,
+                'description': self.description,
+                'values': [{'labels': self.get_labels(labels), 'value': value}
+                           for labels, value in self.snapshot()]}
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: Optional[float]=1, labels: Optional[tuple]=()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels: Optional[tuple]=()) -> float:
+        return self.values.get(labels, 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, labels: Optional[tuple]=()):
+        with self._lock:
+            self.values[labels] = value
+
+    def inc(self, amount: Optional[float]=1, labels: Optional[tuple]=()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels: Optional[tuple]=()) -> float:
+        return self.values.get(labels, 0)
+
+
+class Histogram(Metric):
+    #  counts per bucket upper bound, the last count is for +Inf
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 label_names: Optional[Tuple[str, ...]]=(),
+                 buckets: Optional[Tuple[float, ...]]=LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, labels: Optional[tuple]=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, labels: Optional[tuple]=()) -> 'Timer':
+        return Timer(self, labels)
+
+    def snapshot(self) -> List[Tuple[tuple, object]]:
+        with self._lock:
+            return [(labels, [list(counts), total, count])
+                    for labels, (counts, total, count) in self.values.items()]
+
+    def get_count(self, labels: Optional[tuple]=()) -> int:
+        series = self.values.get(labels)
+        return series[2] if series is not None else 0
+
+    def collect(self) -> dict:
+        values = []
+        for labels, (counts, total, count) in self.snapshot():
+            cumulative, buckets = 0, {}
+            for bound, n in zip(self.buckets + ['+Inf'], counts):
+                cumulative += n
+                buckets[str(bound)] = cumulative
+            values.append({'labels': self.get_labels(labels),
+                           'buckets': buckets, 'sum': total, 'count': count})
+        return {'type': self.kind,
+                'description': self.description,
+                'values': values}
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+        self.started_at = None
+
+    def __enter__(self) -> 'Timer':
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started_at,
+                               self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self.metrics:
+                raise Exception(f'Metric already registered: {metric.name}')
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str,
+                label_names: Optional[Tuple[str, ...]]=()) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str,
+              label_names: Optional[Tuple[str, ...]]=()) -> Gauge:
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str,
+                  label_names: Optional[Tuple[str, ...]]=(),
+                  buckets: Optional[Tuple[float, ...]]=LATENCY_BUCKETS
+                  ) -> Histogram:
+        return self.register(Histogram(name, description, label_names,
+                                       buckets))
+
+    def collect(self) -> Dict[str, dict]:
+        return {name: metric.collect()
+                for name, metric in list(self.metrics.items())}
+
+    def clear(self):
+        for metric in list(self.metrics.values()):
+            metric.clear()
+
+    @staticmethod
+    def escape(value: object) -> str:
+        return (str(value).replace('\\', r'\\').replace('"', r'\"')
+                .replace('\n', r'\n'))
+
+    @staticmethod
+    def format_labels(labels: Dict[str, str]) -> str:
+        if not labels:
+            return ''
+        pairs = ','.join(f'{k}="{MetricsRegistry.escape(v)}"'
+                         for k, v in labels.items())
+        return f'{{{pairs}}}'
+
+    def as_prometheus(self) -> str:
+        #  the prometheus text exposition format
+        lines = []
+        for name, metric in self.collect().items():
+            lines.append(f'# HELP {name} {metric["description"]}')
+            lines.append(f'# TYPE {name} {metric["type"]}')
+            for value in metric['values']:
+                labels = value['labels']
+                if metric['type'] != 'histogram':
+                    lines.append(f'{name}{self.format_labels(labels)} '
+                                 f'{value["value"]}')
+                    continue
+                for bound, count in value['buckets'].items():
+                    bucket_labels = dict(labels, le=bound)
+                    lines.append(f'{name}_bucket'
+                                 f'{self.format_labels(bucket_labels)} {count}')
+                lines.append(f'{name}_sum{self.format_labels(labels)} '
+                             f'{value["sum"]}')
+                lines.append(f'{name}_count{self.format_labels(labels)} '
+                             f'{value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    'akoin_request_seconds', 'Time spent handling requests', ('path',))
+REQUEST_ERRORS = registry.counter(
+    'akoin_request_errors_total', 'Requests that failed', ('path',))
+HASHES = registry.counter(
+    'akoin_hashes_total', 'Proof of work hashes computed')
+HASH_RATE = registry.gauge(
+    'akoin_hash_rate', 'Hashes per second of the last mining run')
+VALIDATION_SECONDS = registry.histogram(
+    'akoin_validation_seconds', 'Time spent validating blocks')
+VALIDATED_BLOCKS = registry.counter(
+    'akoin_validated_blocks_total', 'Blocks validated')
+MEMPOOL_SIZE = registry.gauge(
+    'akoin_mempool_transactions', 'Transactions in the mempool')
+CHAIN_LENGTH = registry.gauge(
+    'akoin_chain_length', 'Blocks in the chain')
+PEERS = registry.gauge(
+    'akoin_peers', 'Known peers by health', ('state',))
+PEER_RTT_SECONDS = registry.histogram(
+    'akoin_peer_rtt_seconds', 'Round trip time of requests to peers',
+    ('peer',))
+BYTES_SENT = registry.counter(
+    'akoin_bytes_sent_total', 'Bytes of framed messages sent')
+BYTES_RECEIVED = registry.counter(
+    'akoin_bytes_received_total', 'Bytes of framed messages received')
+
+
+class MetricsServer:
+    #  serves the registry as prometheus text over http, on_scrape refreshes
+    #  the gauges read from the node before every scrape
+    def __init__(self, host: str, port: int,
+                 on_scrape: Optional[Callable[[], None]]=None):
+        self.on_scrape = on_scrape
+        self.server = http.server.ThreadingHTTPServer((host, port),
+                                                      self.make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address
+
+    def make_handler(self) -> type:
+        metrics_server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                if metrics_server.on_scrape is not None:
+                    metrics_server.on_scrape()
+                body = registry.as_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args):
+                logger.debug(f'metrics scrape from {self.client_address[0]}')
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name='metrics', daemon=True)
+        self._thread.start()
+        logger.info(f'Metrics served on http://{self.address[0]}:'
+                    f'{self.address[1]}{METRICS_PATH}')
+
+    def close(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread = None
+        self.server.server_close()
@@ -0,0 +1,185 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+from hashlib import sha256
+from typing import Optional, Tuple
+
+from .helper_functions import get_logger, get_process_context
+from .metrics import HASHES, HASH_RATE
+from .constants import MINING_BATCH_SIZE, PARALLEL_MINING_MIN_DIFFICULTY
+
+logger = get_logger(__name__)
+
+_stop_event = None
+_hash_counter = None
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+class MiningCancelled(Exception):
+    pass
+
+
+def _init_worker(stop_event: 'multiprocessing.Event',
+                 hash_counter: 'multiprocessing.Value'):
+    global _stop_event, _hash_counter
+    _stop_event = stop_event
+    _hash_counter = hash_counter
+
+
+def search_nonces(prefix: bytes, suffix: bytes, start: int, step: int,
+                  difficulty: int, stop_event=None,
+                  hash_counter=None) -> Optional[Tuple[int, str]]:
+    if stop_event is None:
+        stop_event, hash_counter = _stop_event, _hash_counter
+    target = '0' * difficulty
+    nonce = start
+    prefix_state = sha256(prefix)
+
+    while not stop_event.is_set():
+        for attempts in range(1, MINING_BATCH_SIZE + 1):
+            attempt = prefix_state.copy()
+            attempt.update(str(nonce).encode() + suffix)
+            computed_hash = attempt.hexdigest()
+            if computed_hash.startswith(target):
+                stop_event.set()
+                with hash_counter.get_lock():
+                    hash_counter.value += attempts
+                return nonce, computed_hash
+            nonce += step
+
+        with hash_counter.get_lock():
+            hash_counter.value += MINING_BATCH_SIZE
+
+    return None
+
+
+class MiningEngine:
+    def __init__(self, processes: Optional[int]=None,
+                 min_parallel_difficulty: Optional[int]=
+                     PARALLEL_MINING_MIN_DIFFICULTY):
+        self.processes = processes or os.cpu_count() or 1
+        self.min_parallel_difficulty = min_parallel_difficulty
+        self._set_up()
+
+    def _set_up(self):
+        context = get_process_context()
+        self._context = context
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stop_event = context.Event()
+        self._hash_counter = context.Value('Q', 0)
+        self._started_at = None
+        self._elapsed = 0
+        self._last_hashes = 0
+        self._run_lock = threading.Lock()
+        self._cancels = 0
+
+    def __getstate__(self) -> dict:
+        #  process pools and shared memory can't be copied or pickled
+        return {'processes': self.processes,
+                'min_parallel_difficulty': self.min_parallel_difficulty}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._set_up()
+
+    @staticmethod
+    def get_default() -> 'MiningEngine':
+        #  shared by blocks mined without an engine of their own
+        global _default_engine
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = MiningEngine(processes=1)
+            return _default_engine
+
+    @property
+    def is_mining(self) -> bool:
+        return self._started_at is not None
+
+    @property
+    def hashes_per_second(self) -> float:
+        if self.is_mining:
+            elapsed = time.time() - self._started_at
+            hashes = self._hash_counter.value
+        else:
+            elapsed = self._elapsed
+            hashes = self._last_hashes
+
+        return hashes / elapsed if elapsed > 0 else 0.0
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                logger.info(f'Starting mining pool ({self.processes} processes)')
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=self._context,
+                    initializer=_init_worker,
+                    initargs=(self._stop_event, self._hash_counter))
+            return self._executor
+
+    def _mine_parallel(self, prefix: bytes, suffix: bytes,
+                       difficulty: int) -> Optional[Tuple[int, str]]:
+        executor = self._get_executor()
+        futures = [executor.submit(search_nonces, prefix, suffix,
+                                   start, self.processes, difficulty)
+                   for start in range(self.processes)]
+
+        result = None
+        for future in concurrent.futures.as_completed(futures):
+            found = future.result()
+            if found is not None and (result is None or found[0] < result[0]):
+                result = found
+
+        return result
+
+    def mine(self, prefix: bytes, suffix: bytes,
+             difficulty: int) -> Optional[Tuple[int, str]]:
+        #  runs share the stop event and hash counter, so they take turns.
+        #  a cancel while a run waits for its turn cancels it too
+        cancels = self._cancels
+        with self._run_lock:
+            self._stop_event.clear()
+            if self._cancels != cancels:
+                logger.info('Mining cancelled before it started')
+                return None
+            return self._mine(prefix, suffix, difficulty)
+
+    def _mine(self, prefix: bytes, suffix: bytes,
+              difficulty: int) -> Optional[Tuple[int, str]]:
+        with self._hash_counter.get_lock():
+            self._hash_counter.value = 0
+        self._started_at = time.time()
+
+        try:
+            if self.processes > 1 and difficulty >= self.min_parallel_difficulty:
+                result = self._mine_parallel(prefix, suffix, difficulty)
+            else:
+                result = search_nonces(prefix, suffix, 0, 1, difficulty,
+                                       self._stop_event, self._hash_counter)
+        finally:
+            self._elapsed = time.time() - self._started_at
+            self._last_hashes = self._hash_counter.value
+            self._started_at = None
+            HASHES.inc(self._last_hashes)
+            HASH_RATE.set(self.hashes_per_second)
+
+        logger.info(f'Mining done, hash rate: {self.hashes_per_second:.0f} H/s')
+        return result
+
+    def cancel(self):
+        if self.is_mining:
+            logger.info('Mining cancelled')
+        self._cancels += 1
+        self._stop_event.set()
+
+    def shutdown(self):
+        self.cancel()
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -1,19 +1,40 @@
+import concurrent.futures
 import pickle
 import socket
-from typing import List
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
 
 from urllib.parse import urlparse
 
-from .constants import BUFFERSIZE, HEADERSIZE, MAX_MESSAGE_SIZE
+from .connection_pool import ConnectionPool
+from .constants import (BUFFERSIZE, HEADERSIZE, MAX_MESSAGE_SIZE,
+                        LEGACY_PROTOCOL_VERSION, PROTOCOL_VERSION,
+                        BROADCAST_TIMEOUT, BROADCAST_MAX_WORKERS,
+                        ALLOW_LEGACY_PROTOCOL, PROTOCOL_NEGOTIATION_TIMEOUT)
 from .helper_functions import get_logger
+from .wire_protocol import FrameReader, WireProtocol
 
 logger = get_logger(__name__)
+_executor_lock = threading.Lock()
 
 
 class NetworkManager:
     def __init__(self):
-        self.url_set = set()
-        self.socket_list = []
+        self.pool = ConnectionPool(self.open_connection)
+        self._broadcast_executor = None
+        
+    @property
+    def peer_sockets(self) -> Dict[str, socket.socket]:
+        return {c.peer: c.socket for c in self.pool.get_connected()}
+    
+    @property
+    def socket_list(self) -> List[socket.socket]:
+        return list(self.peer_sockets.values())
+    
+    @property
+    def url_set(self) -> Set[str]:
+        return {c.url for c in self.pool.get_connections() if c.url}
         
     @staticmethod
     def parse_message_buffer(s: 'socket.socket') -> bytes:
@@ -38,44 +59,214 @@ class NetworkManager:
         msg = pickle.dumps(message_dict)
         return bytes(f"{len(msg):<{HEADERSIZE}}", 'utf-8') + msg
         
-    def connect_to_node(self, ip: str, port: int) -> bool:
-        try:
-            self.set_up_socket(ip, port)
-            logger.info(f'New Socket connection: {ip}:{port}')
-            return True
-        except OSError as e:
-            logger.exception(f'Unable to connect to socket! \n Exception: {e}')
+    def connect_to_node(self, ip: str, port: int, 
+                        url: Optional[str]=None) -> bool:
+        #  a failed peer stays pooled and is retried with backoff
+        if self.pool.connect(f'{ip}:{port}', (ip, port), url) is None:
+            logger.warning(f'Unable to connect to socket: {ip}:{port}')
             return False
         
+        logger.info(f'New Socket connection: {ip}:{port}')
+        return True
+        
     @staticmethod
     def deserialize(r: str) -> dict:
         return pickle.loads(r)
         
-    def set_up_socket(self, ip: str, port: int):
+    @staticmethod
+    def connect_socket(address: Tuple[str, int]) -> socket.socket:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ip, port))
-        self.socket_list.append(s)
+        try:
+            s.settimeout(BROADCAST_TIMEOUT)
+            s.connect(address)
+            return s
+        except Exception:
+            s.close()
+            raise
+        
+    def open_connection(self, address: Tuple[str, int]
+                        ) -> Tuple[socket.socket, int]:
+        s = self.connect_socket(address)
+        try:
+            return s, self.negotiate_protocol(s)
+        except ConnectionError as e:
+            #  peers predating framing can't parse a framed request, they
+            #  are asked again in legacy framing on a new connection
+            s.close()
+            if not ALLOW_LEGACY_PROTOCOL:
+                raise
+            logger.info(f'{address} failed the framed handshake ({e}), '
+                        'trying legacy')
+        except Exception:
+            s.close()
+            raise
+        
+        s = self.connect_socket(address)
+        try:
+            return s, self.negotiate_protocol(s, LEGACY_PROTOCOL_VERSION)
+        except Exception:
+            s.close()
+            raise
+        
+    def add_peer_socket(self, peer: str, s: socket.socket, 
+                        address: Optional[Tuple[str, int]]=None):
+        self.pool.add(peer, s, self.negotiate_protocol(s), address)
+        
+    def negotiate_protocol(self, s: socket.socket, 
+                           version: Optional[int]=PROTOCOL_VERSION) -> int:
+        #  asked in the current framing so no peer has to unpickle, nodes 
+        #  that don't know the path answer without a version. nodes predating
+        #  framing fail to parse the header and may leave the socket open, 
+        #  so no reply in time or one we can't parse is a ConnectionError
+        request = {'path': 'negotiate_protocol', 
+                   'data': {'versions': [PROTOCOL_VERSION]}}
+        timeout = s.gettimeout()
+        s.settimeout(PROTOCOL_NEGOTIATION_TIMEOUT)
+        try:
+            WireProtocol.send_message(s, request, version)
+            frame_reader = FrameReader(
+                allow_legacy=version == LEGACY_PROTOCOL_VERSION)
+            res, _ = frame_reader.read_message(s)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            raise ConnectionError(f'No handshake reply: {e}') from e
+        finally:
+            s.settimeout(timeout)
+        if res is None:
+            raise ConnectionError('Connection closed by peer')
+        
+        negotiated = LEGACY_PROTOCOL_VERSION
+        if isinstance(res, dict) and res.get('success'):
+            negotiated = res.get('version', LEGACY_PROTOCOL_VERSION)
+        if negotiated == LEGACY_PROTOCOL_VERSION and not ALLOW_LEGACY_PROTOCOL:
+            raise ValueError('Legacy protocol not allowed!')
+        logger.info(f'Protocol version {negotiated} negotiated')
+        return negotiated
         
     def register_new_node(self, url: str):
-        if url in self.url_set:
+        peer = urlparse(url).netloc
+        if peer in self.pool:
             logger.info('Peer already connected')
             return False
         
-        ip, port = urlparse(url).netloc.split(':')
-        self.connect_to_node(ip, int(port))
-        self.url_set.add(url)
+        ip, port = peer.split(':')
+        self.connect_to_node(ip, int(port), url)
         logger.info(f'socket connected to {ip}:{port}')
         return True
         
-    def message_node(self, s: socket.socket, path: str, data: dict):
-        s.send(self.serialize_message({'path': path, 'data': data}))
-        return self.deserialize(self.parse_message_buffer(s))
+    def message_node(self, s: socket.socket, path: str, data: dict, 
+                     timeout: Optional[float]=None):
+        for connection in self.pool.get_connected():
+            if connection.socket is s:
+                frame = WireProtocol.frame({'path': path, 'data': data}, 
+                                           connection.protocol)
+                return connection.request(frame, timeout)
+        raise ConnectionError('Socket not in the connection pool')
+        
+    def drop_peer(self, peer: str):
+        if self.pool.remove(peer) is not None:
+            logger.warning(f'Dropping peer: {peer}')
+            
+    def get_peer_health(self) -> Dict[str, dict]:
+        return self.pool.get_health()
+    
+    def maintain_connections(self):
+        self.pool.maintain()
+        
+    def close(self):
+        self.pool.close()
+        if self._broadcast_executor is not None:
+            self._broadcast_executor.shutdown(wait=False)
+        
+    def get_broadcast_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with _executor_lock:
+            if self._broadcast_executor is None:
+                self._broadcast_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=BROADCAST_MAX_WORKERS,
+                    thread_name_prefix='broadcast')
+            return self._broadcast_executor
+        
+    def _message_peer(self, peer: str, message: dict, 
+                      timeout: Optional[float], 
+                      frames: Optional[Dict[int, bytes]]=None) -> dict:
+        started_at = time.time()
+        result = {'peer': peer, 'status': 'ok', 'response': None, 'error': None}
+        connection = self.pool.acquire(peer)
+        if connection is None:
+            result.update(status='down', error='not connected', rtt=0)
+            return result
+        
+        frames = {} if frames is None else frames
+        if connection.protocol not in frames:
+            frames[connection.protocol] = WireProtocol.frame(message, 
+                                                             connection.protocol)
+        try:
+            result['response'] = connection.request(frames[connection.protocol], 
+                                                    timeout)
+        except socket.timeout:
+            result.update(status='timeout', error='timed out')
+        except Exception as e:
+            result.update(status='error', error=str(e))
+            
+        result['rtt'] = time.time() - started_at
+        if result['status'] != 'ok':
+            #  a half read reply leaves the stream unusable, the peer
+            #  is reconnected later or evicted
+            logger.warning(f'Peer {peer} failed: {result["error"]}')
+            self.pool.report_failure(peer)
+        return result
+        
+    def message_peer(self, peer: str, path: str, data: dict,
+                     timeout: Optional[float]=BROADCAST_TIMEOUT) -> Optional[dict]:
+        if peer not in self.pool:
+            logger.warning(f'Not connected to peer: {peer}')
+            return None
+        
+        return self._message_peer(peer, {'path': path, 'data': data}, 
+                                  timeout)['response']
+        
+    def broadcast(self, path: str, data: dict, 
+                  timeout: Optional[float]=BROADCAST_TIMEOUT, 
+                  quorum: Optional[int]=None) -> List[dict]:
+        peers = [c.peer for c in self.pool.get_available()]
+        if not peers:
+            return []
+        
+        message = {'path': path, 'data': data}
+        results = {peer: {'peer': peer, 'status': 'pending', 
+                          'response': None, 'error': None} 
+                   for peer in peers}
+        
+        frames = {}
+        futures = {}
+        executor = self.get_broadcast_executor()
+        for peer in peers:
+            future = executor.submit(self._message_peer, peer, message, 
+                                     timeout, frames)
+            futures[future] = peer
+            
+        succeeded = 0
+        deadline = None if timeout is None else time.time() + timeout
+        pending = set(futures)
+        while pending and (quorum is None or succeeded < quorum):
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, 
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                result = future.result()
+                results[futures[future]] = result
+                succeeded += result['status'] == 'ok'
+                
+        logger.debug(f'Broadcast {path}: {succeeded}/{len(peers)} peers answered')
+        return list(results.values())
         
     def message_all_nodes(self, path: str, data: dict) -> List[bytes]:
-        responses = []
-        for s in self.socket_list:
-            res = self.message_node(s, path, data)
-            responses.append(res)
+        responses = [r['response'] for r in self.broadcast(path, data) 
+                     if r['status'] == 'ok']
             
         logger.debug(f'Responses: {responses}')
         return responses
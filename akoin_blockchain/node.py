@@ -1,43 +1,93 @@
-from typing import Dict, List
+import os
+import threading
+import time
+
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
 
 from .account import Account
+from .block_store import BlockStore
 from .blockchain import Blockchain
 from .key_master import KeyMaster
+from .mempool import Mempool
+from .metrics import MEMPOOL_SIZE, CHAIN_LENGTH, PEERS
+from .mining import MiningEngine
 from .network_manager import NetworkManager
 from .transaction import Transaction
 
 from .helper_functions import days_ago, is_url_valid, get_logger
-from .constants import TRANSACTION_MAX_DAYS
+from .constants import (MINING_PROCESSES, TRANSACTION_MAX_DAYS, 
+                        MAX_SYNC_HEADERS, MAX_SYNC_BLOCKS,
+                        INVENTORY_BATCH_INTERVAL, MAX_INVENTORY_SIZE,
+                        MAX_PENDING_TIPS,
+                        PEER_HEALTHY, PEER_IDLE, PEER_DOWN)
 
 logger = get_logger(__name__)
 
 
 class Node:
-    def __init__(self, web_address: str):
-        self.keys = KeyMaster.generate_keys()
+    def __init__(self, web_address: str, data_dir: Optional[str]=None):
+        self.data_dir = data_dir
+        self.block_store = None
+        key_path = None
+        if data_dir is not None:
+            os.makedirs(data_dir, exist_ok=True)
+            key_path = os.path.join(data_dir, 'node_key.pem')
+            self.block_store = BlockStore(os.path.join(data_dir, 'blocks'))
+            
+        self.keys = KeyMaster.load_or_generate_keys(key_path)
         self.web_address = web_address
         self.network_manager = NetworkManager()
         self.blockchain_address = self.keys['public_key_string']
         self.account = Account(self.keys['public_key_string'])
         self.nodes = {}
-        self.transactions = set()
-        self.mempool = set()
-        self.blockchain = Blockchain(self.keys['public_key_string'])
+        self.mempool = Mempool()
+        self.inventory = []  # txids waiting to be announced
+        self.inventory_timer = None
+        self.mining_engine = MiningEngine(MINING_PROCESSES)
+        self.blockchain = Blockchain(self.keys['public_key_string'],
+                                     mining_engine=self.mining_engine,
+                                     block_store=self.block_store)
         self.account.chain = self.blockchain.chain
+        self.account.balance_index = self.blockchain.balance_index
+        self._set_up()
         logger.info('Node Created!')
+        
+    def _set_up(self):
+        self.pending_tips: Dict[str, int] = {}  # web address to height
+        self._sync_worker = None
+        self._sync_lock = threading.Lock()
+        self._inventory_lock = threading.Lock()
+        self._tips_lock = threading.Lock()
+        
+    def __getstate__(self) -> dict:
+        #  locks and the sync worker can't be copied, copies get their own
+        state = dict(self.__dict__)
+        for name in ['pending_tips', '_sync_worker', '_sync_lock', 
+                     '_inventory_lock', '_tips_lock']:
+            state.pop(name, None)
+        return state
+    
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._set_up()
+        
+    @property
+    def transactions(self) -> List[Transaction]:
+        return self.mempool.get_transactions()
  
     @staticmethod
     def is_transaction_verified(t: Transaction) -> bool:
         return KeyMaster.is_verified(t.serialized, t.signature, t.sender)
 
     def is_fee_valid(self, t: Transaction) -> bool:
-        return self.account.get_balance_of(t.sender, 
-                                           self.account.chain) >= t.fee + t.amount
+        return self.blockchain.get_balance_of(t.sender) >= t.fee + t.amount
     
     def verify_total_amounts(self) -> bool:
         total_amount = sum((t.fee + t.amount) for t in self.transactions)
         logger.debug(f'total amount: {total_amount}')
-        return self.account.get_balance() >= total_amount
+        balance = self.blockchain.get_balance_of(self.blockchain_address)
+        return balance >= total_amount
         
     def is_node_valid(self, node: dict) -> bool:
         return all([is_url_valid(node['web_address']),
@@ -76,7 +126,8 @@ class Node:
     
     def create_signed_transaction(self, receiver_address: str, amount: int, 
                                   fee: int) -> Transaction:
-        if fee < 0 or amount < 0 or amount + fee > self.account.get_balance():
+        balance = self.blockchain.get_balance_of(self.blockchain_address)
+        if fee < 0 or amount < 0 or amount + fee > balance:
             logger.error('Transaction Invalid!')
             raise Exception('Transaction Invalid!')
             
@@ -87,24 +138,77 @@ class Node:
         
         transaction.add_signature(KeyMaster.sign(transaction.serialized,
                                                  self.keys['private_key']))
-        self.transactions.add(transaction)
-        self.mempool.add(transaction.as_json())
+        self.mempool.add(transaction)
         logger.info('Transaction created and added to mempool')
         return transaction
     
     def transmit_transactions(self):
         self.verify_total_amounts()
-        self.network_manager.message_all_nodes('register_new_transactions',
-                                               self.mempool)
+        self.announce_inventory(list(self.mempool.transactions))
+        
+    def queue_inventory(self, txids: List[str]):
+        #  announcements are batched, the first queued txid starts the timer
+        if not len(self.network_manager.pool):
+            return
+        
+        with self._inventory_lock:
+            self.inventory.extend(txids)
+            if self.inventory_timer is None:
+                self.inventory_timer = threading.Timer(INVENTORY_BATCH_INTERVAL,
+                                                       self.announce_inventory)
+                self.inventory_timer.daemon = True
+                self.inventory_timer.start()
+                
+    def announce_inventory(self, txids: Optional[List[str]]=None) -> List[dict]:
+        #  peers answer with the txids they don't know and only those are 
+        #  sent, legacy peers that don't know the announcement get them all
+        with self._inventory_lock:
+            txids = self.inventory + list(txids or [])
+            self.inventory = []
+            self.inventory_timer = None
+            
+        txids = [txid for txid in dict.fromkeys(txids) if txid in self.mempool]
+        results = []
+        for i in range(0, len(txids), MAX_INVENTORY_SIZE):
+            batch = txids[i: i + MAX_INVENTORY_SIZE]
+            batch_results = self.network_manager.broadcast(
+                'announce_transactions', {'txids': batch})
+            results.extend(batch_results)
+            for r in batch_results:
+                if r['status'] != 'ok':
+                    continue
+                wanted = (r['response'].get('wanted', []) 
+                          if r['response'].get('success') else batch)
+                json_transactions = [self.mempool.get_json(txid) 
+                                     for txid in wanted if txid in self.mempool]
+                if json_transactions:
+                    self.network_manager.message_peer(r['peer'], 
+                                                      'register_new_transactions',
+                                                      json_transactions)
+        return results
+    
+    def on_transactions_announced(self, txids: List[str]) -> List[str]:
+        return [txid for txid in txids[:MAX_INVENTORY_SIZE]
+                if txid not in self.mempool and 
+                not self.blockchain.is_transaction_in_chain(txid)]
+            
+    @staticmethod
+    def verify_transaction_batch(transactions: List[Transaction]) -> List[bool]:
+        return KeyMaster.verify_batch([(t.serialized, t.signature, t.sender) 
+                                       for t in transactions])
             
     def verify_transactions(self):
-        if not all([self.is_transaction_verified(t) for t in self.transactions]):
+        if not all(self.verify_transaction_batch(self.transactions)):
             logger.error('Unverified Transaction in list')
             raise Exception('Transaction list contains non valid transactions!')
             
     def add_transaction(self, json_transaction: str) -> bool:
+        #  verified once by from_json, checked again from the cache
         t = Transaction.from_json(json_transaction)
-        
+        return self.accept_transaction(t, json_transaction)
+    
+    def accept_transaction(self, t: Transaction, 
+                           json_transaction: Optional[str]=None) -> bool:
         if not self.is_transaction_verified(t):
             logger.info('Transaction not verified')
             return False
@@ -113,62 +217,215 @@ class Node:
             logger.info('Insufficient balance for transaction')
             return False
         
-        mempool_size_before_addition = len(self.mempool)
-        self.mempool.add(json_transaction)
-        if len(self.mempool) > mempool_size_before_addition:
-            self.transactions.add(t)
+        if t.txid in self.mempool:
+            logger.info('Transaction already found in mempool')
+            return False
+        
+        if self.mempool.add(t, json_transaction):
             logger.info('transaction added to mempool')
             return True
         
-        logger.info('Transaction already found in mempool')
+        logger.info('Mempool full and transaction fee too low')
+        return False
         
     def is_transaction_executed(self, t: Transaction) -> bool:
-        for block in self.blockchain.chain[1:]:
-            try:
-                json_transactions = {bt.as_json() for bt in block.transactions}
-                return t.as_json() in json_transactions
-            except AttributeError:
-                logger.exception(f'Bad Transaction in block: {block.index}')
-                logger.critical('Bad Block in Chain!')
+        return self.blockchain.is_transaction_in_chain(t.txid)
+                
+    def expire_transactions(self) -> List[Transaction]:
+        return self.mempool.expire(time.time() - 
+                                   TRANSACTION_MAX_DAYS * 24 * 60 * 60)
                 
     def cleanup_transactions(self, new_chain=False):
         logger.info('Transaction cleanup initiated')
-        cleanup = []
-        for t in self.transactions:
-            if days_ago(t.timestamp) > TRANSACTION_MAX_DAYS:
-                cleanup.append(t)
-            elif new_chain and self.is_transaction_executed(t):
-                cleanup.append(t)
-                
-        self.transactions.difference_update(cleanup)
-        self.mempool = {t.as_json() for t in self.transactions}
+        self.expire_transactions()
+        if new_chain:
+            self.mempool.remove_transactions(
+                [t for t in self.transactions if self.is_transaction_executed(t)])
         logger.info('Transaction cleanup done')
         
-    def receive_transactions(self, json_transactions: str):
-        for jt in json_transactions:
-            self.add_transaction(jt)
-            self.cleanup_transactions()
+    def receive_transactions(self, json_transactions: List[str]):
+        #  the batch is parsed and verified once, expired transactions
+        #  are swept once at the end instead of after every addition
+        json_transactions = list(json_transactions)
+        transactions = [Transaction.from_json(jt, verify=False) 
+                        for jt in json_transactions]
+        verified = self.verify_transaction_batch(transactions)
+        added = [t.txid for t, jt, is_verified 
+                 in zip(transactions, json_transactions, verified)
+                 if is_verified and self.accept_transaction(t, jt)]
+        self.expire_transactions()
+        self.queue_inventory(added)
+        
+        if not all(verified):
+            logger.error('Unverified Transaction in batch')
+            raise Exception('Transaction batch contains non valid transactions!')
             
     def remove_executed_transactions(self, transactions: List[Transaction]):
-        self.mempool.difference_update({t.as_json() for t in transactions})
-        self.transactions = {Transaction.from_json(jt) for jt in self.mempool}
+        self.mempool.remove_transactions(transactions)
         
     def request_chain_replace(self):
         self.network_manager.message_all_nodes('replace_chain', 
-                                               self.blockchain.chain)
+                                               self.blockchain.get_chain())
+        
+    def get_tip(self) -> dict:
+        return {'height': self.blockchain.chain_length,
+                'hash': self.blockchain.get_last_block().hashcode,
+                'web_address': self.web_address}
+        
+    def announce_tip(self):
+        #  peers pull what they are missing, legacy peers that don't know
+        #  the announcement get the full chain pushed as before
+        results = self.network_manager.broadcast('announce_tip', self.get_tip())
+        for r in results:
+            if r['status'] == 'ok' and not r['response'].get('success'):
+                self.network_manager.message_peer(r['peer'], 'replace_chain', 
+                                                  self.blockchain.get_chain())
+                
+    def on_tip_announced(self, tip: dict) -> bool:
+        if tip['height'] <= self.blockchain.chain_length:
+            return False
+        
+        #  one worker syncs at a time, each peer's highest tip waits for it
+        with self._tips_lock:
+            web_address = tip['web_address']
+            if (web_address not in self.pending_tips and 
+                    len(self.pending_tips) >= MAX_PENDING_TIPS):
+                logger.info(f'Too many pending tips, dropping {web_address}')
+                return False
+            self.pending_tips[web_address] = max(
+                tip['height'], self.pending_tips.get(web_address, 0))
+            if self._sync_worker is None:
+                self._sync_worker = threading.Thread(target=self.run_sync_worker,
+                                                     name='sync', daemon=True)
+                self._sync_worker.start()
+        return True
+    
+    def run_sync_worker(self):
+        while True:
+            with self._tips_lock:
+                if not self.pending_tips:
+                    self._sync_worker = None
+                    return
+                web_address, height = self.pending_tips.popitem()
+                
+            if height <= self.blockchain.chain_length:
+                continue
+            try:
+                self.sync_with_peer(web_address)
+            except Exception:
+                logger.exception(f'Sync with {web_address} failed')
+    
+    def fetch_headers(self, peer: str) -> Optional[List[dict]]:
+        headers = []
+        locator = self.blockchain.get_block_locator()
+        while True:
+            res = self.network_manager.message_peer(peer, 'get_headers', 
+                                                    {'locator': locator,
+                                                     'max_headers': MAX_SYNC_HEADERS})
+            if not res or not res.get('success'):
+                return None
+            
+            headers.extend(res['headers'])
+            if len(res['headers']) < MAX_SYNC_HEADERS:
+                return headers
+            locator = [headers[-1]['hashcode']]
+            
+    def fetch_blocks(self, peer: str, 
+                     hashes: List[str]) -> Optional[List[Blockchain.Block]]:
+        blocks = []
+        for i in range(0, len(hashes), MAX_SYNC_BLOCKS):
+            res = self.network_manager.message_peer(peer, 'get_blocks', 
+                                                    {'hashes': hashes[i: i + MAX_SYNC_BLOCKS]})
+            if not res or not res.get('success'):
+                return None
+            blocks.extend(res['blocks'])
+            
+        if [block.hashcode for block in blocks] != hashes:
+            logger.info('Peer sent blocks not matching its headers')
+            return None
+        return blocks
+    
+    def sync_with_peer(self, web_address: str) -> bool:
+        peer = urlparse(web_address).netloc
+        with self._sync_lock:
+            if peer not in self.network_manager.peer_sockets:
+                self.network_manager.register_new_node(web_address)
+                
+            headers = self.fetch_headers(peer)
+            if not headers:
+                logger.info(f'Nothing to sync from {peer}')
+                return False
+            
+            fork_height = headers[0]['index']
+            if fork_height + len(headers) <= self.blockchain.chain_length:
+                logger.info(f'Chain of {peer} is not longer')
+                return False
+            
+            if not self.blockchain.is_header_chain_valid(headers):
+                logger.info(f'Invalid headers from {peer}')
+                return False
+            
+            blocks = self.fetch_blocks(peer, [h['hashcode'] for h in headers])
+            reorganized = (blocks is not None and 
+                           self.blockchain.reorganize(fork_height, blocks))
+            if not reorganized:
+                logger.info(f'Sync with {peer} failed')
+                return False
+            
+            self.on_chain_replaced(*reorganized)
+            logger.info(f'Synced {len(blocks)} blocks from {peer}')
+            return True
+        
+    def on_chain_replaced(self, disconnected: List[Blockchain.Block], 
+                          connected: List[Blockchain.Block]):
+        #  only the blocks that changed are looked at, transactions of 
+        #  the disconnected ones go back to the mempool
+        self.mining_engine.cancel()
+        for block in connected:
+            self.mempool.remove_transactions(block.transactions)
+            
+        returned = 0
+        for block in disconnected:
+            if block.index == 0:
+                continue  # genesis mints without a signature
+            for t in block.transactions:
+                if (days_ago(t.timestamp) <= TRANSACTION_MAX_DAYS and
+                    not self.is_transaction_executed(t) and 
+                    self.mempool.add(t)):
+                    returned += 1
+                    
+        if returned:
+            logger.info(f'{returned} transactions returned to the mempool')
+        self.account.chain = self.blockchain.chain
         
     def mine_new_block(self):
-        executed_transactions = self.blockchain.create_block(self.transactions)
+        executed_transactions = self.blockchain.create_block(
+            list(self.mempool.iter_by_fee()))
         if len(executed_transactions) > 0:
             self.remove_executed_transactions(executed_transactions)
-            self.request_chain_replace()
+            self.announce_tip()
+            return
         logger.warning('Block mined with no executed transactions')
             
     def replace_chain(self, chain: List[Blockchain.Block]) -> bool:
-        if self.blockchain.replace_chain(chain):
-            self.cleanup_transactions(new_chain=True)
-            self.account.chain = chain
+        reorganized = self.blockchain.reorganize_to(chain)
+        if reorganized:
+            self.on_chain_replaced(*reorganized)
             logger.info('chain replaced')
             return True
         logger.info('chain not replaced')
         return False
+    
+    def update_metrics(self):
+        #  gauges are read from the node when metrics are collected, so the
+        #  hot paths don't pay for them
+        MEMPOOL_SIZE.set(len(self.mempool))
+        CHAIN_LENGTH.set(self.blockchain.chain_length)
+        states = [h['state'] for h in self.network_manager.get_peer_health().values()]
+        for state in (PEER_HEALTHY, PEER_IDLE, PEER_DOWN):
+            PEERS.set(states.count(state), (state,))
+    
+    def close(self):
+        self.mining_engine.shutdown()
+        self.network_manager.close()
+        self.blockchain.close()
@@ -1,8 +1,15 @@
+import time
+
 from typing import List
 
 from akoin_blockchain.helper_functions import get_logger
+from akoin_blockchain.metrics import registry, REQUEST_SECONDS, REQUEST_ERRORS
 from akoin_blockchain.node import Node
 
+from akoin_blockchain.constants import (LEGACY_PROTOCOL_VERSION, 
+                                        PROTOCOL_VERSION, MAX_SYNC_HEADERS,
+                                        MAX_SYNC_BLOCKS)
+
 
 logger = get_logger(__name__)
 
@@ -42,7 +49,7 @@ class RequestHandler:
     def add_transaction(node: Node, data: dict) -> dict:
         try:
             t = node.create_signed_transaction(**data)
-            node.transmit_transactions()
+            node.queue_inventory([t.txid])
             return {'message': 'new transaction created',
                     'transaction': t.as_json(), 'success': True}
         except:
@@ -86,14 +93,106 @@ class RequestHandler:
             logger.exception('bad transaction data')
             return {'message': 'bad transaction data', 'success': False}
     
+    @staticmethod
+    def announce_transactions(node: Node, data: dict) -> dict:
+        try:
+            return {'message': 'transactions announced',
+                    'wanted': node.on_transactions_announced(data['txids']),
+                    'success': True}
+        except:
+            logger.exception('bad inventory data')
+            return {'message': 'bad inventory data', 'success': False}
+    
+    @staticmethod
+    def get_tip(node: Node, data: dict) -> dict:
+        return dict(node.get_tip(), message='got tip', success=True)
+    
+    @staticmethod
+    def announce_tip(node: Node, data: dict) -> dict:
+        try:
+            syncing = node.on_tip_announced(data)
+            return {'message': 'tip announced', 'syncing': syncing, 
+                    'success': True}
+        except:
+            logger.exception('bad tip data')
+            return {'message': 'bad tip data', 'success': False}
+        
+    @staticmethod
+    def get_headers(node: Node, data: dict) -> dict:
+        max_headers = min(data.get('max_headers', MAX_SYNC_HEADERS), 
+                          MAX_SYNC_HEADERS)
+        return {'message': 'got headers',
+                'headers': node.blockchain.get_headers(data['locator'], 
+                                                       max_headers),
+                'success': True}
+    
+    @staticmethod
+    def get_blocks(node: Node, data: dict) -> dict:
+        return {'message': 'got blocks',
+                'blocks': node.blockchain.get_blocks(data['hashes'][:MAX_SYNC_BLOCKS]),
+                'success': True}
+    
+    @staticmethod
+    def get_transaction(node: Node, data: dict) -> dict:
+        location = node.blockchain.get_transaction_location(data['txid'])
+        if location is None:
+            return {'message': 'transaction not found', 'success': False}
+        
+        height, position = location
+        t = node.blockchain.chain[height].transactions[position]
+        return {'message': 'got transaction',
+                'transaction': t.as_json(),
+                'height': height,
+                'position': position,
+                'success': True}
+    
+    @staticmethod
+    def ping(node: Node, data: dict) -> dict:
+        return {'message': 'pong', 'success': True}
+    
+    @staticmethod
+    def get_metrics(node: Node, data: dict) -> dict:
+        node.update_metrics()
+        return {'message': 'got metrics',
+                'metrics': registry.collect(),
+                'success': True}
+    
+    @staticmethod
+    def negotiate_protocol(node: Node, data: dict) -> dict:
+        version = LEGACY_PROTOCOL_VERSION
+        if PROTOCOL_VERSION in data.get('versions', []):
+            version = PROTOCOL_VERSION
+        return {'message': f'protocol version {version}',
+                'version': version,
+                'success': True}
+    
+    @staticmethod
+    def get_path_label(req: dict) -> str:
+        #  unknown paths share a label, so bad requests can't grow the metrics
+        path = req.get('path') if isinstance(req, dict) else None
+        return path if path in REQUEST_PATHS else 'unknown'
+    
     @staticmethod
     def handle_request(node: Node, req: dict) -> dict:
+        started_at = time.perf_counter()
+        path = RequestHandler.get_path_label(req)
         try:
-            logger.info(f'got request: {req}')
-            return getattr(RequestHandler, req['path'])(node, req['data'])
-        except AttributeError:
-            logger.exception(f'bad request path {req}')
-            return {'message': f'unknown request path {req}'}
+            #  the request itself can be a whole chain, only its path is logged
+            logger.debug('got request: %s', path)
+            if path == 'unknown':
+                REQUEST_ERRORS.inc(labels=(path,))
+                request_path = req.get('path') if isinstance(req, dict) else None
+                logger.warning('bad request path %s', request_path)
+                return {'message': f'unknown request path {request_path}'}
+            return getattr(RequestHandler, path)(node, req['data'])
         except Exception as e:
+            REQUEST_ERRORS.inc(labels=(path,))
             logger.exception('Unknown Error occured!')
             return {'message': f'Internal Error: {e}'}
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started_at, (path,))
+
+
+REQUEST_PATHS = {name for name, value in vars(RequestHandler).items()
+                 if isinstance(value, staticmethod)} - {'get_path_label',
+                                                        'handle_request'}
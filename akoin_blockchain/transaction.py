@@ -1,6 +1,8 @@
 import json
 import time
 
+from hashlib import sha256
+
 from typing import Optional
 from ellipticcurve.signature import Signature
 
@@ -11,8 +13,14 @@ logger = get_logger(__name__)
 
 
 class Transaction:
+    __slots__ = ('sender', 'receiver', 'amount', 'fee', 'timestamp', 
+                 'signature', '_serialized', '_txid')
+    serialized_fields = ('sender', 'receiver', 'amount', 'fee', 'timestamp')
+    
     def __init__(self, sender: str, receiver: str, amount: int, fee: int, 
                  timestamp: Optional[float]=None):
+        object.__setattr__(self, '_serialized', None)
+        object.__setattr__(self, '_txid', None)
         self.fee = fee
         self.sender = sender
         self.receiver = receiver
@@ -22,15 +30,66 @@ class Transaction:
         else:
             self.timestamp = time.time()
         logger.debug('New transaction created')
+        
+    def __setattr__(self, name: str, value):
+        #  fields are set once, the txid (and so sets, dicts and the 
+        #  mempool's indexes) can't go stale. use replace for a changed copy
+        if hasattr(self, name):
+            raise AttributeError(f'Transaction {name} can\'t be changed')
+        object.__setattr__(self, name, value)
+        
+    def __getstate__(self) -> dict:
+        #  the same state as before slots, so legacy peers can unpickle it
+        return {name: getattr(self, name) 
+                for name in self.serialized_fields + ('signature',) 
+                if hasattr(self, name)}
+    
+    def __setstate__(self, state):
+        #  legacy pickles hold a dict, slot pickles a (dict, slots) pair
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+        object.__setattr__(self, '_serialized', None)
+        object.__setattr__(self, '_txid', None)
+        for name, value in state.items():
+            if name in self.serialized_fields or name == 'signature':
+                object.__setattr__(self, name, value)
+            
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return self.txid == other.txid
+    
+    def __hash__(self) -> int:
+        return hash(self.txid)
+    
+    def replace(self, **changes) -> 'Transaction':
+        #  the signature is carried over unchecked unless one is given
+        fields = {name: getattr(self, name) for name in self.serialized_fields}
+        fields.update(changes)
+        signature = fields.pop('signature', getattr(self, 'signature', None))
+        t = Transaction(**fields)
+        if signature is not None:
+            t.signature = signature
+        return t
                   
     @property
     def serialized(self) -> str:
-        return json.dumps({'sender': self.sender,
-                           'receiver': self.receiver,
-                           'amount': self.amount,
-                           'fee': self.fee,
-                           'timestamp': self.timestamp}, 
-                          sort_keys=True)
+        if self._serialized is None:
+            object.__setattr__(self, '_serialized', 
+                               json.dumps({'sender': self.sender,
+                                           'receiver': self.receiver,
+                                           'amount': self.amount,
+                                           'fee': self.fee,
+                                           'timestamp': self.timestamp}, 
+                                          sort_keys=True))
+        return self._serialized
+    
+    @property
+    def txid(self) -> str:
+        if self._txid is None:
+            object.__setattr__(self, '_txid', 
+                               sha256(self.serialized.encode('utf-8')).hexdigest())
+        return self._txid
     
     def add_signature(self, signature: Signature):
         if not KeyMaster.is_verified(self.serialized, 
@@ -47,13 +106,29 @@ class Transaction:
                            'signature': self.signature._toString()
                            })
     
+    def as_dict(self) -> dict:
+        signature = getattr(self, 'signature', None)
+        return {'serialized': self.serialized,
+                'signature': signature._toString() if signature else None}
+    
     @classmethod
-    def from_json(cls, json_transaction: str) -> 'Transaction':
+    def from_dict(cls, obj: dict) -> 'Transaction':
+        #  signatures are checked when blocks and transactions are validated
+        t = cls(**json.loads(obj['serialized']))
+        if obj['signature'] is not None:
+            t.signature = KeyMaster.signature_from_string(obj['signature'])
+        return t
+    
+    @classmethod
+    def from_json(cls, json_transaction: str, verify=True) -> 'Transaction':
         obj = json.loads(json_transaction)
         signature = KeyMaster.signature_from_string(obj['signature'])
         init_dict = json.loads(obj['serialized'])
         
         t = cls(**init_dict)
-        t.add_signature(signature)
+        if verify:
+            t.add_signature(signature)
+        else:
+            t.signature = signature
         logger.debug(f'Transaction recovered from json: {t.serialized}')
         return t
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import pickle
+import socket
+import struct
+
+from typing import Optional, Tuple
+
+from .blockchain import Blockchain
+from .helper_functions import get_logger
+from .metrics import BYTES_SENT, BYTES_RECEIVED
+from .transaction import Transaction
+
+from .constants import (HEADERSIZE, MAX_MESSAGE_SIZE, MAX_FRAME_SIZE,
+                        FRAME_MAGIC, FRAME_BUFFER_SIZE, LEGACY_PROTOCOL_VERSION,
+                        PROTOCOL_VERSION)
+
+logger = get_logger(__name__)
+
+#  magic, protocol version, flags, body length
+FRAME_HEADER = struct.Struct('!4sBBI')
+assert FRAME_HEADER.size == HEADERSIZE  # frames are sniffed by header size
+
+
+class WireEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Blockchain.Block):
+            return {'__block__': o.as_dict()}
+        if isinstance(o, Transaction):
+            return {'__transaction__': o.as_dict()}
+        if isinstance(o, (set, frozenset)):
+            return {'__set__': list(o)}
+        if isinstance(o, bytes):
+            return {'__bytes__': o.hex()}
+        return super().default(o)
+
+
+class WireProtocol:
+
+    @staticmethod
+    def decode_object(obj: dict):
+        if len(obj) != 1:
+            return obj
+        if '__block__' in obj:
+            return Blockchain.Block.from_dict(obj['__block__'])
+        if '__transaction__' in obj:
+            return Transaction.from_dict(obj['__transaction__'])
+        if '__set__' in obj:
+            return set(obj['__set__'])
+        if '__bytes__' in obj:
+            return bytes.fromhex(obj['__bytes__'])
+        return obj
+
+    @staticmethod
+    def encode(message: dict) -> bytes:
+        return json.dumps(message, cls=WireEncoder,
+                          separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def decode(body: memoryview) -> dict:
+        return json.loads(str(body, 'utf-8'),
+                          object_hook=WireProtocol.decode_object)
+
+    @staticmethod
+    def frame(message: dict,
+              version: Optional[int]=PROTOCOL_VERSION) -> bytes:
+        if version == LEGACY_PROTOCOL_VERSION:
+            msg = pickle.dumps(message)
+            return bytes(f"{len(msg):<{HEADERSIZE}}", 'utf-8') + msg
+
+        body = WireProtocol.encode(message)
+        if len(body) > MAX_FRAME_SIZE:
+            raise Exception(f'Frame too large: {len(body)}/{MAX_FRAME_SIZE}')
+
+        return FRAME_HEADER.pack(FRAME_MAGIC, version, 0, len(body)) + body
+
+    @staticmethod
+    def send_message(s: socket.socket, message: dict,
+                     version: Optional[int]=PROTOCOL_VERSION) -> int:
+        frame = WireProtocol.frame(message, version)
+        s.sendall(frame)
+        BYTES_SENT.inc(len(frame))
+        return len(frame)
+
+
+class FrameReader:
+    #  pickled legacy frames are only read from peers negotiated as legacy,
+    #  anyone else could have us unpickle arbitrary objects
+    def __init__(self, size: Optional[int]=FRAME_BUFFER_SIZE,
+                 allow_legacy: Optional[bool]=False):
+        self.allow_legacy = allow_legacy
+        self.header = bytearray(HEADERSIZE)
+        self.buffer = bytearray(size)
+
+    @staticmethod
+    def recv_exactly(s: socket.socket, view: memoryview) -> int:
+        received = 0
+        while received < len(view):
+            n = s.recv_into(view[received:])
+            if n == 0:
+                break
+            received += n
+
+        return received
+
+    def _read_body(self, s: socket.socket, length: int) -> memoryview:
+        if length > len(self.buffer):
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+
+        body = memoryview(self.buffer)[:length]
+        if self.recv_exactly(s, body) < length:
+            raise ConnectionError('Connection closed mid message')
+
+        return body
+
+    def parse_header(self) -> Tuple[int, int]:
+        if self.header.startswith(FRAME_MAGIC):
+            _, version, _, length = FRAME_HEADER.unpack(self.header)
+            if version != PROTOCOL_VERSION:
+                raise Exception(f'Unsupported protocol version: {version}')
+            max_size = MAX_FRAME_SIZE
+        elif self.allow_legacy:
+            version = LEGACY_PROTOCOL_VERSION
+            length = int(self.header)
+            max_size = MAX_MESSAGE_SIZE
+        else:
+            raise Exception('Legacy protocol not allowed!')
+
+        if length > max_size:
+            logger.error(f'Message size Exeeded: {length}/{max_size}')
+            raise Exception('Message Size Exeeded!')
+
+        return version, length
+
+    @staticmethod
+    def decode_body(body: memoryview, version: int) -> dict:
+        if version == LEGACY_PROTOCOL_VERSION:
+            return pickle.loads(body)
+        return WireProtocol.decode(body)
+
+    def read_message(self, s: socket.socket) -> Tuple[Optional[dict],
+                                                       Optional[int]]:
+        received = self.recv_exactly(s, memoryview(self.header))
+        if received == 0:
+            return None, None
+        if received < HEADERSIZE:
+            raise ConnectionError('Connection closed mid header')
+
+        version, length = self.parse_header()
+        body = self._read_body(s, length)
+        BYTES_RECEIVED.inc(HEADERSIZE + length)
+        return self.decode_body(body, version), version
+
+    async def read_message_async(self, reader: asyncio.StreamReader
+                                 ) -> Tuple[Optional[dict], Optional[int]]:
+        try:
+            self.header[:] = await reader.readexactly(HEADERSIZE)
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) == 0:
+                return None, None
+            raise ConnectionError('Connection closed mid header')
+
+        version, length = self.parse_header()
+        body = memoryview(await reader.readexactly(length))
+        BYTES_RECEIVED.inc(HEADERSIZE + length)
+        return self.decode_body(body, version), version
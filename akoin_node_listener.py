@@ -1,45 +1,54 @@
+import argparse
+import asyncio
 import concurrent.futures
 import socket
 import os
 
 from dotenv import load_dotenv
-from typing import Tuple
+from typing import Optional, Tuple
 
 from akoin_blockchain.helper_functions import get_logger
-from akoin_blockchain.network_manager import NetworkManager
+from akoin_blockchain.metrics import MetricsServer, BYTES_SENT
 from akoin_blockchain.node import Node
 from akoin_blockchain.request_handler import RequestHandler
+from akoin_blockchain.wire_protocol import FrameReader, WireProtocol
 
-from akoin_blockchain.constants import PORT, LOCAL_HOST, MAX_CONNECTIONS
+from akoin_blockchain.constants import (PORT, LOCAL_HOST, MAX_CONNECTIONS,
+                                        ASYNC_MAX_CONNECTIONS, 
+                                        ASYNC_MAX_PENDING_REQUESTS,
+                                        ASYNC_IDLE_TIMEOUT, ASYNC_INLINE_PATHS,
+                                        ASYNC_LISTEN_BACKLOG, METRICS_PORT,
+                                        SERVER_IDLE_TIMEOUT)
 
 load_dotenv()
 logger = get_logger(__name__)
 dry_run = int(os.getenv('DRY_RUN'))
+server_mode = os.getenv('SERVER_MODE', 'threads')
+data_dir = os.getenv('DATA_DIR') or None
+metrics_port = int(os.getenv('METRICS_PORT') or METRICS_PORT)
 
 def on_client_send_message(net_objects: Tuple['socket.socket', Node]):
     client = net_objects[0]
     node = net_objects[1]
-    request = None
-    new_connection = True
-    serialized_request = b''
+    frame_reader = FrameReader()
     try:
-        while serialized_request != b'' or new_connection:
-            new_connection = False
-            serialized_request = NetworkManager.parse_message_buffer(client)
-            request = NetworkManager.deserialize(serialized_request)
+        while True:
+            request, version = frame_reader.read_message(client)
+            if request is None:
+                break
             response = RequestHandler.handle_request(node, request)
-            serialized_response = NetworkManager.serialize_message(response)
-            client.send(serialized_response)
+            WireProtocol.send_message(client, response, version)
         logger.debug('socket closed (Buffer drained)')
-        client.close()
     except socket.timeout:
         logger.debug('socket closed (Timeout)')
+    except Exception:
+        logger.exception('socket closed (Bad message)')
+    finally:
         client.close()
         
-def make_listener_socket() -> socket.socket:
+def make_listener_socket(port: int) -> socket.socket:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     socket_bound = False
-    port = PORT
     while not socket_bound:
         try:
             s.bind((LOCAL_HOST, port))
@@ -56,27 +65,127 @@ def make_listener_socket() -> socket.socket:
     s.settimeout(1)  # seconds
     return s
 
-def make_node(sockname: tuple):
+def make_node(sockname: tuple, data_dir: str):
     host = sockname[0]
     port = sockname[1]
     web_address = f'http://{host}:{port}'
     logger.info(f'Node litening on {web_address}')
-    node = Node(web_address)
+    node = Node(web_address, data_dir)
     logger.info(f'Node blockchain address: {node.blockchain_address}')
     return node
 
+def start_metrics_server(port: int, node: Node) -> Optional[MetricsServer]:
+    if not port:
+        return None
+    metrics_server = MetricsServer(LOCAL_HOST, port, node.update_metrics)
+    metrics_server.start()
+    return metrics_server
+
+def close_metrics_server(metrics_server: Optional[MetricsServer]):
+    if metrics_server is not None:
+        metrics_server.close()
+
+class AsyncListener:
+    def __init__(self, node: Node, executor: concurrent.futures.Executor):
+        self.node = node
+        self.executor = executor
+        self.connections = 0
+        #  once all slots are taken connections stop being read from,
+        #  which pushes back on peers through their tcp windows
+        self.request_slots = asyncio.Semaphore(ASYNC_MAX_PENDING_REQUESTS)
+        
+    async def handle_request(self, request: dict) -> dict:
+        if isinstance(request, dict) and request.get('path') in ASYNC_INLINE_PATHS:
+            return RequestHandler.handle_request(self.node, request)
+        
+        async with self.request_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, 
+                                              RequestHandler.handle_request,
+                                              self.node, request)
+        
+    async def on_connection(self, reader: asyncio.StreamReader, 
+                            writer: asyncio.StreamWriter):
+        if self.connections >= ASYNC_MAX_CONNECTIONS:
+            logger.warning('Connection limit reached, connection refused')
+            writer.close()
+            return
+        
+        self.connections += 1
+        frame_reader = FrameReader()
+        try:
+            while True:
+                #  requests on a connection are handled one at a time
+                request, version = await asyncio.wait_for(
+                    frame_reader.read_message_async(reader), ASYNC_IDLE_TIMEOUT)
+                if request is None:
+                    break
+                response = await self.handle_request(request)
+                frame = WireProtocol.frame(response, version)
+                writer.write(frame)
+                BYTES_SENT.inc(len(frame))
+                await writer.drain()
+            logger.debug('socket closed (Buffer drained)')
+        except asyncio.TimeoutError:
+            logger.debug('socket closed (Timeout)')
+        except Exception:
+            logger.exception('socket closed (Bad message)')
+        finally:
+            self.connections -= 1
+            writer.close()
+            
+    async def serve(self, listener: socket.socket):
+        server = await asyncio.start_server(self.on_connection, 
+                                            sock=listener,
+                                            backlog=ASYNC_LISTEN_BACKLOG)
+        async with server:
+            await server.serve_forever()
+            
+def main_async(args: argparse.Namespace):
+    listener = make_listener_socket(args.port)
+    node = make_node(listener.getsockname(), args.data_dir)
+    metrics_server = start_metrics_server(args.metrics_port, node)
+    
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        try:
+            asyncio.run(AsyncListener(node, executor).serve(listener))
+        except KeyboardInterrupt:
+            logger.info('Keyboard Interrupt closing')
+        finally:
+            listener.close()
+            close_metrics_server(metrics_server)
+            node.close()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Runs an AKoin node')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--server-mode', choices=['threads', 'asyncio'], 
+                        default=server_mode)
+    parser.add_argument('--data-dir', default=data_dir,
+                        help='keeps blocks and keys on disk when set')
+    parser.add_argument('--metrics-port', type=int, default=metrics_port,
+                        help='serves prometheus metrics over http when set')
+    return parser.parse_args()
+
 def main():
-    listener = make_listener_socket()
-    node = make_node(listener.getsockname())
+    args = parse_args()
+    if args.server_mode == 'asyncio':
+        return main_async(args)
+    
+    listener = make_listener_socket(args.port)
+    node = make_node(listener.getsockname(), args.data_dir)
+    metrics_server = start_metrics_server(args.metrics_port, node)
     
     with concurrent.futures.ThreadPoolExecutor() as executor:
         while True:
             try:
                 client, address = listener.accept()
-                client.settimeout(10)  # seconds
+                client.settimeout(SERVER_IDLE_TIMEOUT)
                 executor.submit(on_client_send_message, (client, node))
             except KeyboardInterrupt:
                 listener.close()
+                close_metrics_server(metrics_server)
+                node.close()
                 logger.info('Keyboard Interrupt closing')
                 return
             except socket.timeout:
@@ -0,0 +1,3 @@
+from .cluster import LoopbackCluster
+from .generators import WorkloadGenerator
+from .suite import BENCHMARKS, BenchmarkContext, compare, run_suite
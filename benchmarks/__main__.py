@@ -0,0 +1,71 @@
+import argparse
+import json
+import logging
+import sys
+
+from .suite import (BENCHMARKS, BenchmarkContext, compare, run_suite,
+                    DEFAULT_SCALE, DEFAULT_REPEAT, MAX_SIGNED_TRANSACTIONS,
+                    LOOPBACK_NODES, REGRESSION_THRESHOLD)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmarks of the AKoin hot paths, printed as json')
+    parser.add_argument('names', nargs='*', choices=[[]] + list(BENCHMARKS),
+                        help='benchmarks to run, all of them by default')
+    parser.add_argument('--scale', type=int, default=DEFAULT_SCALE,
+                        help='transactions per workload (1000 to 1000000)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-signed', type=int, 
+                        default=MAX_SIGNED_TRANSACTIONS,
+                        help='cap on workloads that need signatures')
+    parser.add_argument('--nodes', type=int, default=LOOPBACK_NODES,
+                        help='nodes of the loopback scenario')
+    parser.add_argument('--output', help='file the results are written to')
+    parser.add_argument('--baseline', 
+                        help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, 
+                        default=REGRESSION_THRESHOLD,
+                        help='slowdown reported as a regression')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='of the node, logging is costly and skews timings')
+    return parser.parse_args()
+
+
+def set_node_log_level(level: str):
+    #  every module logger sets its own level, so each one is set here
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('akoin_blockchain'):
+            logging.getLogger(name).setLevel(level)
+
+
+def main() -> int:
+    args = parse_args()
+    set_node_log_level(args.log_level.upper())
+    context = BenchmarkContext(args.scale, args.repeat, args.seed,
+                               args.max_signed, args.nodes)
+    results = run_suite(context, args.names)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['comparison'] = compare(results, json.load(f), 
+                                            args.threshold)
+            
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    
+    regressed = [c['name'] for c in results.get('comparison', []) 
+                 if c['regressed']]
+    if regressed:
+        print(f'Regressions: {", ".join(regressed)}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
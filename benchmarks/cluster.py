@@ -0,0 +1,101 @@
+import copy
+import socket
+import threading
+import time
+
+from typing import Callable, List, Optional
+
+from akoin_blockchain.helper_functions import get_logger
+from akoin_blockchain.node import Node
+from akoin_blockchain.request_handler import RequestHandler
+from akoin_blockchain.wire_protocol import FrameReader, WireProtocol
+
+from akoin_blockchain.constants import LOCAL_HOST, MAX_CONNECTIONS
+
+logger = get_logger(__name__)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float,
+               interval: Optional[float]=0.01) -> bool:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+class LoopbackCluster:
+    #  nodes of this process, each behind its own localhost listener. they
+    #  share the first node's genesis block, and the first node is
+    #  connected to all the others
+    def __init__(self, node_count: int):
+        self.nodes: List[Node] = []
+        self.listeners: List[socket.socket] = []
+        self._stop_event = threading.Event()
+
+        for _ in range(node_count):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind((LOCAL_HOST, 0))
+            listener.listen(MAX_CONNECTIONS)
+            listener.settimeout(0.1)
+            host, port = listener.getsockname()
+            web_address = f'http://{host}:{port}'
+
+            if self.nodes:
+                node = copy.deepcopy(self.nodes[0])
+                node.web_address = web_address
+            else:
+                node = Node(web_address)
+            self.nodes.append(node)
+            self.listeners.append(listener)
+            threading.Thread(target=self.serve, args=(listener, node),
+                             daemon=True).start()
+
+        for node in self.nodes[1:]:
+            self.nodes[0].network_manager.register_new_node(node.web_address)
+
+    @property
+    def origin(self) -> Node:
+        return self.nodes[0]
+
+    @property
+    def peers(self) -> List[Node]:
+        return self.nodes[1:]
+
+    def serve(self, listener: socket.socket, node: Node):
+        while not self._stop_event.is_set():
+            try:
+                client, _ = listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.serve_client, args=(client, node),
+                             daemon=True).start()
+
+    @staticmethod
+    def serve_client(client: socket.socket, node: Node):
+        frame_reader = FrameReader()
+        try:
+            request, version = frame_reader.read_message(client)
+            while request is not None:
+                response = RequestHandler.handle_request(node, request)
+                WireProtocol.send_message(client, response, version)
+                request, version = frame_reader.read_message(client)
+        except OSError:
+            logger.debug('loopback connection closed')
+        finally:
+            client.close()
+
+    def is_converged(self) -> bool:
+        tip = self.origin.blockchain.get_last_block().hashcode
+        return all(node.blockchain.get_last_block().hashcode == tip
+                   for node in self.peers)
+
+    def close(self):
+        self._stop_event.set()
+        for listener in self.listeners:
+            listener.close()
+        for node in self.nodes:
+            node.close()
@@ -0,0 +1,99 @@
+import random
+
+from typing import List, Optional
+
+from ellipticcurve.curve import secp256k1
+from ellipticcurve.privateKey import PrivateKey
+
+from akoin_blockchain.blockchain import Blockchain
+from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.mempool import Mempool
+from akoin_blockchain.mining import MiningEngine
+from akoin_blockchain.transaction import Transaction
+
+from akoin_blockchain.constants import INITIAL_CURRENCY_SUPPLY
+
+MAX_AMOUNT = 100
+MAX_FEE = 10
+
+
+class WorkloadGenerator:
+    #  keys, amounts, fees and who pays whom come from a seeded rng, so runs
+    #  at the same scale and seed build the same workload. with a fixed 
+    #  timestamp, counted up per transaction, txids repeat too. signatures 
+    #  don't, ecdsa signs with a random nonce
+    def __init__(self, wallet_count: Optional[int]=100,
+                 seed: Optional[int]=0,
+                 timestamp: Optional[float]=None):
+        self.random = random.Random(seed)
+        self.timestamp = timestamp
+        self.transactions_made = 0
+        self.wallets = [self.make_keys() for _ in range(wallet_count)]
+        self.genesis_keys = self.wallets[0]
+        self.mining_engine = MiningEngine(processes=1)
+
+    def make_keys(self) -> dict:
+        secret = self.random.randrange(1, secp256k1.N)
+        return KeyMaster.keys_from_private_key(PrivateKey(secret=secret))
+
+    def next_timestamp(self) -> Optional[float]:
+        self.transactions_made += 1
+        if self.timestamp is None:
+            return None
+        return self.timestamp + self.transactions_made
+
+    @property
+    def genesis_address(self) -> str:
+        return self.genesis_keys['public_key_string']
+
+    def make_transaction(self, sender_keys: Optional[dict]=None,
+                         amount: Optional[int]=None,
+                         signed: Optional[bool]=True) -> Transaction:
+        sender_keys = sender_keys or self.random.choice(self.wallets)
+        receiver_keys = self.random.choice(self.wallets)
+        t = Transaction(sender_keys['public_key_string'],
+                        receiver_keys['public_key_string'],
+                        amount or self.random.randint(1, MAX_AMOUNT),
+                        self.random.randint(0, MAX_FEE),
+                        self.next_timestamp())
+        if signed:
+            t.add_signature(KeyMaster.sign(t.serialized,
+                                           sender_keys['private_key']))
+        return t
+
+    def make_funding_transactions(self, signed: Optional[bool]=True
+                                  ) -> List[Transaction]:
+        #  the genesis supply is shared out so every wallet can spend
+        share = INITIAL_CURRENCY_SUPPLY // (2 * len(self.wallets))
+        return [self.make_transaction(self.genesis_keys, share, signed)
+                for _ in self.wallets[1:]]
+
+    def make_transactions(self, n: int,
+                          signed: Optional[bool]=True) -> List[Transaction]:
+        return [self.make_transaction(signed=signed) for _ in range(n)]
+
+    def make_blockchain(self, transaction_count: int,
+                        signed: Optional[bool]=True,
+                        block_size: Optional[int]=Blockchain.Block.max_size
+                        ) -> Blockchain:
+        blockchain = Blockchain(self.genesis_address,
+                                mining_engine=self.mining_engine)
+
+        transactions = self.make_funding_transactions(signed)
+        transactions += self.make_transactions(
+            max(transaction_count - len(transactions), 0), signed)
+        for i in range(0, len(transactions), block_size):
+            blockchain.append_block(Blockchain.Block(
+                blockchain.chain_length,
+                transactions[i: i + block_size],
+                blockchain.get_last_block().hashcode,
+                self.random.choice(self.wallets)['public_key_string'],
+                self.mining_engine))
+        return blockchain
+
+    def make_mempool(self, transaction_count: int,
+                     signed: Optional[bool]=False) -> Mempool:
+        mempool = Mempool(max_size=max(transaction_count, 1))
+        for t in self.make_transactions(transaction_count, signed):
+            mempool.add(t, t.as_json() if signed else t.serialized)
+        return mempool
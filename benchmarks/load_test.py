@@ -0,0 +1,311 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+from akoin_blockchain.helper_functions import get_logger
+from akoin_blockchain.network_manager import NetworkManager
+from akoin_blockchain.transaction import Transaction
+
+from akoin_blockchain.constants import (LOCAL_HOST, PORT, MAX_SYNC_HEADERS,
+                                        MAX_SYNC_BLOCKS,
+                                        INITIAL_CURRENCY_SUPPLY)
+
+from .cluster import wait_until
+from .generators import WorkloadGenerator, MAX_AMOUNT, MAX_FEE
+
+logger = get_logger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LISTENER_SCRIPT = os.path.join(ROOT_DIR, 'akoin_node_listener.py')
+STARTUP_TIMEOUT = 30  # seconds
+SHUTDOWN_TIMEOUT = 10  # seconds
+CONFIRMATION_TIMEOUT = 120  # seconds, once submitting is done
+CONVERGENCE_TIMEOUT = 120  # seconds
+POLL_INTERVAL = 0.5  # seconds between confirmation polls
+
+
+def percentiles(values: Iterable[float],
+                points: Optional[Iterable[int]]=(50, 90, 99)
+                ) -> Dict[str, Optional[float]]:
+    ordered = sorted(values)
+    if not ordered:
+        return {f'p{p}': None for p in points}
+    return {f'p{p}': ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+            for p in points}
+
+
+class NodeCluster:
+    #  listener processes on consecutive ports, all connected to each other
+    def __init__(self, node_count: int, base_port: Optional[int]=PORT,
+                 server_mode: Optional[str]='asyncio'):
+        self.ports = [base_port + i for i in range(node_count)]
+        self.server_mode = server_mode
+        self.processes: List[subprocess.Popen] = []
+        self.network_manager = NetworkManager()
+
+    @property
+    def peers(self) -> List[str]:
+        return [f'{LOCAL_HOST}:{port}' for port in self.ports]
+
+    @staticmethod
+    def is_listening(port: int) -> bool:
+        try:
+            socket.create_connection((LOCAL_HOST, port), timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    def start(self):
+        env = dict(os.environ, DRY_RUN='0',
+                   LOGGING_LEVEL=os.environ.get('LOGGING_LEVEL', '30'))
+        for port in self.ports:
+            self.processes.append(subprocess.Popen(
+                [sys.executable, LISTENER_SCRIPT, '--port', str(port),
+                 '--server-mode', self.server_mode],
+                env=env, cwd=ROOT_DIR))
+
+        for port in self.ports:
+            if not wait_until(lambda: self.is_listening(port),
+                              STARTUP_TIMEOUT, 0.1):
+                raise Exception(f'Node on port {port} did not start')
+            self.network_manager.register_new_node(f'http://{LOCAL_HOST}:{port}')
+        self.connect_nodes()
+
+    def connect_nodes(self):
+        addresses = {peer: self.request(peer, 'get_chain_address')['chain-address']
+                     for peer in self.peers}
+        for peer in self.peers:
+            for other_peer, address in addresses.items():
+                if other_peer != peer:
+                    self.request(peer, 'register_node',
+                                 {'blockchain_address': address,
+                                  'web_address': f'http://{other_peer}'})
+
+    def request(self, peer: str, path: str, data: Optional[dict]=None) -> dict:
+        res = self.network_manager.message_peer(peer, path, data)
+        if res is None:
+            raise Exception(f'No response from {peer} to {path}')
+        return res
+
+    def is_converged(self) -> bool:
+        tips = {self.request(peer, 'get_tip')['hash'] for peer in self.peers}
+        return len(tips) == 1
+
+    def stop(self):
+        self.network_manager.close()
+        for process in self.processes:
+            process.send_signal(signal.SIGINT)
+        for process in self.processes:
+            try:
+                process.wait(SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class LoadTest:
+    #  the first node holds the genesis supply, it funds the wallets and
+    #  its chain is the one confirmations are read from. wallets submit
+    #  through register_new_transactions to random nodes, the first node
+    #  also spends through add_transaction, and nodes take turns mining
+    def __init__(self, cluster: NodeCluster, wallet_count: int, rate: float,
+                 transaction_count: int,
+                 add_transaction_ratio: Optional[float]=0.1,
+                 mine_interval: Optional[float]=1.0,
+                 seed: Optional[int]=0):
+        self.cluster = cluster
+        self.rate = rate
+        self.transaction_count = transaction_count
+        self.add_transaction_ratio = add_transaction_ratio
+        self.mine_interval = mine_interval
+        self.generator = WorkloadGenerator(wallet_count, seed)
+        self.random = self.generator.random
+        self.submitted: Dict[str, float] = {}
+        self.confirmed: Dict[str, float] = {}
+        self.rejected = 0
+        self.blocks_mined = 0
+        self.tip_hash = None
+
+    @property
+    def origin(self) -> str:
+        return self.cluster.peers[0]
+
+    @property
+    def pending(self) -> int:
+        return len(self.submitted) - len(self.confirmed)
+
+    def fund_wallets(self):
+        share = INITIAL_CURRENCY_SUPPLY // (2 * len(self.generator.wallets))
+        self.tip_hash = self.cluster.request(self.origin, 'get_tip')['hash']
+        for wallet in self.generator.wallets:
+            self.submit_add_transaction(wallet['public_key_string'], share, 0)
+
+        self.confirm_pending(self.origin)
+        if not wait_until(self.cluster.is_converged, CONVERGENCE_TIMEOUT, 0.1):
+            raise Exception('Nodes did not converge after funding')
+        logger.info(f'{len(self.generator.wallets)} wallets funded')
+        self.submitted.clear()
+        self.confirmed.clear()
+
+    def submit_add_transaction(self, receiver: str, amount: int, fee: int):
+        #  latencies count from before the request, as for wallet transactions
+        submitted_at = time.time()
+        res = self.cluster.request(self.origin, 'add_transaction',
+                                   {'receiver_address': receiver,
+                                    'amount': amount, 'fee': fee})
+        if not res['success']:
+            self.rejected += 1
+            return
+        t = Transaction.from_json(res['transaction'], verify=False)
+        self.submitted[t.txid] = submitted_at
+
+    def submit_wallet_transaction(self):
+        t = self.generator.make_transaction()
+        submitted_at = time.time()
+        res = self.cluster.request(self.random.choice(self.cluster.peers),
+                                   'register_new_transactions', [t.as_json()])
+        if not res['success']:
+            self.rejected += 1
+            return
+        self.submitted[t.txid] = submitted_at
+
+    def submit(self):
+        if self.random.random() < self.add_transaction_ratio:
+            receiver = self.random.choice(self.generator.wallets)
+            self.submit_add_transaction(receiver['public_key_string'],
+                                        self.random.randint(1, MAX_AMOUNT),
+                                        self.random.randint(0, MAX_FEE))
+        else:
+            self.submit_wallet_transaction()
+
+    def mine(self, peer: Optional[str]=None):
+        peer = peer or self.cluster.peers[self.blocks_mined %
+                                          len(self.cluster.peers)]
+        if self.cluster.request(peer, 'mine')['success']:
+            self.blocks_mined += 1
+
+    def poll_confirmations(self):
+        #  only the blocks after the last seen tip are fetched
+        headers = self.cluster.request(self.origin, 'get_headers',
+                                       {'locator': [self.tip_hash],
+                                        'max_headers': MAX_SYNC_HEADERS})['headers']
+        hashes = [h['hashcode'] for h in headers]
+        now = time.time()
+        for i in range(0, len(hashes), MAX_SYNC_BLOCKS):
+            blocks = self.cluster.request(self.origin, 'get_blocks',
+                                          {'hashes': hashes[i: i + MAX_SYNC_BLOCKS]})['blocks']
+            for block in blocks:
+                for t in block.transactions:
+                    if t.txid in self.submitted and t.txid not in self.confirmed:
+                        self.confirmed[t.txid] = now
+        if hashes:
+            self.tip_hash = hashes[-1]
+
+    def confirm_pending(self, peer: Optional[str]=None):
+        deadline = time.time() + CONFIRMATION_TIMEOUT
+        while self.pending and time.time() < deadline:
+            self.mine(peer)
+            self.poll_confirmations()
+
+    def run(self) -> dict:
+        started_at = time.time()
+        next_submit = started_at
+        next_mine = started_at + self.mine_interval
+        next_poll = started_at + POLL_INTERVAL
+        for _ in range(self.transaction_count):
+            now = time.time()
+            if now < next_submit:
+                time.sleep(next_submit - now)
+            next_submit += 1 / self.rate
+            self.submit()
+
+            now = time.time()
+            if now >= next_mine:
+                self.mine()
+                next_mine = now + self.mine_interval
+            if now >= next_poll:
+                self.poll_confirmations()
+                next_poll = now + POLL_INTERVAL
+        submit_duration = time.time() - started_at
+
+        self.confirm_pending()
+        finished_at = time.time()
+        converged = wait_until(self.cluster.is_converged, CONVERGENCE_TIMEOUT, 0.1)
+        convergence_time = time.time() - finished_at
+
+        latencies = [self.confirmed[txid] - self.submitted[txid]
+                     for txid in self.confirmed]
+        confirm_duration = (max(self.confirmed.values()) - started_at
+                            if self.confirmed else None)
+        return {'nodes': len(self.cluster.peers),
+                'wallets': len(self.generator.wallets),
+                'target_rate': self.rate,
+                'submitted': len(self.submitted),
+                'rejected': self.rejected,
+                'confirmed': len(self.confirmed),
+                'blocks_mined': self.blocks_mined,
+                'submit_duration': submit_duration,
+                'submitted_per_second': len(self.submitted) / submit_duration,
+                'confirmed_per_second': (len(self.confirmed) / confirm_duration
+                                         if confirm_duration else None),
+                'confirmation_latency': dict(
+                    percentiles(latencies),
+                    mean=statistics.mean(latencies) if latencies else None),
+                'converged': converged,
+                'convergence_time': convergence_time}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.load_test',
+        description='Drives signed transactions at a local cluster of nodes')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=PORT,
+                        help='nodes listen on consecutive ports from here')
+    parser.add_argument('--server-mode', choices=['threads', 'asyncio'],
+                        default='asyncio')
+    parser.add_argument('--wallets', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=10,
+                        help='transactions submitted per second')
+    parser.add_argument('--transactions', type=int, default=100)
+    parser.add_argument('--add-transaction-ratio', type=float, default=0.1,
+                        help='share submitted through add_transaction')
+    parser.add_argument('--mine-interval', type=float, default=1.0,
+                        help='seconds between mining requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file the results are written to')
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.getLogger('akoin_blockchain.network_manager').setLevel(logging.WARNING)
+    cluster = NodeCluster(args.nodes, args.base_port, args.server_mode)
+    try:
+        cluster.start()
+        load_test = LoadTest(cluster, args.wallets, args.rate,
+                             args.transactions, args.add_transaction_ratio,
+                             args.mine_interval, args.seed)
+        load_test.fund_wallets()
+        results = load_test.run()
+    finally:
+        cluster.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
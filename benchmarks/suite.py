@@ -0,0 +1,339 @@
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import Callable, List, Optional
+
+from akoin_blockchain.account import Account
+from akoin_blockchain.aux_data_structures import CompactMerkleTree, MerkleTree
+from akoin_blockchain.blockchain import Blockchain
+from akoin_blockchain.helper_functions import get_logger
+from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.mempool import Mempool
+from akoin_blockchain.node import Node
+from akoin_blockchain.transaction import Transaction
+from akoin_blockchain.wire_protocol import FrameReader, WireProtocol
+
+from akoin_blockchain.constants import (HEADERSIZE, INITIAL_WEB_ADDRESS,
+                                        LEGACY_PROTOCOL_VERSION,
+                                        PROTOCOL_VERSION)
+
+from .cluster import LoopbackCluster, wait_until
+from .generators import WorkloadGenerator
+
+logger = get_logger(__name__)
+
+DEFAULT_SCALE = 1000
+DEFAULT_REPEAT = 3
+DEFAULT_DIFFICULTY = 1  # of the generated chains
+POW_DIFFICULTY = 3
+MAX_SIGNED_TRANSACTIONS = 5000  # signing is slow, signed workloads are capped
+LOOPBACK_NODES = 3
+LOOPBACK_TIMEOUT = 60  # seconds
+REGRESSION_THRESHOLD = 0.1  # slower by more than this fraction
+
+
+def measure(fn: Callable[[], object], repeat: int,
+            setup: Optional[Callable[[], object]]=None) -> dict:
+    #  setup runs before every repeat and is not timed
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started_at)
+
+    return {'repeat': repeat,
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings)}
+
+
+def with_items(result: dict, items: int) -> dict:
+    result['items'] = items
+    result['items_per_second'] = (items / result['median']
+                                  if result['median'] > 0 else None)
+    return result
+
+
+class BenchmarkContext:
+    #  generated workloads are cached, benchmarks at the same scale share them
+    def __init__(self, scale: Optional[int]=DEFAULT_SCALE,
+                 repeat: Optional[int]=DEFAULT_REPEAT,
+                 seed: Optional[int]=0,
+                 max_signed: Optional[int]=MAX_SIGNED_TRANSACTIONS,
+                 loopback_nodes: Optional[int]=LOOPBACK_NODES):
+        self.scale = scale
+        self.repeat = repeat
+        self.seed = seed
+        self.signed_scale = min(scale, max_signed)
+        self.loopback_nodes = loopback_nodes
+        self.generator = WorkloadGenerator(seed=seed)
+        self._workloads = {}
+
+    def get(self, name: str, make: Callable[[], object]):
+        if name not in self._workloads:
+            started_at = time.perf_counter()
+            self._workloads[name] = make()
+            logger.info(f'Generated {name} in '
+                        f'{time.perf_counter() - started_at:.2f}s')
+        return self._workloads[name]
+
+    def get_blockchain(self, signed: bool) -> Blockchain:
+        scale = self.signed_scale if signed else self.scale
+        return self.get(f'blockchain_{scale}_{signed}',
+                        lambda: self.generator.make_blockchain(scale, signed))
+
+    def get_transactions(self, signed: bool) -> List[Transaction]:
+        scale = self.signed_scale if signed else self.scale
+        return self.get(f'transactions_{scale}_{signed}',
+                        lambda: self.generator.make_transactions(scale, signed))
+
+
+def bench_proof_of_work(context: BenchmarkContext) -> dict:
+    generator = context.generator
+    block = Blockchain.Block(1, generator.make_transactions(10, signed=False),
+                             '0', generator.genesis_address,
+                             generator.mining_engine)
+    block.difficulty = POW_DIFFICULTY
+    hash_rates = []
+
+    def mine():
+        block.unix_timestamp += 1  # a new header, so a new search
+        block.proof_of_work(generator.mining_engine)
+        hash_rates.append(generator.mining_engine.hashes_per_second)
+
+    result = with_items(measure(mine, context.repeat), 1)
+    result['difficulty'] = POW_DIFFICULTY
+    result['hashes_per_second'] = statistics.median(hash_rates)
+    return result
+
+
+def bench_chain_validation(context: BenchmarkContext) -> dict:
+    blockchain = context.get_blockchain(signed=True)
+    #  a cold signature cache, as when validating a peer's chain
+    result = measure(lambda: blockchain.is_chain_valid(blockchain.chain),
+                     context.repeat, setup=KeyMaster.clear_caches)
+    return with_items(result, context.signed_scale)
+
+
+def bench_balance_scan(context: BenchmarkContext) -> dict:
+    blockchain = context.get_blockchain(signed=False)
+    address = context.generator.genesis_address
+    result = measure(lambda: Account.get_balance_of(address, blockchain.chain),
+                     context.repeat)
+    return with_items(result, context.scale)
+
+
+def bench_balance_index(context: BenchmarkContext) -> dict:
+    blockchain = context.get_blockchain(signed=False)
+    addresses = [w['public_key_string'] for w in context.generator.wallets]
+    result = measure(lambda: [blockchain.get_balance_of(a) for a in addresses],
+                     context.repeat)
+    return with_items(result, len(addresses))
+
+
+def bench_merkle_tree(context: BenchmarkContext) -> dict:
+    txids = [t.txid for t in context.get_transactions(signed=False)]
+    result = measure(lambda: MerkleTree.make_tree(txids), context.repeat)
+    return with_items(result, len(txids))
+
+
+def bench_compact_merkle_tree(context: BenchmarkContext) -> dict:
+    digests = [bytes.fromhex(t.txid)
+               for t in context.get_transactions(signed=False)]
+    result = measure(lambda: CompactMerkleTree(digests).root, context.repeat)
+    return with_items(result, len(digests))
+
+
+def make_node_transactions(context: BenchmarkContext, node: Node) -> List[str]:
+    #  spent from the node's genesis supply so they pass the balance check
+    json_transactions = []
+    for t in context.generator.make_transactions(context.signed_scale,
+                                                 signed=False):
+        t = t.replace(sender=node.blockchain_address)
+        t.add_signature(KeyMaster.sign(t.serialized, node.keys['private_key']))
+        json_transactions.append(t.as_json())
+    return json_transactions
+
+
+def bench_add_transaction(context: BenchmarkContext) -> dict:
+    node = Node(INITIAL_WEB_ADDRESS)
+    json_transactions = make_node_transactions(context, node)
+
+    def setup():
+        node.mempool.clear()
+        KeyMaster.clear_caches()
+
+    result = measure(lambda: [node.add_transaction(jt)
+                              for jt in json_transactions],
+                     context.repeat, setup)
+    node.close()
+    return with_items(result, len(json_transactions))
+
+
+def bench_receive_transactions(context: BenchmarkContext) -> dict:
+    node = Node(INITIAL_WEB_ADDRESS)
+    json_transactions = make_node_transactions(context, node)
+
+    def setup():
+        node.mempool.clear()
+        KeyMaster.clear_caches()
+
+    result = measure(lambda: node.receive_transactions(json_transactions),
+                     context.repeat, setup)
+    node.close()
+    return with_items(result, len(json_transactions))
+
+
+def bench_mempool(context: BenchmarkContext) -> dict:
+    transactions = context.get_transactions(signed=False)
+    mempool = Mempool(max_size=len(transactions))
+
+    def fill():
+        #  unsigned transactions have no json, their serialization stands in
+        for t in transactions:
+            mempool.add(t, t.serialized)
+        mempool.top(Blockchain.Block.max_size)
+
+    result = measure(fill, context.repeat, setup=mempool.clear)
+    return with_items(result, len(transactions))
+
+
+def bench_framing(context: BenchmarkContext, message: dict, 
+                  version: int) -> dict:
+    def round_trip():
+        frame = WireProtocol.frame(message, version)
+        FrameReader.decode_body(memoryview(frame)[HEADERSIZE:], version)
+
+    result = with_items(measure(round_trip, context.repeat), 
+                        len(message['data']))
+    result['frame_bytes'] = len(WireProtocol.frame(message, version))
+    return result
+
+
+def make_framing_message(context: BenchmarkContext) -> dict:
+    #  both framings encode the same message, so they compare like for like
+    return {'path': 'register_new_transactions',
+            'data': context.get_transactions(signed=False)}
+
+
+def bench_wire_framing(context: BenchmarkContext) -> dict:
+    return bench_framing(context, make_framing_message(context),
+                         PROTOCOL_VERSION)
+
+
+def bench_legacy_framing(context: BenchmarkContext) -> dict:
+    return bench_framing(context, make_framing_message(context),
+                         LEGACY_PROTOCOL_VERSION)
+
+
+def bench_loopback(context: BenchmarkContext) -> dict:
+    #  one run: relay transactions from the first node to the others, then
+    #  mine them and wait for every node to sync the new block
+    cluster = LoopbackCluster(context.loopback_nodes)
+    try:
+        origin = cluster.origin
+        transactions = [origin.create_signed_transaction(
+                            context.generator.genesis_address, 1, 0)
+                        for _ in range(context.signed_scale)]
+        txids = [t.txid for t in transactions]
+
+        started_at = time.perf_counter()
+        origin.announce_inventory(txids)
+        relayed = wait_until(lambda: all(len(node.mempool) == len(txids)
+                                         for node in cluster.peers),
+                             LOOPBACK_TIMEOUT)
+        relay_time = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        while len(origin.mempool):
+            origin.mine_new_block()
+        converged = wait_until(cluster.is_converged, LOOPBACK_TIMEOUT)
+        convergence_time = time.perf_counter() - started_at
+
+        return {'nodes': context.loopback_nodes,
+                'items': len(txids),
+                'relayed': relayed,
+                'relay_time': relay_time,
+                'relay_per_second': len(txids) / relay_time,
+                'blocks': origin.blockchain.chain_length - 1,
+                'converged': converged,
+                'convergence_time': convergence_time}
+    finally:
+        cluster.close()
+
+
+BENCHMARKS = {'proof_of_work': bench_proof_of_work,
+              'chain_validation': bench_chain_validation,
+              'balance_scan': bench_balance_scan,
+              'balance_index': bench_balance_index,
+              'merkle_tree': bench_merkle_tree,
+              'compact_merkle_tree': bench_compact_merkle_tree,
+              'add_transaction': bench_add_transaction,
+              'receive_transactions': bench_receive_transactions,
+              'mempool': bench_mempool,
+              'wire_framing': bench_wire_framing,
+              'legacy_framing': bench_legacy_framing,
+              'loopback': bench_loopback}
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(context: BenchmarkContext,
+              names: Optional[List[str]]=None) -> dict:
+    names = names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise Exception(f'Unknown benchmarks: {sorted(unknown)}')
+
+    difficulty = Blockchain.Block.difficulty
+    Blockchain.Block.difficulty = DEFAULT_DIFFICULTY
+    results = {}
+    try:
+        for name in names:
+            logger.info(f'Running benchmark: {name}')
+            results[name] = BENCHMARKS[name](context)
+    finally:
+        Blockchain.Block.difficulty = difficulty
+
+    return {'meta': {'scale': context.scale,
+                     'signed_scale': context.signed_scale,
+                     'repeat': context.repeat,
+                     'seed': context.seed,
+                     'python': sys.version.split()[0],
+                     'platform': platform.platform(),
+                     'cpu_count': os.cpu_count(),
+                     'commit': get_git_commit(),
+                     'timestamp': time.time()},
+            'benchmarks': results}
+
+
+def compare(results: dict, baseline: dict,
+            threshold: Optional[float]=REGRESSION_THRESHOLD) -> List[dict]:
+    #  benchmarks timed in both runs, compared on their medians
+    comparison = []
+    for name, result in results['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if not base or 'median' not in result or 'median' not in base:
+            continue
+
+        ratio = result['median'] / base['median'] if base['median'] else None
+        comparison.append({'name': name,
+                           'baseline': base['median'],
+                           'median': result['median'],
+                           'ratio': ratio,
+                           'regressed': ratio is not None and
+                                        ratio > 1 + threshold})
+    return comparison
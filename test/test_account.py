@@ -99,16 +99,14 @@ def test_transaction_in_block_validation():
                                            transaction_proof['proof_list']
                                            )
     
-    good_amount = transaction_proof['transaction'].amount
-    bad_amount = good_amount * 2
-    transaction_proof['transaction'].amount = bad_amount
+    good_transaction = transaction_proof['transaction']
+    bad_transaction = good_transaction.replace(amount=good_transaction.amount * 2)
     assert not account.is_transaction_in_block(block_index,
                                            transaction_index,
-                                           transaction_proof['transaction'],
+                                           bad_transaction,
                                            transaction_proof['proof_list']
                                            )
     
-    transaction_proof['transaction'].amount = good_amount
     shuffle(transaction_proof['proof_list'])
     
     assert not account.is_transaction_in_block(block_index,
@@ -116,4 +114,77 @@ def test_transaction_in_block_validation():
                                            transaction_proof['transaction'],
                                            transaction_proof['proof_list']
                                            )
-    
\ No newline at end of file
+        
+def test_balance_index():
+    bc = Blockchain(KEYS['public_key_string'])
+    account = Account(KEYS['public_key_string'])
+    account.chain = bc.get_chain()
+    account.balance_index = bc.balance_index
+    
+    transaction_details_list = [{'sender': KEYS['public_key_string'],
+                                'receiver': OTHER_KEYS['public_key_string'],
+                                'amount': i * 100,
+                                'fee': i * 10} for i in range(1, 5)]
+    add_multiple_transaction_block_to_chain(bc, transaction_details_list)
+    add_block_to_chain(bc, 
+                       OTHER_KEYS['public_key_string'], 
+                       KEYS['public_key_string'],
+                       50, 
+                       5)
+    
+    assert bc.balance_index.is_synced_with(account.chain)
+    for address in [KEYS['public_key_string'], OTHER_KEYS['public_key_string']]:
+        assert (bc.get_balance_of(address) == 
+                Account.get_balance_of(address, account.chain))
+    
+    assert account.get_balance() == Account.get_balance_of(KEYS['public_key_string'], 
+                                                           account.chain)
+    
+    #  index is rebuilt when the chain is changed behind its back
+    bc.chain.pop()
+    assert not bc.balance_index.is_synced_with(bc.chain)
+    assert (bc.get_balance_of(OTHER_KEYS['public_key_string']) == 
+            Account.get_balance_of(OTHER_KEYS['public_key_string'], bc.chain))
+            
+def test_transactions_in_block_multiproof():
+    bc = Blockchain(KEYS['public_key_string'])
+    account = Account(KEYS['public_key_string'])
+    account.chain = bc.get_chain()
+    
+    transaction_details_list = [{'sender': KEYS['public_key_string'],
+                                'receiver': OTHER_KEYS['public_key_string'],
+                                'amount': i * 100,
+                                'fee': i * 10} for i in range(1, 10)]
+    add_multiple_transaction_block_to_chain(bc, transaction_details_list)
+    block_index = 1
+    
+    transaction_indexes = [1, 2, 5, 8]
+    proof = account.generate_transactions_in_block_proof(transaction_indexes,
+                                                         block_index)
+    single_proofs = [account.generate_transaction_in_block_proof(idx, block_index)
+                     for idx in transaction_indexes]
+    assert len(proof['proof_list']) < sum(len(p['proof_list']) 
+                                          for p in single_proofs)
+    
+    #  proofs are not consumed by validation and can be checked again
+    for _ in range(2):
+        assert account.are_transactions_in_block(block_index,
+                                                 proof['transaction_indexes'],
+                                                 proof['transactions'],
+                                                 proof['transaction_count'],
+                                                 proof['proof_list'])
+        assert account.is_transaction_in_block(block_index, 
+                                               transaction_indexes[0],
+                                               single_proofs[0]['transaction'],
+                                               single_proofs[0]['proof_list'])
+    
+    assert not account.are_transactions_in_block(block_index,
+                                                 [1, 2, 6, 8],
+                                                 proof['transactions'],
+                                                 proof['transaction_count'],
+                                                 proof['proof_list'])
+    assert not account.are_transactions_in_block(block_index,
+                                                 proof['transaction_indexes'],
+                                                 proof['transactions'],
+                                                 proof['transaction_count'],
+                                                 proof['proof_list'][1:])
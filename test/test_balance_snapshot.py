@@ -0,0 +1,52 @@
+from akoin_blockchain.account import Account
+from akoin_blockchain.balance_snapshot import TransactionColumns
+from akoin_blockchain.blockchain import Blockchain
+from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.transaction import Transaction
+
+from akoin_blockchain.constants import INITIAL_CURRENCY_SUPPLY
+
+Blockchain.Block.difficulty = 1  # to save time
+KEYS = KeyMaster.generate_keys()
+ADDRESSES = ['alice', 'bob', 'carol']
+
+
+def make_signed_transaction(receiver: str, amount: int, fee: int) -> Transaction:
+    t = Transaction(KEYS['public_key_string'], receiver, amount, fee)
+    t.add_signature(KeyMaster.sign(t.serialized, KEYS['private_key']))
+    return t
+
+def make_blockchain() -> Blockchain:
+    blockchain = Blockchain(KEYS['public_key_string'])
+    for i in range(1, 4):
+        blockchain.create_block([make_signed_transaction(address, 100 * i, i) 
+                                 for address in ADDRESSES[:i]])
+    return blockchain
+
+def test_balances_at_height():
+    blockchain = make_blockchain()
+    columns = TransactionColumns.from_chain(blockchain.chain)
+    assert len(columns) == 7
+    
+    for height in range(len(blockchain.chain)):
+        chain = blockchain.chain[:height + 1]
+        balances = columns.get_balances(height)
+        for address in ADDRESSES + [KEYS['public_key_string']]:
+            assert (balances.get(address, 0) == 
+                    Account.get_balance_of(address, chain))
+    
+    balances = blockchain.get_balances_at()
+    assert sum(b for b in balances.values() if b > 0) == INITIAL_CURRENCY_SUPPLY
+    assert columns.get_rich_list(2, 2)[1] == ('alice', 300)
+    
+def test_transaction_columns_sync():
+    blockchain = make_blockchain()
+    columns = blockchain.get_transaction_columns()
+    blockchain.create_block([make_signed_transaction('bob', 5, 0)])
+    assert blockchain.get_transaction_columns() is columns
+    assert len(columns) == 8
+    
+    blockchain.chain.pop()
+    blockchain.chain.pop()
+    assert blockchain.get_balances_at()['bob'] == 200
+    assert len(columns) == 4
@@ -0,0 +1,41 @@
+from benchmarks import BenchmarkContext, WorkloadGenerator, compare, run_suite
+from benchmarks.load_test import percentiles
+
+
+def test_workload_generator():
+    generator = WorkloadGenerator(wallet_count=5, seed=1)
+    other_generator = WorkloadGenerator(wallet_count=5, seed=1)
+    amounts = [t.amount for t in generator.make_transactions(10, signed=False)]
+    assert amounts == [t.amount for t in 
+                       other_generator.make_transactions(10, signed=False)]
+    assert generator.genesis_address == other_generator.genesis_address
+    
+    #  a fixed timestamp makes the txids repeat too
+    txids = [[t.txid for t in WorkloadGenerator(5, 1, 1e9).make_transactions(10)]
+             for _ in range(2)]
+    assert txids[0] == txids[1] and len(set(txids[0])) == 10
+    
+    blockchain = generator.make_blockchain(25)
+    assert sum(len(block.transactions) for block in blockchain.chain) == 26
+    assert blockchain.is_chain_valid(blockchain.chain)
+    
+def test_run_suite():
+    context = BenchmarkContext(scale=20, repeat=1, max_signed=5, 
+                               loopback_nodes=2)
+    results = run_suite(context, ['merkle_tree', 'mempool', 'wire_framing', 
+                                  'loopback'])
+    assert results['meta']['signed_scale'] == 5
+    assert results['benchmarks']['merkle_tree']['items'] == 20
+    assert results['benchmarks']['loopback']['relayed']
+    assert results['benchmarks']['loopback']['converged']
+    
+    baseline = {'benchmarks': {'mempool': dict(results['benchmarks']['mempool'])}}
+    baseline['benchmarks']['mempool']['median'] /= 2
+    comparison = compare(results, baseline)
+    assert [c['name'] for c in comparison] == ['mempool']
+    assert comparison[0]['regressed']
+    
+def test_percentiles():
+    assert percentiles(range(100)) == {'p50': 50, 'p90': 90, 'p99': 99}
+    assert percentiles([3, 1, 2], [0, 50, 100]) == {'p0': 1, 'p50': 2, 'p100': 3}
+    assert percentiles([]) == {'p50': None, 'p90': None, 'p99': None}
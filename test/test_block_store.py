@@ -0,0 +1,117 @@
+import mock
+import random
+
+from akoin_blockchain.block_store import BlockStore, TransactionLocations
+from akoin_blockchain.blockchain import Blockchain
+from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.transaction import Transaction
+
+Blockchain.Block.difficulty = 1  # to save time
+KEYS = KeyMaster.generate_keys()
+OTHER_KEYS = KeyMaster.generate_keys()
+
+
+def make_signed_transaction(amount=10, fee=1) -> Transaction:
+    t = Transaction(KEYS['public_key_string'], OTHER_KEYS['public_key_string'],
+                    amount, fee)
+    t.add_signature(KeyMaster.sign(t.serialized, KEYS['private_key']))
+    return t
+
+def make_stored_blockchain(directory: str, n_blocks=3, **kwargs) -> Blockchain:
+    blockchain = Blockchain(KEYS['public_key_string'],
+                            block_store=BlockStore(directory, **kwargs))
+    for _ in range(n_blocks):
+        blockchain.create_block([make_signed_transaction()])
+    return blockchain
+
+def test_block_store_reopen(tmp_path):
+    blockchain = make_stored_blockchain(str(tmp_path), segment_size=2048)
+    hashes = [block.hashcode for block in blockchain.chain]
+    balance = blockchain.get_balance_of(KEYS['public_key_string'])
+    blockchain.close()
+
+    block_store = BlockStore(str(tmp_path), cache_size=2)
+    assert len(block_store) == 4
+    assert len(list(tmp_path.glob('blk*.dat'))) > 1
+    assert [block_store.get_hash(i) for i in range(4)] == hashes
+
+    blockchain = Blockchain(KEYS['public_key_string'], block_store=block_store)
+    assert blockchain.chain_length == 4
+    assert [block.hashcode for block in blockchain.chain] == hashes
+    assert blockchain.get_block_by_hash(hashes[2]).index == 2
+    assert blockchain.get_block_by_hash('f' * 64) is None
+    assert blockchain.is_chain_valid()
+    assert blockchain.balance_index.is_synced_with(blockchain.chain)
+    assert blockchain.get_balance_of(KEYS['public_key_string']) == balance
+
+    blockchain.create_block([make_signed_transaction()])
+    assert blockchain.chain[-1].index == 4
+    blockchain.close()
+
+def test_block_store_replace_chain(tmp_path):
+    blockchain_1 = make_stored_blockchain(str(tmp_path / 'a'), n_blocks=1)
+    blockchain_2 = Blockchain(KEYS['public_key_string'], with_genesis=False,
+                              block_store=BlockStore(str(tmp_path / 'b')))
+    blockchain_2.append_block(blockchain_1.chain[0])
+    for _ in range(3):
+        blockchain_2.create_block([make_signed_transaction()])
+
+    assert blockchain_1.replace_chain(blockchain_2.get_chain())
+    assert blockchain_1.chain_length == 4
+    assert ([block.hashcode for block in blockchain_1.chain] ==
+            [block.hashcode for block in blockchain_2.chain])
+    assert blockchain_1.balance_index.is_synced_with(blockchain_1.chain)
+    assert (blockchain_1.get_balance_of(OTHER_KEYS['public_key_string']) ==
+            blockchain_2.get_balance_of(OTHER_KEYS['public_key_string']))
+    for height, block in enumerate(blockchain_2.chain):
+        txid = block.transactions[0].txid
+        assert blockchain_1.get_transaction_location(txid) == (height, 0)
+    blockchain_1.close()
+    blockchain_2.close()
+
+def test_block_store_checkpoint_replay(tmp_path):
+    blockchain = make_stored_blockchain(str(tmp_path))
+    blockchain.save_state()
+    for _ in range(2):
+        blockchain.create_block([make_signed_transaction()])
+    txid = blockchain.chain[-1].transactions[0].txid
+    balance = blockchain.get_balance_of(KEYS['public_key_string'])
+    blockchain.block_store.close()  # stopped without a checkpoint
+
+    block_store = BlockStore(str(tmp_path))
+    blockchain = Blockchain(KEYS['public_key_string'], block_store=block_store)
+    with mock.patch.object(block_store, 'get_block', 
+                           wraps=block_store.get_block) as get_block:
+        assert blockchain.get_balance_of(KEYS['public_key_string']) == balance
+        assert blockchain.get_transaction_location(txid) == (5, 0)
+    #  only the checkpoint tip and the blocks after it are read
+    assert {call.args[0] for call in get_block.call_args_list} == {3, 4, 5}
+    blockchain.close()
+    #  the transaction index is kept in its own table, not checkpointed
+    assert not (tmp_path / 'transactions.json').exists()
+
+def test_transaction_locations(tmp_path):
+    path = str(tmp_path / 'transactions.idx')
+    rng = random.Random(0)
+    txids = [rng.randbytes(32).hex() for _ in range(200)]
+    locations = TransactionLocations(path, capacity=8)
+    for i, txid in enumerate(txids):
+        locations[txid] = (i, i % 7)
+    assert locations.capacity > 8 and locations.used == 200
+
+    #  deleting shifts the rest of a probe run up, every lookup still lands
+    for txid in txids[::2]:
+        del locations[txid]
+    locations.set_tip(3, 'ab' * 32)
+    locations.close()
+
+    locations = TransactionLocations(path)
+    assert locations.used == 100
+    assert (locations.height, locations.tip_hash) == (3, 'ab' * 32)
+    for i, txid in enumerate(txids):
+        assert locations.get(txid) == (None if i % 2 == 0 else (i, i % 7))
+    assert locations.get('not hex') is None
+
+    locations.clear()
+    assert locations.used == 0 and txids[1] not in locations
+    locations.close()
@@ -0,0 +1,61 @@
+import mock
+
+from akoin_blockchain.aux_data_structures import CompactMerkleTree
+from akoin_blockchain.block_template import BlockTemplate
+from akoin_blockchain.transaction import Transaction
+from akoin_blockchain.constants import MAX_FUNDING_CANDIDATES
+
+BALANCES = {'alice': 100, 'bob': 0, 'carol': 5}
+
+
+def test_block_template_fee_order():
+    transactions = [Transaction('alice', 'carol', 10, fee) 
+                    for fee in [3, 9, 1, 7]]
+    transactions.append(Transaction('carol', 'bob', 50, 20))
+    
+    selected = BlockTemplate.build_from(transactions, BALANCES.get, 3)
+    assert [t.fee for t in selected] == [9, 7, 3]
+    
+def test_block_template_dependent_transactions():
+    #  bob can only pay once alice's low fee transaction funds him
+    transactions = [Transaction('bob', 'carol', 30, 20),
+                    Transaction('alice', 'carol', 50, 2),
+                    Transaction('alice', 'bob', 60, 5)]
+    
+    template = BlockTemplate(BALANCES.get, 10)
+    selected = template.build(transactions)
+    assert selected == [transactions[2], transactions[0]]
+    assert template.balances == {'alice': 35, 'bob': 10, 'carol': 35}
+    assert list(template.parked) == ['alice']
+    assert template.merkle_root == CompactMerkleTree.compute_root(
+        [bytes.fromhex(t.txid) for t in selected]).hex()
+    
+def test_block_template_ancestor_packages():
+    #  bob's high fee needs alice's low fee parent, together they pay more
+    #  per transaction than carol's mid fee one
+    parent = Transaction('alice', 'bob', 10, 1)
+    child = Transaction('bob', 'carol', 1, 9)
+    mid_fee = Transaction('carol', 'alice', 1, 4)
+    
+    selected = BlockTemplate.build_from([child, mid_fee, parent], 
+                                        BALANCES.get, 2)
+    assert selected == [parent, child]
+    
+    selected = BlockTemplate.build_from([child, mid_fee, parent], 
+                                        BALANCES.get, 3)
+    assert selected == [parent, child, mid_fee]
+    
+def test_block_template_resolves_packages_once():
+    #  many transactions from a sender nothing can fund, and many funding it
+    unaffordable = [Transaction('dave', 'bob', 1000 + i, 1) for i in range(200)]
+    funders = [Transaction(f'payer{i}', 'dave', 1, 2) for i in range(200)]
+    
+    template = BlockTemplate(lambda address: BALANCES.get(address, 10), 300)
+    with mock.patch.object(template, 'get_funding_steps', 
+                           wraps=template.get_funding_steps) as steps:
+        selected = template.build(unaffordable + funders)
+    assert steps.call_count == 1
+    assert len(template.funding['dave']) == MAX_FUNDING_CANDIDATES
+    assert selected == funders
+    assert template.balances['dave'] == 210
+    assert len(template.parked['dave']) == 200
@@ -1,16 +1,22 @@
 import copy
+import hashlib
+import mock
 import pytest
 import random
+import threading
 import time
 
 from datetime import datetime
 from typing import Optional
 
 from akoin_blockchain.blockchain import Blockchain
+from akoin_blockchain.chain_validation import ChainValidator
 from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.mining import MiningEngine
 from akoin_blockchain.transaction import Transaction
 
-from akoin_blockchain.constants import INITIAL_CURRENCY_SUPPLY
+from akoin_blockchain.constants import (INITIAL_CURRENCY_SUPPLY, BLOCK_VERSION,
+                                        LEGACY_BLOCK_VERSION)
 
 Blockchain.Block.difficulty = 2  # to save time
 KEYS = KeyMaster.generate_keys()
@@ -46,7 +52,8 @@ def test_block_difficulty():
     #  multiple timesoperations will get closer to mean, but might still fail!
     blocks = [make_block(make_transaction_list(1)) for _ in range(100)] 
     after = datetime.now()
-    assert (after - before).seconds > 0
+    assert (after - before).total_seconds() > 0
+    assert sum(block.nonce for block in blocks) > 0
     
     for block in blocks:
         assert block.hashcode.startswith('0' * BLOCK_DIFFICULTY)
@@ -170,4 +177,235 @@ def test_replace_chain():
     
     for i, block in enumerate(blockchain_2.chain):
         assert str(block) == str(blockchain_1.chain[i])
-    
\ No newline at end of file
+            
+def test_replace_chain_balance_index():
+    blockchain_1 = Blockchain(KEYS['public_key_string'])
+    blockchain_2 = copy.deepcopy(blockchain_1)
+    blockchain_1.Block.difficulty = 1
+    
+    blockchain_1.create_block(make_transaction_list(2))
+    blockchain_2.create_block(make_transaction_list(1))
+    blockchain_1.create_block(make_transaction_list(1))
+    
+    assert blockchain_2.find_fork_height(blockchain_1.get_chain()) == 1
+    assert blockchain_2.replace_chain(blockchain_1.get_chain())
+    
+    for address in [KEYS['public_key_string'], OTHER_KEYS['public_key_string']]:
+        assert (blockchain_2.get_balance_of(address) == 
+                blockchain_1.get_balance_of(address))
+        assert blockchain_2.balance_index.is_synced_with(blockchain_2.chain)
+    
+def test_parallel_mining():
+    mining_engine = MiningEngine(processes=2, min_parallel_difficulty=0)
+    try:
+        block = Blockchain.Block(DEFAULT_BLOCK_INDEX, 
+                                 make_transaction_list(2), 
+                                 DEFAULT_PREVIOUS_HASH,
+                                 KEYS['public_key_string'],
+                                 mining_engine)
+        assert block.hashcode == block.compute_hash()
+        assert block.hashcode.startswith('0' * block.difficulty)
+        assert mining_engine.hashes_per_second > 0
+    finally:
+        mining_engine.shutdown()
+        
+def test_mining_cancellation():
+    mining_engine = MiningEngine(processes=1)
+    prefix, suffix = make_block(make_transaction_list(1)).get_pow_template()
+    
+    #  unreachable difficulty, so only cancelling can stop the search
+    miner = threading.Thread(target=lambda: results.append(
+        mining_engine.mine(prefix, suffix, 64)))
+    results = []
+    miner.start()
+    time.sleep(0.1)
+    mining_engine.cancel()
+    miner.join(timeout=5)
+    
+    assert not miner.is_alive()
+    assert results == [None]
+    
+    #  a cancel while a run waits to start cancels it, not the runs after
+    mining_engine._run_lock.acquire()
+    miner = threading.Thread(target=lambda: results.append(
+        mining_engine.mine(prefix, suffix, 64)))
+    miner.start()
+    time.sleep(0.1)
+    mining_engine.cancel()
+    mining_engine._run_lock.release()
+    miner.join(timeout=5)
+    assert not miner.is_alive()
+    assert results == [None, None]
+    assert mining_engine.mine(prefix, suffix, 1) is not None
+        
+def test_legacy_block_validation():
+    blockchain = Blockchain(KEYS['public_key_string'])
+    block = make_block(make_transaction_list(3), 1, 
+                       blockchain.get_last_block().hashcode)
+    assert block.version == BLOCK_VERSION
+    assert blockchain.is_block_valid(block)
+    
+    #  blocks stored before versioning don't carry a version attribute
+    del block.__dict__['version']
+    assert block.version == LEGACY_BLOCK_VERSION
+    assert not blockchain.is_block_valid(block)
+    block.merkle_root = block.compute_merkle_root()
+    block.hashcode = block.proof_of_work()
+    assert block.compute_hash() == hashlib.sha256(
+        block.as_json_pre_hash().encode()).hexdigest()
+    assert blockchain.is_block_valid(block)
+    
+    blockchain.chain.append(block)
+    assert blockchain.is_chain_valid()
+    
+    block.merkle_root = blockchain.chain[0].merkle_root
+    assert not blockchain.is_block_valid(block)
+    
+def test_transaction_index():
+    blockchain_1 = Blockchain(KEYS['public_key_string'])
+    blockchain_2 = copy.deepcopy(blockchain_1)
+    blockchain_1.Block.difficulty = 1
+    
+    orphaned = make_transaction_list(2)
+    blockchain_2.create_block(orphaned)
+    assert blockchain_2.get_transaction(orphaned[1].txid) is orphaned[1]
+    assert blockchain_2.get_transaction_location(orphaned[1].txid) == (1, 1)
+    
+    transactions = make_transaction_list(1) + orphaned[:1]
+    blockchain_1.create_block(transactions)
+    blockchain_1.create_block(make_transaction_list(1))
+    assert blockchain_2.replace_chain(blockchain_1.get_chain())
+    
+    assert blockchain_2.is_transaction_in_chain(orphaned[0].txid)
+    assert not blockchain_2.is_transaction_in_chain(orphaned[1].txid)
+    assert blockchain_2.get_transaction(orphaned[1].txid) is None
+    assert blockchain_2.transaction_index.is_synced_with(blockchain_2.chain)
+    
+def test_parallel_chain_validation():
+    blockchain = Blockchain(KEYS['public_key_string'])
+    blockchain.Block.difficulty = 1
+    for _ in range(8):
+        blockchain.create_block(make_transaction_list(2))
+    
+    blocks = blockchain.chain[1:]
+    assert ChainValidator.validate_blocks_parallel(blocks, 1, MAX_BLOCK_TRANSACTIONS, 
+                                                   chunk_size=2)
+    
+    #  a swapped signature leaves hashes and merkle root intact
+    transactions = blockchain.chain[5].transactions
+    transactions[0] = transactions[0].replace(signature=transactions[1].signature)
+    assert not ChainValidator.validate_blocks_parallel(blocks, 1, 
+                                                       MAX_BLOCK_TRANSACTIONS,
+                                                       chunk_size=2)
+    assert not blockchain.is_chain_valid()
+    
+    #  blocks not validated in time are rejected, on a new pool next time
+    assert not ChainValidator.validate_blocks_parallel(blocks, 1, 
+                                                       MAX_BLOCK_TRANSACTIONS,
+                                                       timeout=0)
+    assert ChainValidator.validate_blocks_parallel(blocks[:4], 1, 
+                                                   MAX_BLOCK_TRANSACTIONS,
+                                                   chunk_size=2)
+    
+def test_replace_chain_validates_suffix():
+    blockchain_1 = Blockchain(KEYS['public_key_string'])
+    blockchain_1.Block.difficulty = 1
+    for _ in range(3):
+        blockchain_1.create_block(make_transaction_list(1))
+    blockchain_2 = copy.deepcopy(blockchain_1)
+    prefix_block = blockchain_2.chain[2]
+    
+    blockchain_1.create_block(make_transaction_list(1))
+    blockchain_1.create_block(make_transaction_list(1))
+    chain = copy.deepcopy(blockchain_1.get_chain())
+    
+    #  the common prefix is trusted, only the new blocks are validated
+    chain[2].transactions.pop()
+    assert blockchain_2.replace_chain(chain)
+    assert blockchain_2.chain[2] is prefix_block
+    assert blockchain_2.chain[-1] == chain[-1]
+    assert blockchain_2.is_chain_valid()
+    
+    overspending = Transaction(OTHER_KEYS['public_key_string'], 
+                               KEYS['public_key_string'], 
+                               INITIAL_CURRENCY_SUPPLY, 1)
+    overspending.add_signature(KeyMaster.sign(overspending.serialized, 
+                                              OTHER_KEYS['private_key']))
+    chain = blockchain_1.get_chain()[:]
+    chain.append(make_block([overspending], len(chain), chain[-1].hashcode))
+    assert blockchain_1.is_chain_valid(chain)
+    assert not blockchain_2.replace_chain(chain)
+    
+def test_disconnect_and_connect_blocks():
+    blockchain = Blockchain(KEYS['public_key_string'])
+    blockchain.Block.difficulty = 1
+    for _ in range(3):
+        blockchain.create_block(make_transaction_list(1))
+    balance = blockchain.get_balance_of(OTHER_KEYS['public_key_string'])
+    columns = blockchain.get_transaction_columns()
+    
+    tip = blockchain.get_last_block()
+    assert tip.hashcode in blockchain.undo_records
+    assert blockchain.disconnect_block() is tip
+    assert tip.hashcode not in blockchain.undo_records
+    assert blockchain.chain_length == 3
+    assert not blockchain.is_transaction_in_chain(tip.transactions[0].txid)
+    assert (blockchain.get_balance_of(OTHER_KEYS['public_key_string']) == 
+            balance - 100)
+    assert blockchain.transaction_index.is_synced_with(blockchain.chain)
+    assert blockchain.balance_index.is_synced_with(blockchain.chain)
+    assert len(columns) == 3 and columns.block_count == 3
+    
+    #  without an undo record the deltas are recomputed from the block
+    blockchain.undo_records.clear()
+    blockchain.disconnect_block()
+    assert (blockchain.get_balance_of(OTHER_KEYS['public_key_string']) == 
+            balance - 200)
+    
+    blockchain.connect_block(tip.__class__(2, make_transaction_list(1), 
+                                           blockchain.get_last_block().hashcode,
+                                           KEYS['public_key_string']))
+    assert (blockchain.get_balance_of(OTHER_KEYS['public_key_string']) == 
+            balance - 100)
+    assert blockchain.is_chain_valid()
+    assert blockchain.get_transaction_columns().get_balances() == {
+        address: blockchain.get_balance_of(address) 
+        for address in blockchain.balance_index.balances 
+        if blockchain.get_balance_of(address)}
+    
+def test_create_block_waits_for_reorganization():
+    blockchain_1 = Blockchain(KEYS['public_key_string'])
+    blockchain_1.Block.difficulty = 1
+    blockchain_2 = copy.deepcopy(blockchain_1)
+    for _ in range(2):
+        blockchain_2.create_block(make_transaction_list(1))
+        
+    mining, mined = threading.Event(), threading.Event()
+    proof_of_work = Blockchain.Block.proof_of_work
+    
+    def slow_proof_of_work(block, mining_engine=None):
+        mining.set()
+        mined.wait(5)
+        return proof_of_work(block, mining_engine)
+    
+    results = []
+    with mock.patch.object(Blockchain.Block, 'proof_of_work', 
+                           slow_proof_of_work):
+        create_thread = threading.Thread(
+            target=lambda: results.append(
+                blockchain_1.create_block(make_transaction_list(1))))
+        create_thread.start()
+        assert mining.wait(5)
+        
+        #  the mined block can't be appended while a reorganization holds
+        #  the chain, and is discarded once the tip moved
+        with blockchain_1._chain_lock:
+            mined.set()
+            time.sleep(0.2)
+            assert blockchain_1.chain_length == 1
+            assert blockchain_1.replace_chain(blockchain_2.get_chain())
+        create_thread.join()
+        
+    assert results == [[]]
+    assert blockchain_1.chain == blockchain_2.chain
+    assert blockchain_1.is_chain_valid()
@@ -1,5 +1,8 @@
+import mock
+import os
 import pytest
 
+from akoin_blockchain import key_master
 from akoin_blockchain.key_master import KeyMaster
 from akoin_blockchain.helper_functions import generate_random_string
   
@@ -49,4 +52,45 @@ def test_signature_from_string():
 def test_is_public_key_string_valid():
     keys = KeyMaster.generate_keys()
     assert KeyMaster.is_public_key_string_valid(keys['public_key_string'])
-    assert not KeyMaster.is_public_key_string_valid(generate_random_string())
\ No newline at end of file
+    assert not KeyMaster.is_public_key_string_valid(generate_random_string())
+
+def test_verify_batch():
+    keys = KeyMaster.generate_keys()
+    other_keys = KeyMaster.generate_keys()
+    messages = [generate_random_string() for _ in range(6)]
+    items = [(rs, KeyMaster.sign(rs, keys['private_key']), 
+              keys['public_key_string']) for rs in messages]
+    items[2] = (messages[2], items[2][1], other_keys['public_key_string'])
+    items[4] = (messages[4], None, keys['public_key_string'])
+    expected = [True, True, False, True, False, True]
+    
+    assert KeyMaster.verify_batch(items, min_parallel_size=1) == expected
+    assert KeyMaster.verify_batch(items) == expected  # cached this time
+    
+    #  batches the pool doesn't verify in time are verified in process
+    KeyMaster.clear_caches()
+    with mock.patch.object(key_master, 'VERIFY_TIMEOUT', 0):
+        assert KeyMaster.verify_batch(items, min_parallel_size=1) == expected
+    assert (KeyMaster.public_key_from_string(keys['public_key_string']) is
+            KeyMaster.public_key_from_string(keys['public_key_string']))
+    
+def test_load_or_generate_keys(tmp_path):
+    path = str(tmp_path / 'node_key.pem')
+    keys = KeyMaster.load_or_generate_keys(path)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert (KeyMaster.load_or_generate_keys(path)['public_key_string'] ==
+            keys['public_key_string'])
+    
+def test_public_key_cache_eviction():
+    keys = [KeyMaster.generate_keys()['public_key_string'] for _ in range(3)]
+    KeyMaster.clear_caches()
+    with mock.patch('akoin_blockchain.key_master.PUBLIC_KEY_CACHE_SIZE', 2):
+        first = KeyMaster.public_key_from_string(keys[0])
+        KeyMaster.public_key_from_string(keys[1])
+        assert KeyMaster.public_key_from_string(keys[0]) is first
+        KeyMaster.public_key_from_string(keys[2])
+        
+    #  the least recently used key went, not the first one cached
+    assert list(key_master._public_key_cache) == [keys[0], keys[2]]
+    assert KeyMaster.public_key_from_string(keys[0]) is first
+    KeyMaster.clear_caches()
@@ -0,0 +1,59 @@
+from akoin_blockchain.key_master import KeyMaster
+from akoin_blockchain.mempool import Mempool
+from akoin_blockchain.transaction import Transaction
+
+KEYS = KeyMaster.generate_keys()
+OTHER_KEYS = KeyMaster.generate_keys()
+
+
+def make_signed_transaction(fee: int, keys=KEYS, timestamp=None) -> Transaction:
+    t = Transaction(keys['public_key_string'], '000', 10, fee, timestamp)
+    t.add_signature(KeyMaster.sign(t.serialized, keys['private_key']))
+    return t
+
+def test_mempool_fee_order():
+    mempool = Mempool()
+    transactions = [make_signed_transaction(fee) for fee in [5, 1, 9, 3, 7]]
+    other = make_signed_transaction(4, OTHER_KEYS)
+    for t in transactions + [other]:
+        assert mempool.add(t)
+    assert not mempool.add(transactions[0])
+
+    assert len(mempool) == 6
+    assert transactions[0].as_json() in mempool
+    assert [t.fee for t in mempool.top(3)] == [9, 7, 5]
+    assert mempool.get_by_sender(OTHER_KEYS['public_key_string']) == [other]
+
+    mempool.remove_transactions([transactions[2], other])
+    assert [t.fee for t in mempool.iter_by_fee()] == [7, 5, 3, 1]
+    assert other.as_json() not in mempool
+    assert mempool.get_by_sender(OTHER_KEYS['public_key_string']) == []
+
+    mempool.compact()
+    assert len(mempool.fee_heap) == 4
+    assert [t.fee for t in mempool.top(10)] == [7, 5, 3, 1]
+
+def test_mempool_eviction():
+    mempool = Mempool(max_size=3)
+    transactions = [make_signed_transaction(fee) for fee in [5, 2, 8]]
+    for t in transactions:
+        assert mempool.add(t)
+
+    assert not mempool.add(make_signed_transaction(1))
+    assert mempool.add(make_signed_transaction(6))
+    assert len(mempool) == 3
+    assert transactions[1].txid not in mempool
+    assert [t.fee for t in mempool.top(3)] == [8, 6, 5]
+
+def test_mempool_expiry():
+    mempool = Mempool()
+    transactions = [make_signed_transaction(fee, timestamp=1000 + i) 
+                    for i, fee in enumerate([1, 2, 3])]
+    for t in transactions:
+        mempool.add(t)
+    mempool.remove(transactions[0].txid)
+
+    assert mempool.expire(1000) == []
+    assert mempool.expire(1002) == [transactions[1]]
+    assert len(mempool) == 1 and transactions[2] in mempool
+    assert mempool.expiry_heap == [(1002, transactions[2].txid)]
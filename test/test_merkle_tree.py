@@ -5,7 +5,7 @@ from hashlib import sha256
 from random import randint
 from typing import List
 
-from akoin_blockchain.aux_data_structures import MerkleTree
+from akoin_blockchain.aux_data_structures import CompactMerkleTree, MerkleTree
 
 def get_merkle_tree(leaf_amount: int) -> List[list]:
     return MerkleTree.make_tree(list(range(leaf_amount)))
@@ -63,4 +63,31 @@ def test_leaf_validation():
         is_valid = MerkleTree.validate_leaf_hash(leaf_hash, 
                                                  bad_idx, 
                                                  copy(proof_list))
-        assert not is_valid
\ No newline at end of file
+        assert not is_valid
+
+def test_compact_tree():
+    leaf_lengths = [1, 2, 10, 16, 150, randint(1, 1000)]
+    for leaf_length in leaf_lengths:
+        leafs = [sha256(str(i).encode('utf-8')).digest() 
+                 for i in range(leaf_length)]
+        tree = CompactMerkleTree(leafs)
+        incremental_tree = CompactMerkleTree()
+        for leaf in leafs:
+            incremental_tree.append(leaf)
+            
+        assert incremental_tree.levels == tree.levels
+        assert len(tree.levels) == len(get_merkle_tree(leaf_length))
+        assert tree.root == CompactMerkleTree.compute_root(leafs)
+        assert len(tree.root) == 32
+        
+        leaf_index = randint(0, leaf_length - 1)
+        proof = tree.get_proof(leaf_index)
+        assert CompactMerkleTree.verify_proof(leafs[leaf_index], leaf_index, 
+                                              proof, tree.root)
+        assert not CompactMerkleTree.verify_proof(sha256(b'not a leaf').digest(), 
+                                                  leaf_index, proof, tree.root)
+        
+        proof_list = tree.get_proof_list(leaf_index)
+        assert proof_list[-1] == tree.root.hex().encode('utf-8')
+        assert CompactMerkleTree.validate_leaf_hash(
+            leafs[leaf_index].hex().encode('utf-8'), leaf_index, proof_list)
@@ -0,0 +1,79 @@
+import urllib.request
+
+from akoin_blockchain.metrics import (MetricsRegistry, MetricsServer,
+                                      REQUEST_SECONDS, REQUEST_ERRORS,
+                                      HASHES)
+from akoin_blockchain.node import Node
+from akoin_blockchain.request_handler import RequestHandler
+
+from akoin_blockchain.constants import (INITIAL_WEB_ADDRESS, LOCAL_HOST,
+                                        METRICS_PATH)
+
+TRANSACTION_DATA = {'receiver_address': '000','amount': 10, 'fee': 10}
+
+def test_registry_collects_and_formats():
+    registry = MetricsRegistry()
+    counter = registry.counter('requests_total', 'Requests', ('path',))
+    gauge = registry.gauge('queue_size', 'Queue size')
+    histogram = registry.histogram('latency_seconds', 'Latency', ('path',),
+                                   buckets=(0.1, 1))
+    counter.inc(labels=('mine',))
+    counter.inc(2, ('mine',))
+    gauge.set(7)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, ('get_chain',))
+    with histogram.time(('get_chain',)):
+        pass
+
+    metrics = registry.collect()
+    assert metrics['requests_total']['values'] == [
+        {'labels': {'path': 'mine'}, 'value': 3}]
+    latency = metrics['latency_seconds']['values'][0]
+    assert latency['buckets'] == {'0.1': 2, '1': 3, '+Inf': 4}
+    assert latency['count'] == 4
+
+    text = registry.as_prometheus()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{path="mine"} 3' in text
+    assert 'queue_size 7' in text
+    assert 'latency_seconds_bucket{path="get_chain",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{path="get_chain"} 4' in text
+
+def test_get_metrics():
+    node = Node(INITIAL_WEB_ADDRESS)
+    node.blockchain.Block.difficulty = 1
+    requests = REQUEST_SECONDS.get_count(('mine',))
+    errors = REQUEST_ERRORS.get(('unknown',))
+    hashes = HASHES.get()
+
+    node.create_signed_transaction(**TRANSACTION_DATA)
+    RequestHandler.handle_request(node, {'path': 'mine', 'data': None})
+    RequestHandler.handle_request(node, {'path': 'no_such_path', 'data': None})
+    assert REQUEST_SECONDS.get_count(('mine',)) == requests + 1
+    assert REQUEST_ERRORS.get(('unknown',)) == errors + 1
+    assert HASHES.get() > hashes
+
+    res = RequestHandler.handle_request(node, {'path': 'get_metrics',
+                                               'data': None})
+    assert res['success']
+    metrics = res['metrics']
+    assert metrics['akoin_chain_length']['values'][0]['value'] == 2
+    assert metrics['akoin_mempool_transactions']['values'][0]['value'] == 0
+    assert metrics['akoin_validation_seconds']['type'] == 'histogram'
+    node.close()
+
+def test_metrics_server():
+    node = Node(INITIAL_WEB_ADDRESS)
+    metrics_server = MetricsServer(LOCAL_HOST, 0, node.update_metrics)
+    metrics_server.start()
+    try:
+        host, port = metrics_server.address
+        with urllib.request.urlopen(f'http://{host}:{port}{METRICS_PATH}',
+                                    timeout=5) as res:
+            text = res.read().decode()
+        assert res.status == 200
+        assert '# TYPE akoin_request_seconds histogram' in text
+        assert 'akoin_chain_length 1' in text
+    finally:
+        metrics_server.close()
+        node.close()
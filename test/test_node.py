@@ -1,10 +1,16 @@
+import copy
 import datetime
+import pytest
+import socket
+import threading
 
 from freezegun import freeze_time
 from typing import List
 
 from akoin_blockchain.blockchain import Blockchain
 from akoin_blockchain.node import Node
+from akoin_blockchain.request_handler import RequestHandler
+from akoin_blockchain.wire_protocol import FrameReader, WireProtocol
 
 from akoin_blockchain.constants import (INITIAL_CURRENCY_SUPPLY, 
                                         INITIAL_WEB_ADDRESS,
@@ -90,4 +96,139 @@ def test_expired_transaction_removal():
         node.cleanup_transactions()
         assert len(node.transactions) == 0
         assert len(node.mempool) == 0
-    
\ No newline at end of file
+            
+def connect_nodes(node, peer_node, peer):
+    client, server = socket.socketpair()
+    
+    def serve():
+        frame_reader = FrameReader()
+        try:
+            request, version = frame_reader.read_message(server)
+            while request is not None:
+                requests.append(request['path'])
+                response = RequestHandler.handle_request(peer_node, request)
+                WireProtocol.send_message(server, response, version)
+                request, version = frame_reader.read_message(server)
+        except OSError:
+            pass
+        
+    requests = []
+    threading.Thread(target=serve, daemon=True).start()
+    node.network_manager.add_peer_socket(peer, client)
+    return requests
+    
+def mine_blocks(node: Node, n: int):
+    node.blockchain.Block.difficulty = 1
+    for _ in range(n):
+        node.create_signed_transaction('000', 10, 1)
+        node.mine_new_block()
+    
+def test_header_sync():
+    node_1 = Node(INITIAL_WEB_ADDRESS)
+    mine_blocks(node_1, 2)
+    node_2 = copy.deepcopy(node_1)
+    node_2.web_address = 'http://127.0.0.1:1'
+    mine_blocks(node_1, 3)
+    mine_blocks(node_2, 1)
+    
+    requests = connect_nodes(node_2, node_1, '127.0.0.1:1620')
+    assert node_2.sync_with_peer(INITIAL_WEB_ADDRESS)
+    assert requests == ['negotiate_protocol', 'get_headers', 'get_blocks']
+    
+    assert node_2.blockchain.chain_length == node_1.blockchain.chain_length
+    for block, peer_block in zip(node_2.blockchain.chain, node_1.blockchain.chain):
+        assert block.hashcode == peer_block.hashcode
+    assert node_2.account.chain is node_2.blockchain.chain
+    assert (node_2.blockchain.get_balance_of(node_1.blockchain_address) == 
+            node_1.blockchain.get_balance_of(node_1.blockchain_address))
+    
+    #  only the blocks after the fork were requested
+    headers = node_1.blockchain.get_headers(
+        [node_1.blockchain.chain[2].hashcode], 10)
+    assert [h['index'] for h in headers] == [3, 4, 5]
+    
+    assert not node_2.sync_with_peer(INITIAL_WEB_ADDRESS)
+        
+def test_reorg_returns_transactions_to_mempool():
+    node_1 = Node(INITIAL_WEB_ADDRESS)
+    mine_blocks(node_1, 1)
+    node_2 = copy.deepcopy(node_1)
+    
+    orphaned = node_2.create_signed_transaction('111', 10, 1)
+    shared = node_2.create_signed_transaction('222', 10, 1)
+    node_2.mine_new_block()
+    assert len(node_2.mempool) == 0
+    
+    node_1.add_transaction(shared.as_json())
+    mine_blocks(node_1, 2)
+    assert node_2.replace_chain(node_1.blockchain.get_chain())
+    
+    assert orphaned in node_2.mempool
+    assert shared not in node_2.mempool
+    assert len(node_2.mempool) == 1
+    assert node_2.account.chain is node_2.blockchain.chain
+    
+def test_transaction_inventory_relay():
+    node_1 = Node(INITIAL_WEB_ADDRESS)
+    node_2 = copy.deepcopy(node_1)
+    known = node_1.create_signed_transaction('000', 10, 1)
+    assert node_2.add_transaction(known.as_json())
+    
+    requests = connect_nodes(node_1, node_2, '127.0.0.1:1')
+    new = node_1.create_signed_transaction('111', 10, 1)
+    node_1.queue_inventory([known.txid, new.txid])
+    assert node_1.inventory_timer is not None
+    node_1.inventory_timer.join()
+    
+    #  only the transaction the peer didn't know was sent
+    assert requests == ['negotiate_protocol', 'announce_transactions', 
+                        'register_new_transactions']
+    assert new in node_2.mempool and len(node_2.mempool) == 2
+    assert node_2.on_transactions_announced([known.txid, new.txid]) == []
+    
+    node_1.transmit_transactions()
+    assert requests[3:] == ['announce_transactions']
+    node_1.network_manager.close()
+    
+def test_receive_transaction_batch():
+    node_1 = Node(INITIAL_WEB_ADDRESS)
+    node_2 = copy.deepcopy(node_1)
+    transactions = [node_1.create_signed_transaction('000', 10, fee) 
+                    for fee in range(5)]
+    json_transactions = [t.as_json() for t in transactions]
+    
+    bad_transaction = transactions[0].replace(amount=transactions[0].amount + 1)
+    with pytest.raises(Exception):
+        node_2.receive_transactions(json_transactions + 
+                                    [bad_transaction.as_json()])
+    assert node_2.mempool == node_1.mempool
+    
+    with freeze_time('2222-10-06'):
+        node_2.receive_transactions(json_transactions)
+        assert len(node_2.mempool) == 0
+        
+def test_tip_announcements_share_one_sync_worker():
+    node_1 = Node(INITIAL_WEB_ADDRESS)
+    node_2 = copy.deepcopy(node_1)
+    assert node_2._sync_lock is not node_1._sync_lock
+    
+    release = threading.Event()
+    synced = []
+    
+    def sync_with_peer(web_address):
+        synced.append(web_address)
+        release.wait(5)
+        
+    node_1.sync_with_peer = sync_with_peer
+    peers = [f'http://127.0.0.1:{port}' for port in range(1700, 1703)]
+    for height in range(2, 6):
+        for peer in peers:
+            assert node_1.on_tip_announced({'height': height, 
+                                            'web_address': peer})
+    assert [t.name for t in threading.enumerate()].count('sync') == 1
+    
+    worker = node_1._sync_worker
+    release.set()
+    worker.join(5)
+    assert node_1._sync_worker is None and not node_1.pending_tips
+    assert set(synced) == set(peers) and len(synced) <= len(peers) + 1
@@ -1,4 +1,5 @@
 import copy
+import mock
 
 from akoin_blockchain.key_master import KeyMaster
 from akoin_blockchain.node import Node
@@ -155,10 +156,33 @@ def test_register_new_transactions():
     res = RequestHandler.handle_request(node, req)
     validate_response(res, 'message')
     
-    bad_transaction = good_transaction
-    bad_transaction.amount += 1
+    bad_transaction = good_transaction.replace(amount=good_transaction.amount + 1)
     req = {'path': 'register_new_transactions', 
            'data': [bad_transaction.as_json()]}
     res = RequestHandler.handle_request(node, req)
     assert not res['success']
-    
\ No newline at end of file
+        
+def test_get_transaction():
+    node = Node(INITIAL_WEB_ADDRESS)
+    add_block_to_node(node)
+    t = node.blockchain.chain[-1].transactions[0]
+    req = {'path': 'get_transaction', 'data': {'txid': t.txid}}
+    res = RequestHandler.handle_request(node, req)
+    validate_response(res, 'transaction')
+    assert res['transaction'] == t.as_json()
+    assert (res['height'], res['position']) == (1, 0)
+    
+    req = {'path': 'get_transaction', 'data': {'txid': '0' * 64}}
+    assert not RequestHandler.handle_request(node, req)['success']
+    
+def test_unknown_path():
+    node = Node(INITIAL_WEB_ADDRESS)
+    req = {'path': 'no_such_path', 'data': {'secret': 'not echoed'}}
+    res = RequestHandler.handle_request(node, req)
+    assert res == {'message': 'unknown request path no_such_path'}
+    
+    #  an AttributeError raised by a handler isn't an unknown path
+    with mock.patch.object(node, 'get_tip', side_effect=AttributeError('tip')):
+        res = RequestHandler.handle_request(node, {'path': 'get_tip', 
+                                                   'data': None})
+    assert res == {'message': 'Internal Error: tip'}
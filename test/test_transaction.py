@@ -1,4 +1,6 @@
 import copy
+import json
+import pickle
 import pytest
 import time
 
@@ -74,4 +76,44 @@ def test_full_json_serialization():
     assert KeyMaster.is_verified(from_json_t.serialized, 
                                  from_json_t.signature, 
                                  from_json_t.sender)
-        
\ No newline at end of file
+            
+def test_cached_serialization():
+    t = make_unsigned_transaction()
+    t.add_signature(KeyMaster.sign(t.serialized, KEYS['private_key']))
+    txid = t.txid
+    assert t.serialized is t.serialized
+    assert not hasattr(t, '__dict__')
+    
+    t_copy = pickle.loads(pickle.dumps(t))
+    assert t_copy == t and hash(t_copy) == hash(t)
+    assert len({t, t_copy, copy.deepcopy(t)}) == 1
+    
+    with pytest.raises(AttributeError):
+        t_copy.amount += 1
+    t_changed = t.replace(amount=t.amount + 1)
+    assert t_changed.txid != txid and t.txid == txid
+    assert json.loads(t_changed.serialized)['amount'] == t.amount + 1
+    assert t_changed != t and t_changed.signature is t.signature
+    
+#  Transaction('0000', '0000', 100, 5, 1.0) pickled before slots
+LEGACY_PICKLE = (b'\x80\x04\x95}\x00\x00\x00\x00\x00\x00\x00\x8c\x1cakoin_blockchain.'
+                 b'transaction\x94\x8c\x0bTransaction\x94\x93\x94)\x81\x94}\x94(\x8c'
+                 b'\x03fee\x94K\x05\x8c\x06sender\x94\x8c\x040000\x94\x8c\x08receiver'
+                 b'\x94h\x07\x8c\x06amount\x94Kd\x8c\ttimestamp\x94G?\xf0\x00\x00\x00'
+                 b'\x00\x00\x00ub.')
+    
+def test_legacy_pickle():
+    legacy_t = pickle.loads(LEGACY_PICKLE)
+    t = Transaction(**TRANSACTION_TEMPLATE, timestamp=1.0)
+    assert legacy_t == t and legacy_t.serialized == t.serialized
+    with pytest.raises(AttributeError):
+        legacy_t.fee = 0
+    
+    
+    t = make_unsigned_transaction()
+    t.add_signature(KeyMaster.sign(t.serialized, KEYS['private_key']))
+    #  and peers still on the dict state can load new pickles
+    state = pickle.loads(pickle.dumps(t)).__getstate__()
+    assert sorted(state) == ['amount', 'fee', 'receiver', 'sender', 
+                             'signature', 'timestamp']
+    assert state['signature']._toString() == t.signature._toString()